@@ -0,0 +1,355 @@
+"""Versioned JSON API (/api/v1) over the same models as the HTML pages.
+
+Every read answers conditional GETs with an ETag built from cheap index-only
+aggregates (newest created_at / edit timestamp, approval timestamps, counts),
+so an unchanged resource returns 304 before any row data is read. There is
+no Last-Modified: HTTP dates have whole-second resolution, so a change later
+in the same second as a client's copy would be answered 304. Amounts are
+serialized as strings ("1234.50") to keep them exact.
+"""
+import hashlib
+from datetime import date, datetime
+from functools import wraps
+
+from dateutil.relativedelta import relativedelta
+from flask import Blueprint, Response, abort, jsonify, request
+from flask_login import current_user
+from sqlalchemy import func, tuple_
+from sqlalchemy.orm import aliased, joinedload
+
+from models import db, User, ExpenseRequest, LedgerEntry, LedgerDailyBalance, Budget
+import ledger_book
+import budgets
+import user_cache
+import fragment_cache
+import login_throttle
+import passwords
+import metrics
+import tenants
+from money import ZERO
+
+api_bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+def api_login_required(*roles):
+    """Like login_required, but answers 401/403 JSON instead of redirecting to the login page."""
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            if not current_user.is_authenticated:
+                return jsonify(error='authentication required'), 401
+            if roles and current_user.role not in roles:
+                return jsonify(error='forbidden'), 403
+            return view(*args, **kwargs)
+        return wrapped
+    return decorator
+
+
+def conditional_json(validators, build):
+    """Return 304 if the client's copy is current, else jsonify(build()) with validators attached.
+
+    `validators` is any repr-able value that changes whenever the data does;
+    `build` is only called when the body is actually needed.
+    """
+    # The representation depends on the query string and on who is asking
+    key = repr((request.full_path, current_user.id, validators)).encode('utf-8')
+    etag = hashlib.sha1(key).hexdigest()
+    not_modified = request.if_none_match.contains(etag)
+
+    response = Response(status=304) if not_modified else jsonify(build())
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def _money(value):
+    return None if value is None else str(value)
+
+
+def _ledger_type_or_404(type):
+    if type not in ledger_book.LEDGER_TYPES:
+        abort(404)
+    return ledger_book.LEDGER_TYPES[type]
+
+
+def _date_arg(name, default):
+    value = request.args.get(name)
+    if not value:
+        return default
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        abort(400)
+
+
+def _request_json(req):
+    return {
+        'id': req.id,
+        'date': req.date.isoformat(),
+        'amount': _money(req.amount),
+        'description': req.description,
+        'account_type': req.account_type,
+        'category': req.category,
+        'status': req.status,
+        'requester': req.requester.name or req.requester.username,
+        'finance_approved_at': req.finance_approved_at.isoformat() if req.finance_approved_at else None,
+        'director_approved_at': req.director_approved_at.isoformat() if req.director_approved_at else None,
+        'ledger_entry_id': req.ledger_entry.id if req.ledger_entry else None,
+    }
+
+
+def _request_validators(query):
+    """count / newest id / newest approval over a filtered ExpenseRequest query."""
+    count, max_id, finance_at, director_at = query.with_entities(
+        func.count(ExpenseRequest.id),
+        func.max(ExpenseRequest.id),
+        func.max(ExpenseRequest.finance_approved_at),
+        func.max(ExpenseRequest.director_approved_at)
+    ).one()
+    return count, max_id, finance_at, director_at
+
+
+# --- Ledgers ---
+
+@api_bp.route('/ledgers/<type>/entries')
+@api_login_required('finance', 'director')
+def ledger_entries(type):
+    ledger_type = _ledger_type_or_404(type)
+    today = date.today()
+    start = _date_arg('start', today.replace(month=1, day=1))
+    end = _date_arg('end', today)
+    limit = max(1, min(request.args.get('limit', DEFAULT_LIMIT, type=int), MAX_LIMIT))
+    after = ledger_book.parse_cursor(request.args.get('after'))
+
+    def build():
+        requester = aliased(User)
+        creator = aliased(User)
+        range_start = max(start, after[0]) if after else start
+        query = db.session.query(
+            LedgerEntry.id, LedgerEntry.date, LedgerEntry.category, LedgerEntry.transaction_type,
+            LedgerEntry.amount, LedgerEntry.description, LedgerEntry.note, LedgerEntry.expense_request_id,
+            requester.name, requester.username, creator.name, creator.username
+        ).outerjoin(
+            ExpenseRequest, LedgerEntry.expense_request_id == ExpenseRequest.id
+        ).outerjoin(
+            requester, ExpenseRequest.requester_id == requester.id
+        ).outerjoin(
+            creator, LedgerEntry.created_by_id == creator.id
+        ).filter(
+            LedgerEntry.ledger_type == ledger_type,
+            LedgerEntry.date >= range_start,
+            LedgerEntry.date <= end
+        )
+        if after:
+            query = query.filter(tuple_(LedgerEntry.date, LedgerEntry.id) > after)
+        rows = query.order_by(LedgerEntry.date, LedgerEntry.id).limit(limit + 1).all()
+
+        entries = []
+        for row in rows[:limit]:
+            if row.expense_request_id is not None:
+                created_by = row[8] or row[9]
+            else:
+                created_by = row[10] or row[11]
+            entries.append({
+                'id': row.id,
+                'date': row.date.isoformat(),
+                'category': row.category,
+                'transaction_type': row.transaction_type,
+                'amount': _money(row.amount),
+                'description': row.description,
+                'note': row.note,
+                'expense_request_id': row.expense_request_id,
+                'created_by': created_by,
+            })
+        next_cursor = ledger_book.make_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return {'ledger': type, 'start': start.isoformat(), 'end': end.isoformat(),
+                'entries': entries, 'next_cursor': next_cursor}
+
+    # start/end are part of the validators because their defaults move with the calendar
+    return conditional_json((ledger_book.ledger_version(ledger_type), start, end), build)
+
+
+@api_bp.route('/ledgers/<type>/balance')
+@api_login_required('finance', 'director')
+def ledger_balance(type):
+    ledger_type = _ledger_type_or_404(type)
+    today = date.today()
+    start = _date_arg('start', today.replace(month=1, day=1))
+    end = _date_arg('end', today)
+
+    def build():
+        month_start = today.replace(day=1)
+        month_end = month_start + relativedelta(months=1) - relativedelta(days=1)
+        income, expense = ledger_book.period_totals(ledger_type, start, end)
+        month_income, month_expense = ledger_book.period_totals(ledger_type, month_start, month_end)
+        return {
+            'ledger': type,
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'income': _money(income),
+            'expense': _money(expense),
+            'balance': _money(income - expense),
+            'month': {'income': _money(month_income), 'expense': _money(month_expense)},
+        }
+
+    return conditional_json((ledger_book.ledger_version(ledger_type), start, end, today), build)
+
+
+@api_bp.route('/balances')
+@api_login_required('finance', 'director')
+def balances():
+    """All three ledgers' balances for a range from one grouped query."""
+    today = date.today()
+    start = _date_arg('start', today.replace(month=1, day=1))
+    end = _date_arg('end', today)
+
+    def build():
+        rows = db.session.query(
+            LedgerDailyBalance.ledger_type,
+            func.sum(LedgerDailyBalance.income),
+            func.sum(LedgerDailyBalance.expense)
+        ).filter(
+            LedgerDailyBalance.date >= start,
+            LedgerDailyBalance.date <= end
+        ).group_by(LedgerDailyBalance.ledger_type).all()
+        found = {ledger_type: (income, expense) for ledger_type, income, expense in rows}
+        result = {}
+        for url_type, ledger_type in ledger_book.LEDGER_TYPES.items():
+            income, expense = found.get(ledger_type, (None, None))
+            income = income if income is not None else ZERO
+            expense = expense if expense is not None else ZERO
+            result[url_type] = {'income': _money(income), 'expense': _money(expense),
+                                'balance': _money(income - expense)}
+        return {'start': start.isoformat(), 'end': end.isoformat(), 'ledgers': result}
+
+    version = ledger_book.ledger_version()
+    return conditional_json((*version, start, end), build)
+
+
+@api_bp.route('/budgets')
+@api_login_required('finance', 'director')
+def budget_utilisation():
+    """Allocation vs spend per category of every ledger for ?fiscal_year= (default: the current one)."""
+    fiscal_year = request.args.get('fiscal_year', type=int) or ledger_book.fiscal_year_label(date.today())
+
+    def build():
+        return {
+            'fiscal_year': fiscal_year,
+            'ledgers': {
+                type: [dict(row, budget=_money(row['budget']), income=_money(row['income']),
+                            expense=_money(row['expense']), remaining=_money(row['remaining']),
+                            percent=float(row['percent']) if row['percent'] is not None else None)
+                       for row in rows]
+                for type, rows in budgets.utilisation(fiscal_year).items()
+            },
+        }
+
+    version = ledger_book.ledger_version()
+    budget_count, budget_updated = db.session.query(func.count(Budget.id), func.max(Budget.updated_at)).one()
+    return conditional_json((*version, budget_count, budget_updated, fiscal_year), build)
+
+
+# --- Requests and approvals ---
+
+@api_bp.route('/approvals/pending')
+@api_login_required('finance', 'director')
+def pending_approvals():
+    query = ExpenseRequest.query.filter(ExpenseRequest.status != 'APPROVED')
+
+    def build():
+        pending = query.options(
+            joinedload(ExpenseRequest.requester),
+            joinedload(ExpenseRequest.ledger_entry)
+        ).order_by(ExpenseRequest.date, ExpenseRequest.id).all()
+        return {'requests': [_request_json(req) for req in pending]}
+
+    return conditional_json(_request_validators(query), build)
+
+
+@api_bp.route('/requests')
+@api_login_required('teacher', 'finance')
+def my_requests():
+    query = ExpenseRequest.query.filter_by(requester_id=current_user.id)
+
+    def build():
+        mine = query.options(
+            joinedload(ExpenseRequest.requester),
+            joinedload(ExpenseRequest.ledger_entry)
+        ).order_by(ExpenseRequest.date.desc()).all()
+        return {'requests': [_request_json(req) for req in mine]}
+
+    return conditional_json(_request_validators(query), build)
+
+
+@api_bp.route('/requests/<int:req_id>')
+@api_login_required()
+def request_status(req_id):
+    requester_id = db.session.query(ExpenseRequest.requester_id).filter_by(id=req_id).scalar()
+    if requester_id is None:
+        return jsonify(error='not found'), 404
+    # Teachers may only look at their own requests
+    if current_user.role == 'teacher' and requester_id != current_user.id:
+        return jsonify(error='forbidden'), 403
+
+    query = ExpenseRequest.query.filter_by(id=req_id)
+    validators = _request_validators(query)
+
+    def build():
+        req = query.options(
+            joinedload(ExpenseRequest.requester),
+            joinedload(ExpenseRequest.ledger_entry)
+        ).one()
+        return _request_json(req)
+
+    return conditional_json(validators, build)
+
+
+# --- Diagnostics ---
+
+@api_bp.route('/stats/user-cache')
+@api_login_required('finance', 'director')
+def user_cache_stats():
+    """Hit/miss counters of the login identity cache in this worker process."""
+    response = jsonify(user_cache.stats())
+    response.cache_control.no_store = True
+    return response
+
+
+@api_bp.route('/stats/fragment-cache')
+@api_login_required('finance', 'director')
+def fragment_cache_stats():
+    """Hit/miss counters and size of the rendered ledger fragment cache in this worker process."""
+    response = jsonify(fragment_cache.stats())
+    response.cache_control.no_store = True
+    return response
+
+
+@api_bp.route('/stats/login')
+@api_login_required('finance', 'director')
+def login_stats():
+    """Password hashing CPU time per login and throttle counters in this worker process."""
+    response = jsonify(hashing=passwords.stats(), throttle=login_throttle.stats())
+    response.cache_control.no_store = True
+    return response
+
+
+@api_bp.route('/stats/school-engines')
+@api_login_required('finance', 'director')
+def school_engine_stats():
+    """Open per-school database engines and LRU counters in this worker process (TENANCY on)."""
+    response = jsonify(tenants.engine_stats())
+    response.cache_control.no_store = True
+    return response
+
+
+@api_bp.route('/stats/slow-requests')
+@api_login_required('finance', 'director')
+def slow_request_stats():
+    """The latest requests slower than SLOW_REQUEST_MS in this worker process, with their SQL breakdown."""
+    response = jsonify(threshold_ms=metrics.slow_threshold_ms(), requests=metrics.slow_requests())
+    response.cache_control.no_store = True
+    return response
@@ -1,29 +1,145 @@
-from flask import Flask, render_template, redirect, url_for, request, flash, send_file, abort
+from flask import Flask, render_template, redirect, url_for, request, flash, send_file, abort, jsonify
+from markupsafe import Markup
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, date
+import click
+from datetime import datetime, date, timedelta
 from dateutil.relativedelta import relativedelta
-import pandas as pd
-import io
+from sqlalchemy import insert, update
+from sqlalchemy.orm import joinedload
 import os
 import secrets
 
-from models import db, User, ExpenseRequest, LedgerEntry, LedgerEntryHistory
+from models import db, School, User, ExpenseRequest, LedgerEntry, LedgerDailyBalance, LedgerCategoryTotal, PeriodClose, Job
+import ledger_book
+import ledger_rows
+from money import ZERO, amount_in_range, format_satang, parse_amount, to_satang
+import schema
+import query_profiler
+import user_cache
+import sqlite_tuning
+import jobs
+import rollups as rollups_module
+import audit
+import fragment_cache
+import passwords
+import login_throttle
+import budgets
+import search
+import periods
+import metrics
+import tenants
+import district
+
+def shared_secret_key(path):
+    """Read the session signing key from `path`, creating it on first use.
+
+    Every worker process reads the same file, so a session cookie signed by
+    one worker is accepted by the others, and logins survive restarts.
+    """
+    try:
+        with open(path) as f:
+            key = f.read().strip()
+        if key:
+            return key
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write a temp file and hard-link it into place: a worker racing us either
+    # wins the link (we read its key) or sees no file yet, never a half-written one
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        f.write(secrets.token_hex(32))
+    try:
+        os.link(tmp, path)
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(tmp)
+    with open(path) as f:
+        return f.read().strip()
 
 app = Flask(__name__)
-# Production: Use environment variable for secret key, fallback to generated key for development
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', secrets.token_hex(32))
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///financial_system.db'
+# Production: set SECRET_KEY in the environment; otherwise a key generated once
+# is kept in instance/secret_key (SECRET_KEY_FILE) and shared by all workers
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY') or shared_secret_key(
+    os.environ.get('SECRET_KEY_FILE', os.path.join(app.instance_path, 'secret_key')))
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URI', 'sqlite:///financial_system.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 # Security: Enable session cookie security in production
 app.config['SESSION_COOKIE_SECURE'] = os.environ.get('PRODUCTION', 'false').lower() == 'true'
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
+# Rows per page on the ledger pages (?per_page= may lower or raise it up to LEDGER_MAX_PAGE_SIZE)
+app.config['LEDGER_PAGE_SIZE'] = int(os.environ.get('LEDGER_PAGE_SIZE', 100))
+app.config['LEDGER_MAX_PAGE_SIZE'] = 1000
+# SQL statement count / DB time headers on every response (always on in debug mode)
+app.config['SQL_PROFILE'] = os.environ.get('SQL_PROFILE', 'false').lower() == 'true'
+# Prometheus metrics on /metrics (localhost only unless METRICS_TOKEN is set, then bearer token)
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN') or None
+# Requests slower than this are logged with their SQL and timing breakdown (0 = off)
+app.config['SLOW_REQUEST_MS'] = int(os.environ.get('SLOW_REQUEST_MS', 1000))
+# Identity cache for the login loader: 'memory' (per process), 'file:<dir>' or 'sqlite:<path>' (shared by workers)
+app.config['USER_CACHE_BACKEND'] = os.environ.get('USER_CACHE_BACKEND', 'memory')
+app.config['USER_CACHE_TTL'] = int(os.environ.get('USER_CACHE_TTL', 300))
+# SQLite: WAL, synchronous=NORMAL, busy timeout and a connection pool (see sqlite_tuning.py)
+app.config['SQLITE_TUNING'] = os.environ.get('SQLITE_TUNING', 'true').lower() == 'true'
+app.config['SQLITE_BUSY_TIMEOUT'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 10000))
+# Background jobs (exports): worker threads per process and where finished files are kept
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+app.config['JOB_ARTIFACT_TTL'] = int(os.environ.get('JOB_ARTIFACT_TTL', 24 * 3600))
+# Audit log: full snapshot of an entry after this many edits (bounds "as of" reconstruction)
+app.config['AUDIT_SNAPSHOT_EVERY'] = int(os.environ.get('AUDIT_SNAPSHOT_EVERY', 10))
+# Rendered ledger cards/tables reused until the ledger changes (see fragment_cache.py)
+app.config['FRAGMENT_CACHE_SIZE'] = int(os.environ.get('FRAGMENT_CACHE_SIZE', 256))
+app.config['FRAGMENT_CACHE_MAX_BYTES'] = int(os.environ.get('FRAGMENT_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+# Werkzeug hash method for passwords; existing hashes are upgraded at each user's next login
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', passwords.DEFAULT_METHOD)
+# Failed logins allowed per username / per IP within the window before attempts are refused
+app.config['LOGIN_THROTTLE_WINDOW'] = int(os.environ.get('LOGIN_THROTTLE_WINDOW', 300))
+app.config['LOGIN_THROTTLE_USER_LIMIT'] = int(os.environ.get('LOGIN_THROTTLE_USER_LIMIT', 5))
+app.config['LOGIN_THROTTLE_IP_LIMIT'] = int(os.environ.get('LOGIN_THROTTLE_IP_LIMIT', 30))
+# Requests/approvals over a category budget or the ledger balance: 'warn', 'block' or 'off'
+app.config['BUDGET_ENFORCEMENT'] = os.environ.get('BUDGET_ENFORCEMENT', 'warn')
+# Name of a new database's school (the School row), shown on every page
+app.config['SCHOOL_NAME'] = os.environ.get('SCHOOL_NAME', 'โรงเรียนบ้านบางน้ำจืด')
+# Several schools on one deployment (see tenants.py): 'off', 'path' (/school/<slug>/) or 'subdomain'
+app.config['TENANCY'] = os.environ.get('TENANCY', 'off')
+app.config['TENANT_DOMAIN'] = os.environ.get('TENANT_DOMAIN', 'localhost')  # <slug>.<TENANT_DOMAIN>
+app.config['TENANT_DB_DIR'] = os.environ.get('TENANT_DB_DIR', os.path.join(app.instance_path, 'schools'))
+app.config['TENANT_ENGINE_CACHE'] = int(os.environ.get('TENANT_ENGINE_CACHE', 16))  # open school databases
+app.config['TENANT'] = os.environ.get('TENANT') or None  # school the CLI commands work on
+# District report (/district/balances): bearer token (else localhost only) and schools read at once
+app.config['DISTRICT_NAME'] = os.environ.get('DISTRICT_NAME', 'สถานศึกษาในสังกัด')
+app.config['DISTRICT_TOKEN'] = os.environ.get('DISTRICT_TOKEN') or None
+app.config['DISTRICT_REPORT_WORKERS'] = int(os.environ.get('DISTRICT_REPORT_WORKERS', 4))
 
+sqlite_tuning.configure(app)
 db.init_app(app)
 login_manager = LoginManager()
 login_manager.login_view = 'login'
 login_manager.init_app(app)
+metrics.init_app(app)  # first: its timer then covers the other modules' request hooks
+tenants.init_app(app)  # before any hook or view that reads the school's database
+district.init_app(app)
+query_profiler.init_app(app)
+user_cache.init_app(app)
+jobs.init_app(app)
+audit.init_app(app)
+fragment_cache.init_app(app)
+passwords.init_app(app)
+login_throttle.init_app(app)
+budgets.init_app(app)
+
+from api import api_bp
+app.register_blueprint(api_bp)
+
+# Thai ledger names for the dashboard rollups
+LEDGER_HEADERS_TH = {
+    'subsidy': 'เงินอุดหนุน',
+    'income': 'เงินรายได้',
+    'lunch': 'เงินอาหารกลางวัน'
+}
 
 # Thai role name mapping
 ROLE_NAMES_TH = {
@@ -38,27 +154,220 @@ def utility_processor():
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # A session started at another school (or at none) is not a login here
+    if not tenants.owns_session():
+        return None
+    # Served from the identity cache; the user table is only read on a miss
+    return user_cache.load(user_id)
 
 # --- Initialization ---
-def init_db():
-    with app.app_context():
-        db.create_all()
-        # Create default users if they don't exist
-        # Create default users if they don't exist
-        if not User.query.filter_by(username='teacher').first():
-            db.session.add(User(username='teacher', name='ครู 01', password_hash=generate_password_hash('pass1234'), role='teacher'))
-            db.session.add(User(username='director', name='ผอ.โรงเรียนบ้านบางน้ำจืด', password_hash=generate_password_hash('pass1234'), role='director'))
-            db.session.add(User(username='finance', name='ครูการเงิน', password_hash=generate_password_hash('pass1234'), role='finance'))
-            db.session.commit()
-            print("Database initialized and default users created.")
+def setup_database(school_name=None, recover_jobs=True, label=''):
+    """Create/upgrade the current school's schema, its School row and default users.
+
+    Runs in an app context bound to one school (tenants.activate); provisioning
+    a new school is this on its empty database file.
+    """
+    db.create_all()
+    # Bring databases created by older versions up to date (indexes, etc.)
+    for change in schema.upgrade_schema():
+        print(f"{label}Schema upgrade: {change}")
+    school = School.query.first()
+    if school is None:
+        db.session.add(School(name=school_name or app.config['SCHOOL_NAME']))
+        db.session.commit()
+    elif school_name and school.name != school_name:
+        school.name = school_name  # provisioned from a copy of another school's database
+        db.session.commit()
+    # Create default users if they don't exist
+    if not User.query.filter_by(username='teacher').first():
+        director_name = f"ผอ.{School.query.first().name}"
+        db.session.add(User(username='teacher', name='ครู 01', password_hash=passwords.hash_password('pass1234'), role='teacher'))
+        db.session.add(User(username='director', name=director_name, password_hash=passwords.hash_password('pass1234'), role='director'))
+        db.session.add(User(username='finance', name='ครูการเงิน', password_hash=passwords.hash_password('pass1234'), role='finance'))
+        db.session.commit()
+        print(f"{label}Database initialized and default users created.")
+    # Backfill the daily/category total tables for databases created before they existed
+    if LedgerEntry.query.first() and not (LedgerDailyBalance.query.first() and LedgerCategoryTotal.query.first()):
+        days = ledger_book.rebuild_balances()
+        print(f"{label}Daily and category total tables rebuilt ({days} days).")
+    # Restart export jobs left queued by a previous run
+    if recover_jobs:
+        requeued = jobs.recover()
+        if requeued:
+            print(f"{label}Re-queued {requeued} background job(s).")
+
+def init_db(recover_jobs=True):
+    """Create/upgrade every school's database. Run once per deployment start.
+
+    serve.py calls it in the launching process before the workers start, with
+    recover_jobs=False: each worker re-queues leftover jobs itself.
+    """
+    for slug in tenants.each_school(app):
+        setup_database(recover_jobs=recover_jobs, label=f"[{slug}] " if slug else '')
+
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    """Apply pending schema upgrades to the existing database."""
+    db.create_all()
+    changes = schema.upgrade_schema()
+    for change in changes:
+        print(change)
+    print("Database schema is up to date.")
+
+@app.cli.command('rebuild-balances')
+def rebuild_balances_command():
+    """Recompute the daily balance and category total tables from all ledger entries."""
+    days = ledger_book.rebuild_balances()
+    print(f"Rebuilt {days} daily balance rows and the category totals.")
+
+@app.cli.command('verify-balances')
+def verify_balances_command():
+    """Check the daily balance and category total tables, and the closed periods, against the ledger entries."""
+    problems = ledger_book.verify_balances()
+    for problem in problems:
+        print(problem)
+    if problems:
+        raise SystemExit(f"{len(problems)} mismatched row(s). Run 'flask rebuild-balances' to fix.")
+    print("Daily balance and category total tables are consistent.")
+    # Frozen month-end closes against the (now verified) daily table
+    problems = periods.verify()
+    for problem in problems:
+        print(problem)
+    if problems:
+        raise SystemExit(f"{len(problems)} closed period(s) do not match the ledger.")
+    print("Closed periods are consistent.")
+
+@app.cli.command('close-period')
+@click.option('--ledger', type=click.Choice(list(ledger_book.LEDGER_TYPES)), required=True)
+@click.option('--month', required=True, help='Last month to close, YYYY-MM; earlier open months are closed too.')
+@click.option('--archive', is_flag=True, help='Also move the closed months\' entries to the archive tables.')
+@click.option('--user', 'username', default='finance', show_default=True, help='Recorded as the closer.')
+def close_period_command(ledger, month, archive, username):
+    """Close a ledger's months up to --month (month-end close)."""
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise SystemExit(f"Unknown user: {username}")
+    try:
+        month = datetime.strptime(month, '%Y-%m').date()
+    except ValueError:
+        raise SystemExit(f"Invalid month: {month} (use YYYY-MM)")
+    ledger_type = ledger_book.LEDGER_TYPES[ledger]
+    through = ledger_book.closed_through(ledger_type)
+    try:
+        # A month closed earlier is only archived
+        if through is None or through < month or not archive:
+            for close in periods.close_through(ledger_type, month, user.id):
+                print(f"Closed {close.month.strftime('%Y-%m')}: opening {close.opening_balance}, "
+                      f"income {close.income}, expense {close.expense}, closing {close.closing_balance}")
+        if archive:
+            print(f"Archived {periods.archive_through(ledger_type, month)} entries.")
+    except periods.PeriodError as e:
+        db.session.rollback()
+        raise SystemExit(str(e))
+    db.session.commit()
+
+@app.cli.command('rebuild-search')
+def rebuild_search_command():
+    """Refill the full-text search indexes from the ledger entries and expense requests."""
+    search.rebuild()
+    print("Search indexes rebuilt.")
+
+@app.cli.command('verify-search')
+def verify_search_command():
+    """Check the full-text search indexes against their tables."""
+    problems = search.verify()
+    for problem in problems:
+        print(problem)
+    if problems:
+        raise SystemExit("Search index is out of date. Run 'flask rebuild-search' to fix.")
+    print("Search indexes are consistent.")
+
+@app.cli.command('compact-audit')
+def compact_audit_command():
+    """Write audit snapshots for entries edited many times since their last one."""
+    written = audit.compact()
+    print(f"Wrote {written} audit snapshot(s).")
+
+@app.cli.command('import-ledger')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--ledger', type=click.Choice(list(ledger_book.LEDGER_TYPES)), required=True)
+@click.option('--user', 'username', default='finance', show_default=True, help='Recorded as the creator of the entries.')
+@click.option('--dry-run', is_flag=True, help='Validate only, write nothing.')
+def import_ledger_command(path, ledger, username, dry_run):
+    """Import ledger entries from an .xlsx or .csv file."""
+    from ledger_import import LedgerImport, LedgerImportError
+
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise SystemExit(f"Unknown user: {username}")
+    importer = LedgerImport(ledger, user.id, dry_run=dry_run, max_errors=10**9)
+    try:
+        with open(path, 'rb') as f:
+            result = importer.run(f, path)
+    except LedgerImportError as e:
+        raise SystemExit(str(e))
+    for row_number, message in result.errors:
+        print(f"row {row_number}: {message}")
+    action = 'would insert' if dry_run else 'inserted'
+    print(f"{result.total} rows read, {result.valid} valid, {result.error_count} rejected, "
+          f"{result.valid if dry_run else result.inserted} {action}.")
+
+@app.cli.command('provision-school')
+@click.argument('slug')
+@click.option('--name', required=True, help='School name shown on every page, e.g. โรงเรียนบ้านบางน้ำจืด.')
+@click.option('--copy-from', type=click.Path(exists=True, dir_okay=False),
+              help='Start from an existing single-school database (e.g. instance/financial_system.db).')
+def provision_school_command(slug, name, copy_from):
+    """Create a school's database (TENANCY on): tables, default users and its name."""
+    import sqlite3
+
+    if app.config['TENANCY'] == 'off':
+        raise SystemExit("Set TENANCY=path or TENANCY=subdomain to host several schools.")
+    try:
+        tenants.create(slug)
+    except tenants.TenantError as e:
+        raise SystemExit(str(e))
+    path = tenants.database_path(slug)
+    try:
+        if copy_from:
+            # The backup API copies a consistent snapshot even while the source is in use (WAL)
+            with sqlite3.connect(copy_from) as source, sqlite3.connect(path) as target:
+                source.backup(target)
+        with app.app_context():
+            tenants.activate(slug)
+            setup_database(school_name=name, recover_jobs=False)
+    except Exception:
+        tenants.dispose_all()
+        os.remove(path)
+        raise
+    print(f"School {slug} provisioned in {path}.")
+
+@app.cli.command('district-report')
+def district_report_command():
+    """Print every school's ledger balances (read in parallel) and the district totals."""
+    if app.config['TENANCY'] == 'off':
+        raise SystemExit("Set TENANCY=path or TENANCY=subdomain to host several schools.")
+    report = district.balances()
+    print(f"{'school':24} " + ' '.join(f'{url_type:>16}' for url_type in ledger_book.LEDGER_TYPES) + f" {'total':>16}")
+    rows = [(school['school'], school.get('ledgers'), school.get('error')) for school in report['schools']]
+    rows.append(('TOTAL', report['totals'], None))
+    for label, ledgers, error in rows:
+        if error:
+            print(f"{label:24} error: {error}")
+            continue
+        balances = [ledgers[url_type]['balance'] for url_type in ledger_book.LEDGER_TYPES]
+        print(f"{label:24} " + ' '.join(f'{value:16,.2f}' for value in balances) + f" {sum(balances, ZERO):16,.2f}")
 
 # --- Routes ---
 
 @app.route('/')
 def index():
     if current_user.is_authenticated:
-        return render_template('dashboard.html')
+        # School-wide totals only for the roles that can see the ledgers
+        rollups = None
+        if current_user.role in ['finance', 'director']:
+            rollups = rollups_module.dashboard_rollups()
+        return render_template('dashboard.html', rollups=rollups, ledger_headers=LEDGER_HEADERS_TH)
     return redirect(url_for('login'))
 
 @app.route('/register', methods=['GET', 'POST'])
@@ -85,7 +394,7 @@ def register():
             username=username,
             name=name,
             role=role,
-            password_hash=generate_password_hash(password)
+            password_hash=passwords.hash_password(password)
         )
         db.session.add(new_user)
         db.session.commit()
@@ -99,13 +408,29 @@ def register():
 def login():
     if request.method == 'POST':
         username = request.form.get('username')
-        password = request.form.get('password')
+        password = request.form.get('password', '')
+        # Refuse a throttled username/IP before any password hashing
+        wait = login_throttle.retry_after(username, request.remote_addr)
+        if wait:
+            flash(f'เข้าสู่ระบบผิดพลาดหลายครั้งเกินไป กรุณารอ {wait} วินาทีแล้วลองใหม่', 'danger')
+            response = app.make_response((render_template('login.html'), 429))
+            response.headers['Retry-After'] = str(wait)
+            return response
+
         user = User.query.filter_by(username=username).first()
-        
-        if user and check_password_hash(user.password_hash, password):
+        ok, new_hash = passwords.verify(user.password_hash, password) if user else (False, None)
+        if ok:
+            if new_hash:
+                # Hash made with an older PASSWORD_HASH_METHOD: store the new one in a short
+                # write of its own, not on top of the read snapshot taken before hashing
+                db.session.rollback()
+                db.session.execute(update(User).where(User.id == user.id).values(password_hash=new_hash))
+                db.session.commit()
+            login_throttle.record_success(username)
             login_user(user)
             return redirect(url_for('index'))
         else:
+            login_throttle.record_failure(username, request.remote_addr)
             flash('ชื่อผู้ใช้หรือรหัสผ่านไม่ถูกต้อง', 'danger')
     return render_template('login.html')
 
@@ -126,38 +451,69 @@ def logout():
 
 # --- Page 2: Expense Request ---
 @app.route('/request', methods=['GET', 'POST'])
+@sqlite_tuning.writes('POST')
 @login_required
 def request_page():
     if current_user.role not in ['teacher', 'finance']:
         flash('คุณไม่มีสิทธ์เข้าถึงหน้านี้', 'danger')
         return redirect(url_for('index'))
         
+    categories = request_categories()
     if request.method == 'POST':
         date_str = request.form.get('date')
         # Input validation for amount
         try:
-            amount = float(request.form.get('amount', 0))
-            if amount <= 0 or amount > 100000000:  # Max 100 million baht
+            amount = parse_amount(request.form.get('amount', 0))
+            if not amount_in_range(amount):  # Max 100 million baht
                 flash('จำนวนเงินต้องมากกว่า 0 และไม่เกิน 100,000,000 บาท', 'danger')
-                return render_template('page2_request.html')
+                return render_template('page2_request.html', categories=categories)
         except (ValueError, TypeError):
             flash('กรุณาระบุจำนวนเงินที่ถูกต้อง', 'danger')
-            return render_template('page2_request.html')
+            return render_template('page2_request.html', categories=categories)
         description = request.form.get('description', '')  # NEW
         account_type = request.form.get('account_type')
-        
+        # NEW: optional budget category, one of the target ledger's categories
+        category = request.form.get('category') or None
+        if category and category not in categories.get(account_type, []):
+            category = None
+        request_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+
+        # The entry an approval posts would land in a closed period
+        try:
+            ledger_book.check_open(ledger_book.ACCOUNT_LEDGER_TYPES.get(account_type, 'Subsidy'), request_date)
+        except ledger_book.PeriodClosedError as e:
+            flash(f'ไม่สามารถส่งคำขอได้: {e}', 'danger')
+            return render_template('page2_request.html', categories=categories)
+
+        # Over the category budget or the ledger balance: warn, or refuse when enforcement is 'block'
+        problems = budgets.check(ledger_book.ACCOUNT_LEDGER_TYPES.get(account_type, 'Subsidy'),
+                                 category or APPROVAL_CATEGORY, amount, request_date)
+        if problems and budgets.blocking():
+            for problem in problems:
+                flash(f'ไม่สามารถส่งคำขอได้: {problem}', 'danger')
+            return render_template('page2_request.html', categories=categories)
+
         new_request = ExpenseRequest(
             requester_id=current_user.id,
-            date=datetime.strptime(date_str, '%Y-%m-%d').date(),
+            date=request_date,
             amount=amount,
             description=description,  # NEW
-            account_type=account_type
+            account_type=account_type,
+            category=category
         )
         db.session.add(new_request)
         db.session.commit()
         flash('บันทึกคำขอเบิกเงินเรียบร้อยแล้ว', 'success')
+        for problem in problems:
+            flash(f'คำเตือน: {problem}', 'warning')
         
-    return render_template('page2_request.html')
+    return render_template('page2_request.html', categories=categories)
+
+def request_categories():
+    """ExpenseRequest.account_type -> categories of the ledger it is paid from."""
+    url_types = {ledger_type: url_type for url_type, ledger_type in ledger_book.LEDGER_TYPES.items()}
+    return {account_type: ledger_book.LEDGER_CATEGORIES[url_types[ledger_type]]
+            for account_type, ledger_type in ledger_book.ACCOUNT_LEDGER_TYPES.items()}
 
 # --- Page 3: My Requests Status (Teacher & Finance) ---
 @app.route('/my-requests')
@@ -168,7 +524,9 @@ def my_requests():
         return redirect(url_for('index'))
     
     # Get all requests submitted by current user
-    my_requests = ExpenseRequest.query.filter_by(requester_id=current_user.id).order_by(ExpenseRequest.date.desc()).all()
+    my_requests = ExpenseRequest.query.filter_by(requester_id=current_user.id).options(
+        joinedload(ExpenseRequest.requester)
+    ).order_by(ExpenseRequest.date.desc()).all()
     return render_template('page3_status.html', requests=my_requests)
 
 # --- Page 4: Approval ---
@@ -182,64 +540,248 @@ def approve_page():
     # Show all pending or partially approved requests
     # Filter: Status is PENDING or PARTIALLY_APPROVED (essentially not 'APPROVED')
     # Or just show everything that isn't fully approved
-    pending_requests = ExpenseRequest.query.filter(ExpenseRequest.status != 'APPROVED').all()
+    pending_requests = ExpenseRequest.query.filter(
+        ExpenseRequest.status != 'APPROVED'
+    ).options(
+        joinedload(ExpenseRequest.requester)
+    ).order_by(ExpenseRequest.date, ExpenseRequest.id).all()
     return render_template('page4_approve.html', requests=pending_requests)
 
+def apply_approval(req, user, now):
+    """Record `user`'s approval on `req` (no commit).
+
+    Returns 'skipped' if this role already approved, 'approved' if the other
+    approval is still missing, or 'completed' if both are now in and the
+    request just became APPROVED (the caller then posts the ledger entry).
+    """
+    if user.role == 'finance':
+        if req.finance_approved_at:
+            return 'skipped'
+        req.finance_approver_id = user.id
+        req.finance_approved_at = now
+    elif user.role == 'director':
+        if req.director_approved_at:
+            return 'skipped'
+        req.director_approver_id = user.id
+        req.director_approved_at = now
+
+    # Check if both have approved
+    if req.finance_approved_at and req.director_approved_at and req.status != 'APPROVED':
+        req.status = 'APPROVED'
+        return 'completed'
+    return 'approved'
+
+def completes_approval(req, user):
+    """True if `user`'s approval would be the second one, making `req` APPROVED."""
+    if req.status == 'APPROVED':
+        return False
+    if user.role == 'finance':
+        return not req.finance_approved_at and bool(req.director_approved_at)
+    if user.role == 'director':
+        return not req.director_approved_at and bool(req.finance_approved_at)
+    return False
+
+# Category of an approved request's ledger entry when the request names none
+APPROVAL_CATEGORY = 'รายจ่าย'
+
+def approval_budget_key(req):
+    """(ledger_type, category, fiscal year) that approving `req` spends from."""
+    return (ledger_book.ACCOUNT_LEDGER_TYPES.get(req.account_type, 'Subsidy'),
+            req.category or APPROVAL_CATEGORY, ledger_book.fiscal_year_label(req.date))
+
+def approval_budget_problems(req, posting=None):
+    """budgets.check() for the ledger entry that approving `req` would post.
+
+    `posting` maps approval_budget_key() and ledger_type to amounts an unfinished
+    bulk approval has already posted, which count against this request too.
+    """
+    posting = posting or {}
+    key = approval_budget_key(req)
+    return budgets.check(key[0], key[1], req.amount, req.date,
+                         posting.get(key, ZERO), posting.get(key[0], ZERO))
+
+def approval_ledger_values(req, user):
+    """Column values of the Expense entry auto-created for a fully approved request."""
+    return dict(
+        date=req.date,
+        amount=req.amount,
+        description=f'อนุมัติจากคำขอ #{req.id}',
+        ledger_type=ledger_book.ACCOUNT_LEDGER_TYPES.get(req.account_type, 'Subsidy'),
+        category=req.category or APPROVAL_CATEGORY,
+        transaction_type='Expense',
+        expense_request_id=req.id,
+        created_by_id=user.id
+    )
+
 @app.route('/approve/<int:req_id>')
+@sqlite_tuning.writes('GET')
 @login_required
 def approve_action(req_id):
-    req = ExpenseRequest.query.get_or_404(req_id)
-    
-    if current_user.role == 'finance':
-        if not req.finance_approved_at:
-            req.finance_approver_id = current_user.id
-            req.finance_approved_at = datetime.utcnow()
-            flash('เจ้าหน้าที่การเงินอนุมัติแล้ว', 'success')
-    elif current_user.role == 'director':
-        if not req.director_approved_at:
-            req.director_approver_id = current_user.id
-            req.director_approved_at = datetime.utcnow()
-            flash('ผู้อำนวยการอนุมัติแล้ว', 'success')
-    else:
+    if current_user.role not in ['finance', 'director']:
         return redirect(url_for('index'))
 
-    # Check if both have approved
-    if req.finance_approved_at and req.director_approved_at:
-        req.status = 'APPROVED'
-        
+    req = ExpenseRequest.query.get_or_404(req_id)
+    # Checked before the approval that would post the entry; a blocked request stays as it was
+    completing = completes_approval(req, current_user)
+    if completing:
+        try:
+            ledger_book.check_open(approval_budget_key(req)[0], req.date)
+        except ledger_book.PeriodClosedError as e:
+            metrics.APPROVALS.inc(role=current_user.role, outcome='period_closed')
+            flash(f'ไม่สามารถอนุมัติคำขอ #{req.id} ได้: {e}', 'danger')
+            return redirect(url_for('approve_page'))
+    problems = approval_budget_problems(req) if completing else []
+    if problems and budgets.blocking():
+        metrics.APPROVALS.inc(role=current_user.role, outcome='over_budget')
+        for problem in problems:
+            flash(f'ไม่สามารถอนุมัติคำขอ #{req.id} ได้: {problem}', 'danger')
+        return redirect(url_for('approve_page'))
+    for problem in problems:
+        flash(f'คำเตือน (คำขอ #{req.id}): {problem}', 'warning')
+    outcome = apply_approval(req, current_user, datetime.utcnow())
+    if outcome != 'skipped':
+        flash('เจ้าหน้าที่การเงินอนุมัติแล้ว' if current_user.role == 'finance' else 'ผู้อำนวยการอนุมัติแล้ว', 'success')
+
+    if outcome == 'completed':
         try:
             # AUTO-CREATE LEDGER ENTRY
-            ledger_type_map = {
-                'เงินอุดหนุนอื่น': 'Subsidy',
-                'เงินรายได้สถานศึกษา': 'Income',
-                'เงินอาหารกลางวัน': 'Lunch'
-            }
-            
-            new_ledger = LedgerEntry(
-                date=req.date,
-                amount=req.amount,
-                description=f'อนุมัติจากคำขอ #{req.id}',
-                ledger_type=ledger_type_map.get(req.account_type, 'subsidy'),
-                category='รายจ่าย',
-                transaction_type='Expense',
-                expense_request_id=req.id,
-                created_by_id=current_user.id
-            )
+            new_ledger = LedgerEntry(**approval_ledger_values(req, current_user))
             db.session.add(new_ledger)
-            db.session.commit()
-            flash(f'✅ อนุมัติคำขอและบันทึกลงทะเบียน {ledger_type_map.get(req.account_type, "Subsidy")} เรียบร้อยแล้ว! (รหัสรายการ: {new_ledger.id})', 'success')
+            ledger_book.record_entry(new_ledger)
+            db.session.flush()
+            flash(f'✅ อนุมัติคำขอและบันทึกลงทะเบียน {new_ledger.ledger_type} เรียบร้อยแล้ว! (รหัสรายการ: {new_ledger.id})', 'success')
         except Exception as e:
             db.session.rollback()
+            outcome = 'error'
             flash(f'⚠️ อนุมัติเรียบร้อยแต่เกิดข้อผิดพลาดในการสร้างรายการทะเบียน: {str(e)}', 'warning')
-            print(f"ERROR creating ledger: {e}")
-            import traceback
-            traceback.print_exc()
+            app.logger.exception('Approval of request %s: creating the ledger entry failed', req_id)
     
     db.session.commit()
+    metrics.APPROVALS.inc(role=current_user.role, outcome=outcome)
     return redirect(url_for('approve_page'))
 
+BULK_APPROVAL_LIMIT = 1000
+
+def parse_bulk_ids():
+    """Request ids of a bulk approval, de-duplicated in order. Returns (ids, None) or (None, (status, message)).
+
+    JSON bodies must send {"req_ids": [int, ...]}; forms send req_ids fields of digits.
+    """
+    if request.is_json:
+        body = request.get_json(silent=True)
+        raw_ids = body.get('req_ids') if isinstance(body, dict) else None
+        if not isinstance(raw_ids, list) or not all(type(x) is int for x in raw_ids):
+            return None, (400, 'req_ids must be a list of integers')
+        ids = raw_ids
+    else:
+        raw_ids = request.form.getlist('req_ids')
+        if not all(x.isdigit() for x in raw_ids):
+            return None, (400, 'req_ids must be integers')
+        ids = [int(x) for x in raw_ids]
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > BULK_APPROVAL_LIMIT:
+        return None, (413, f'at most {BULK_APPROVAL_LIMIT} requests per bulk approval')
+    return ids, None
+
+@app.route('/approve/bulk', methods=['POST'])
+@sqlite_tuning.writes('POST')
+@login_required
+def approve_bulk():
+    """Apply the current role's approval to many requests in one transaction.
+
+    Every resulting ledger entry is written with a single executemany INSERT.
+    Returns per-request outcomes as JSON when asked for it, otherwise renders
+    the approval page with an outcome table.
+    """
+    wants_json = request.is_json or request.accept_mimetypes.best == 'application/json'
+    if current_user.role not in ['finance', 'director']:
+        if wants_json:
+            return jsonify(error='forbidden'), 403
+        flash('คุณไม่มีสิทธิ์เข้าถึงหน้านี้', 'danger')
+        return redirect(url_for('index'))
+
+    req_ids, error = parse_bulk_ids()
+    if error:
+        status, message = error
+        if wants_json:
+            return jsonify(error=message), status
+        flash('รายการคำขอที่เลือกไม่ถูกต้อง' if status == 400 else
+              f'เลือกได้ไม่เกิน {BULK_APPROVAL_LIMIT} รายการต่อครั้ง', 'danger')
+        return redirect(url_for('approve_page'))
+
+    requests_by_id = {
+        req.id: req for req in ExpenseRequest.query.filter(ExpenseRequest.id.in_(req_ids)).all()
+    } if req_ids else {}
+
+    now = datetime.utcnow()
+    results = []
+    ledger_rows = []
+    warnings = []
+    posting = {}  # amounts this batch has posted so far, see approval_budget_problems()
+    closed = {ledger_type: ledger_book.closed_through(ledger_type) for ledger_type in ledger_book.LEDGER_TYPES.values()}
+    for req_id in req_ids:
+        req = requests_by_id.get(req_id)
+        if req is None:
+            results.append({'id': req_id, 'outcome': 'not_found'})
+            continue
+        if completes_approval(req, current_user):
+            through = closed.get(approval_budget_key(req)[0])
+            if through is not None and req.date <= through:
+                results.append({'id': req_id, 'outcome': 'period_closed'})
+                continue
+            problems = approval_budget_problems(req, posting)
+            if problems and budgets.blocking():
+                results.append({'id': req_id, 'outcome': 'over_budget', 'problems': problems})
+                continue
+            warnings += [f'คำขอ #{req_id}: {problem}' for problem in problems]
+            key = approval_budget_key(req)
+            for k in (key, key[0]):
+                posting[k] = posting.get(k, ZERO) + req.amount
+        outcome = apply_approval(req, current_user, now)
+        if outcome == 'completed':
+            ledger_rows.append(approval_ledger_values(req, current_user))
+        results.append({'id': req_id, 'outcome': outcome})
+
+    try:
+        if ledger_rows:
+            db.session.execute(insert(LedgerEntry), ledger_rows)
+            ledger_book.record_entries(ledger_rows)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.exception('Bulk approval of %d request(s) failed', len(req_ids))
+        metrics.APPROVALS.inc(len(req_ids), role=current_user.role, outcome='error')
+        if wants_json:
+            return jsonify(error=str(e)), 500
+        flash(f'⚠️ อนุมัติไม่สำเร็จ ไม่มีรายการใดถูกบันทึก: {str(e)}', 'danger')
+        return redirect(url_for('approve_page'))
+
+    counts = {}
+    for result in results:
+        counts[result['outcome']] = counts.get(result['outcome'], 0) + 1
+    for outcome, count in counts.items():
+        metrics.APPROVALS.inc(count, role=current_user.role, outcome=outcome)
+    if wants_json:
+        return jsonify(results=results, counts=counts, warnings=warnings)
+
+    flash(f'อนุมัติ {counts.get("approved", 0) + counts.get("completed", 0)} รายการ '
+          f'(บันทึกลงทะเบียน {counts.get("completed", 0)} รายการ)', 'success')
+    if counts.get('over_budget'):
+        flash(f'ไม่ได้อนุมัติ {counts["over_budget"]} รายการเนื่องจากเกินงบประมาณหรือยอดคงเหลือ', 'danger')
+    if counts.get('period_closed'):
+        flash(f'ไม่ได้อนุมัติ {counts["period_closed"]} รายการเนื่องจากวันที่อยู่ในงวดที่ปิดบัญชีแล้ว', 'danger')
+    for warning in warnings:
+        flash(f'คำเตือน: {warning}', 'warning')
+    pending_requests = ExpenseRequest.query.filter(
+        ExpenseRequest.status != 'APPROVED'
+    ).options(
+        joinedload(ExpenseRequest.requester)
+    ).order_by(ExpenseRequest.date, ExpenseRequest.id).all()
+    return render_template('page4_approve.html', requests=pending_requests, bulk_results=results)
+
 # --- Edit Ledger Entry ---
 @app.route('/ledger/<type>/edit/<int:entry_id>', methods=['GET', 'POST'])
+@sqlite_tuning.writes('POST')
 @login_required
 def edit_ledger_entry(type, entry_id):
     if current_user.role not in ['finance', 'director']:
@@ -247,54 +789,86 @@ def edit_ledger_entry(type, entry_id):
         return redirect(url_for('index'))
     
     entry = LedgerEntry.query.get_or_404(entry_id)
+    # Entries of a closed month are frozen, text fields included
+    try:
+        ledger_book.check_open(entry.ledger_type, entry.date)
+    except ledger_book.PeriodClosedError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('ledger_view', type=type))
     
     if request.method == 'POST':
-        # Track changes
+        # Track changes: one audit row per edit with every changed field
+        changes = {}
         old_amount = entry.amount
-        new_amount = float(request.form.get('amount'))
+        try:
+            new_amount = parse_amount(request.form.get('amount'))
+            if not amount_in_range(new_amount):
+                flash('จำนวนเงินต้องมากกว่า 0 และไม่เกิน 100,000,000 บาท', 'danger')
+                return redirect(url_for('edit_ledger_entry', type=type, entry_id=entry.id))
+        except ValueError:
+            flash('กรุณาระบุจำนวนเงินที่ถูกต้อง', 'danger')
+            return redirect(url_for('edit_ledger_entry', type=type, entry_id=entry.id))
         if old_amount != new_amount:
-            history = LedgerEntryHistory(
-                ledger_entry_id=entry.id,
-                edited_by_id=current_user.id,
-                field_name='amount',
-                old_value=str(old_amount),
-                new_value=str(new_amount)
-            )
-            db.session.add(history)
+            changes['amount'] = (old_amount, new_amount)
             entry.amount = new_amount
+            ledger_book.record_amount_change(entry, old_amount)
         
         old_desc = entry.description or ''
         new_desc = request.form.get('description') or ''
         if old_desc != new_desc:
-            history = LedgerEntryHistory(
-                ledger_entry_id=entry.id,
-                edited_by_id=current_user.id,
-                field_name='description',
-                old_value=old_desc,
-                new_value=new_desc
-            )
-            db.session.add(history)
+            changes['description'] = (old_desc, new_desc)
             entry.description = new_desc
         
         old_note = entry.note or ''
         new_note = request.form.get('note') or ''
         if old_note != new_note:
-            history = LedgerEntryHistory(
-                ledger_entry_id=entry.id,
-                edited_by_id=current_user.id,
-                field_name='note',
-                old_value=old_note,
-                new_value=new_note
-            )
-            db.session.add(history)
+            changes['note'] = (old_note, new_note)
             entry.note = new_note
         
+        audit.record_edit(entry, current_user.id, changes)
         db.session.commit()
         flash('บันทึกการแก้ไขเรียบร้อยแล้ว', 'success')
         return redirect(url_for('ledger_view', type=type))
     
     return render_template('edit_ledger.html', entry=entry, type=type)
 
+# --- Bulk Import ---
+@app.route('/ledger/<type>/import', methods=['GET', 'POST'])
+@sqlite_tuning.writes('POST')
+@login_required
+def import_ledger(type):
+    if current_user.role not in ['finance', 'director']:
+        flash('คุณไม่มีสิทธ์เข้าถึงหน้านี้', 'danger')
+        return redirect(url_for('index'))
+    if type not in ledger_book.LEDGER_TYPES:
+        return "Invalid ledger type", 404
+
+    result = None
+    dry_run = False
+    if request.method == 'POST':
+        # Imported here so the import code (and openpyxl) only loads when used
+        from ledger_import import LedgerImport, LedgerImportError
+
+        upload = request.files.get('file')
+        dry_run = request.form.get('dry_run') == 'on'
+        if not upload or not upload.filename:
+            flash('กรุณาเลือกไฟล์ .xlsx หรือ .csv', 'danger')
+            return redirect(url_for('import_ledger', type=type))
+        try:
+            result = LedgerImport(type, current_user.id, dry_run=dry_run).run(upload.stream, upload.filename)
+        except LedgerImportError as e:
+            db.session.rollback()
+            flash(str(e), 'danger')
+            return redirect(url_for('import_ledger', type=type))
+        if dry_run:
+            flash(f'ตรวจสอบแล้ว {result.total} แถว: ถูกต้อง {result.valid} แถว ผิดพลาด {result.error_count} แถว (ยังไม่ได้บันทึก)', 'info')
+        else:
+            flash(f'นำเข้าเรียบร้อย {result.inserted} รายการ ข้ามแถวที่ผิดพลาด {result.error_count} แถว',
+                  'success' if not result.error_count else 'warning')
+
+    return render_template('import_ledger.html', type=type, header=LEDGER_HEADERS_TH[type],
+                           categories=ledger_book.LEDGER_CATEGORIES[type], result=result, dry_run=dry_run)
+
 # --- View Ledger History ---
 @app.route('/ledger/history/<int:entry_id>')
 @login_required
@@ -304,9 +878,11 @@ def ledger_history(entry_id):
         return redirect(url_for('index'))
     
     entry = LedgerEntry.query.get_or_404(entry_id)
-    history = LedgerEntryHistory.query.filter_by(
-        ledger_entry_id=entry_id
-    ).order_by(LedgerEntryHistory.edited_at.desc()).all()
+    history = audit.entry_history(entry_id)
+
+    # Optional ?at=: the entry as it was at that time (snapshot + deltas)
+    at = parse_as_of(request.args.get('at'))
+    as_of_state = audit.entry_as_of(entry, at) if at else None
     
     # Map ledger_type to URL type
     type_map = {
@@ -316,17 +892,191 @@ def ledger_history(entry_id):
     }
     ledger_type_url = type_map.get(entry.ledger_type, 'subsidy')
     
-    return render_template('ledger_history.html', entry=entry, history=history, ledger_type_url=ledger_type_url)
+    return render_template('ledger_history.html', entry=entry, history=history, ledger_type_url=ledger_type_url,
+                           field_labels=audit.FIELD_LABELS, at=at, as_of_state=as_of_state)
+
+def parse_as_of(value):
+    """'YYYY-MM-DDTHH:MM' (datetime-local input) or 'YYYY-MM-DD' (end of that day) -> datetime, else None."""
+    for fmt in ('%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            at = datetime.strptime(value or '', fmt)
+        except ValueError:
+            continue
+        return at.replace(hour=23, minute=59, second=59) if fmt == '%Y-%m-%d' else at
+    return None
+
+# --- Ledger as of a past time ---
+@app.route('/ledger/<type>/as-of')
+@login_required
+def ledger_as_of(type):
+    if current_user.role not in ['finance', 'director']:
+        flash('คุณไม่มีสิทธ์เข้าถึงหน้านี้', 'danger')
+        return redirect(url_for('index'))
+    if type not in ledger_book.LEDGER_TYPES:
+        return "Invalid ledger type", 404
+
+    at = parse_as_of(request.args.get('at')) or datetime.utcnow().replace(second=0, microsecond=0)
+    try:
+        start = datetime.strptime(request.args.get('start', ''), '%Y-%m-%d').date()
+        end = datetime.strptime(request.args.get('end', ''), '%Y-%m-%d').date()
+    except ValueError:
+        # Default: the calendar year of the chosen time, as on the ledger page
+        start, end = at.date().replace(month=1, day=1), at.date()
+
+    rows = audit.ledger_as_of(ledger_book.LEDGER_TYPES[type], at, start, end)
+    income = sum((row['amount'] for row in rows if row['transaction_type'] == 'Income'), ZERO)
+    expense = sum((row['amount'] for row in rows if row['transaction_type'] != 'Income'), ZERO)
+    return render_template('ledger_as_of.html', type=type, header=LEDGER_HEADERS_TH[type], rows=rows,
+                           at=at, start=start, end=end, income=income, expense=expense)
+
+# --- Search ---
+SEARCH_PAGE_SIZE = 50
+
+@app.route('/search')
+@login_required
+def search_page():
+    """Full-text search: ledger entries (finance/director) and expense requests (teachers: their own)."""
+    staff = current_user.role in ['finance', 'director']
+    scope = request.args.get('scope') if staff else 'requests'
+    if scope not in ('ledger', 'requests'):
+        scope = 'ledger'
+    q = request.args.get('q', '').strip()
+    type = request.args.get('ledger', '')
+    if type not in ledger_book.LEDGER_TYPES:
+        type = ''
+    category = request.args.get('category', '')
+    amounts = []
+    for name in ('min_amount', 'max_amount'):
+        try:
+            amounts.append(parse_amount(request.args[name]) if request.args.get(name) else None)
+        except (ValueError, TypeError):
+            flash('กรุณาระบุช่วงจำนวนเงินที่ถูกต้อง', 'warning')
+            amounts.append(None)
+    before = request.args.get('before', type=int)
+
+    results, next_before = [], None
+    if q:
+        if scope == 'ledger':
+            results, next_before = search.search_ledger(
+                q, ledger_book.LEDGER_TYPES.get(type), category or None, *amounts,
+                before=before, limit=SEARCH_PAGE_SIZE)
+        else:
+            account_types = {ledger_type: account_type
+                             for account_type, ledger_type in ledger_book.ACCOUNT_LEDGER_TYPES.items()}
+            results, next_before = search.search_requests(
+                q, account_types.get(ledger_book.LEDGER_TYPES.get(type)), category or None, *amounts,
+                requester_id=None if staff else current_user.id, before=before, limit=SEARCH_PAGE_SIZE)
+
+    # Every category any ledger uses, plus the one approvals post under
+    categories = list(dict.fromkeys(
+        [name for names in ledger_book.LEDGER_CATEGORIES.values() for name in names] + [APPROVAL_CATEGORY]))
+    ledger_urls = {ledger_type: url_type for url_type, ledger_type in ledger_book.LEDGER_TYPES.items()}
+    return render_template('search.html', q=q, scope=scope, staff=staff, type=type, category=category,
+                           min_amount=request.args.get('min_amount', ''), max_amount=request.args.get('max_amount', ''),
+                           results=results, next_before=next_before, before=before, categories=categories,
+                           headers=LEDGER_HEADERS_TH, ledger_urls=ledger_urls,
+                           short_terms=search.parse_query(q)[1])
+
+# --- Budgets ---
+@app.route('/budgets', methods=['GET', 'POST'])
+@sqlite_tuning.writes('POST')
+@login_required
+def budgets_page():
+    """Set category allocations for a fiscal year and show how much of each is used."""
+    if current_user.role not in ['finance', 'director']:
+        flash('คุณไม่มีสิทธ์เข้าถึงหน้านี้', 'danger')
+        return redirect(url_for('index'))
+
+    fiscal_year = request.values.get('fiscal_year', type=int) or ledger_book.fiscal_year_label(date.today())
+    if request.method == 'POST':
+        type = request.form.get('ledger')
+        category = request.form.get('category')
+        if type not in ledger_book.LEDGER_TYPES or category not in ledger_book.LEDGER_CATEGORIES[type]:
+            flash('กรุณาเลือกทะเบียนและหมวดหมู่ให้ถูกต้อง', 'danger')
+            return redirect(url_for('budgets_page', fiscal_year=fiscal_year))
+        try:
+            amount = parse_amount(request.form.get('amount', 0))
+            if not amount_in_range(amount):
+                raise ValueError
+        except (ValueError, TypeError):
+            flash('จำนวนเงินต้องมากกว่า 0 และไม่เกิน 100,000,000 บาท', 'danger')
+            return redirect(url_for('budgets_page', fiscal_year=fiscal_year))
+        budgets.set_budget(fiscal_year, ledger_book.LEDGER_TYPES[type], category, amount, current_user.id)
+        db.session.commit()
+        flash(f'บันทึกงบประมาณหมวด "{category}" ปีงบประมาณ {fiscal_year} เรียบร้อยแล้ว', 'success')
+        return redirect(url_for('budgets_page', fiscal_year=fiscal_year))
+
+    return render_template('budgets.html', fiscal_year=fiscal_year, report=budgets.utilisation(fiscal_year),
+                           headers=LEDGER_HEADERS_TH, categories=ledger_book.LEDGER_CATEGORIES,
+                           enforcement=app.config['BUDGET_ENFORCEMENT'])
+
+# --- Month-end close ---
+@app.route('/periods', methods=['GET', 'POST'])
+@sqlite_tuning.writes('POST')
+@login_required
+def periods_page():
+    """Close months of the ledgers, archive closed months, reopen the latest closed month (director)."""
+    if current_user.role not in ['finance', 'director']:
+        flash('คุณไม่มีสิทธ์เข้าถึงหน้านี้', 'danger')
+        return redirect(url_for('index'))
+
+    if request.method == 'POST':
+        type = request.form.get('ledger')
+        action = request.form.get('action')
+        if type not in ledger_book.LEDGER_TYPES or action not in ('close', 'archive', 'reopen'):
+            flash('กรุณาเลือกทะเบียนและคำสั่งให้ถูกต้อง', 'danger')
+            return redirect(url_for('periods_page'))
+        ledger_type = ledger_book.LEDGER_TYPES[type]
+        header = LEDGER_HEADERS_TH[type]
+        try:
+            if action == 'reopen':
+                if current_user.role != 'director':
+                    flash('เฉพาะผู้อำนวยการเท่านั้นที่เปิดงวดที่ปิดแล้วได้', 'danger')
+                    return redirect(url_for('periods_page'))
+                month = periods.reopen_latest(ledger_type)
+                message = f'เปิดงวด{periods.month_label(month)} ของทะเบียน{header}แล้ว'
+            else:
+                try:
+                    month = datetime.strptime(request.form.get('month', ''), '%Y-%m').date()
+                except ValueError:
+                    flash('กรุณาเลือกเดือนให้ถูกต้อง', 'danger')
+                    return redirect(url_for('periods_page'))
+                if action == 'close':
+                    closed = periods.close_through(ledger_type, month, current_user.id)
+                    message = (f'ปิดงวดทะเบียน{header} {len(closed)} เดือน ถึง{periods.month_label(month)} '
+                               f'ยอดคงเหลือยกไป {closed[-1].closing_balance:,.2f} บาท')
+                else:
+                    moved = periods.archive_through(ledger_type, month)
+                    message = f'ย้ายรายการทะเบียน{header}ถึง{periods.month_label(month)} {moved} รายการไปเก็บถาวรแล้ว'
+        except periods.PeriodError as e:
+            db.session.rollback()
+            flash(str(e), 'danger')
+            return redirect(url_for('periods_page'))
+        db.session.commit()
+        flash(message, 'success')
+        return redirect(url_for('periods_page'))
+
+    ledgers = {}
+    for type, ledger_type in ledger_book.LEDGER_TYPES.items():
+        ledgers[type] = {
+            'closes': PeriodClose.query.filter_by(ledger_type=ledger_type).options(
+                joinedload(PeriodClose.closed_by)).order_by(PeriodClose.month.desc()).all(),
+            'next_month': periods.first_open_month(ledger_type),
+        }
+    last_month = date.today().replace(day=1) - timedelta(days=1)
+    return render_template('periods.html', ledgers=ledgers, headers=LEDGER_HEADERS_TH,
+                           default_month=last_month.strftime('%Y-%m'), month_label=periods.month_label)
 
 # --- Page 6, 7, 8: Ledgers ---
 @app.route('/ledger/<type>', methods=['GET', 'POST'])
+@sqlite_tuning.writes('POST')
 @login_required
 def ledger_view(type):
-    # Mapping URL type to DB Ledger Type and Template
+    # Mapping URL type to DB Ledger Type and page header
     type_map = {
-        'subsidy': {'db_type': 'Subsidy', 'template': 'page6_subsidy.html', 'header': 'ทะเบียนคุมเงินอุดหนุน'},
-        'income': {'db_type': 'Income', 'template': 'page7_income.html', 'header': 'ทะเบียนคุมเงินรายได้'},
-        'lunch': {'db_type': 'Lunch', 'template': 'page8_lunch.html', 'header': 'ทะเบียนคุมเงินอาหารกลางวัน'}
+        'subsidy': {'db_type': 'Subsidy', 'header': 'ทะเบียนคุมเงินอุดหนุน'},
+        'income': {'db_type': 'Income', 'header': 'ทะเบียนคุมเงินรายได้'},
+        'lunch': {'db_type': 'Lunch', 'header': 'ทะเบียนคุมเงินอาหารกลางวัน'}
     }
     
     if type not in type_map:
@@ -342,8 +1092,8 @@ def ledger_view(type):
         date_str = request.form.get('date')
         # Input validation for ledger amount
         try:
-            amount = float(request.form.get('amount', 0))
-            if amount <= 0 or amount > 100000000:
+            amount = parse_amount(request.form.get('amount', 0))
+            if not amount_in_range(amount):
                 flash('จำนวนเงินต้องมากกว่า 0 และไม่เกิน 100,000,000 บาท', 'danger')
                 return redirect(url_for('ledger_view', type=type))
         except (ValueError, TypeError):
@@ -365,13 +1115,16 @@ def ledger_view(type):
             created_by_id=current_user.id # NEW: Track manual creator
         )
         db.session.add(entry)
+        try:
+            ledger_book.record_entry(entry)
+        except ledger_book.PeriodClosedError as e:
+            db.session.rollback()
+            flash(str(e), 'danger')
+            return redirect(url_for('ledger_view', type=type))
         db.session.commit()
         flash('บันทึกรายการเรียบร้อยแล้ว', 'success')
     
     # Calculate date range first (needed for filtering)
-    from sqlalchemy import func
-    from sqlalchemy.orm import joinedload
-    
     today = date.today()
     current_month_start = today.replace(day=1)
     current_month_end = (current_month_start + relativedelta(months=1)) - relativedelta(days=1)
@@ -388,172 +1141,180 @@ def ledger_view(type):
         balance_start_date = today.replace(month=1, day=1)
         balance_end_date = today
     
-    # Fetch entries (Optimized with Eager Loading & Date Filtering)
-    query = LedgerEntry.query.filter_by(ledger_type=config['db_type'])
-    
-    if balance_start_date:
-        query = query.filter(LedgerEntry.date >= balance_start_date)
-    if balance_end_date:
-        query = query.filter(LedgerEntry.date <= balance_end_date)
+    # Keyset pagination on (date, id): every page is an index range scan, never an OFFSET
+    page_size = request.args.get('per_page', app.config['LEDGER_PAGE_SIZE'], type=int)
+    page_size = max(1, min(page_size, app.config['LEDGER_MAX_PAGE_SIZE']))
+    after = ledger_book.parse_cursor(request.args.get('after'))
+    before = ledger_book.parse_cursor(request.args.get('before'))
+
+    def render_fragments():
+        # Archived months are no longer in ledger_entry: their part of the range is
+        # brought forward as one balance from the frozen period totals
+        rows_start = balance_start_date
+        brought_forward = ZERO
+        archived = periods.archived_through(config['db_type'])
+        if archived is not None and archived >= balance_start_date:
+            rows_start = archived + timedelta(days=1)
+            income, expense = ledger_book.period_totals(
+                config['db_type'], balance_start_date, min(archived, balance_end_date))
+            brought_forward = income - expense
+
+        # One column-only query, then display rows built in a single Python pass (ledger_rows.py)
+        tuples, has_prev, has_next = ledger_rows.fetch(
+            config['db_type'], rows_start, balance_end_date, after, before, page_size)
+
+        # Running balance on this page continues from everything earlier in the range
+        opening_balance = brought_forward
+        if tuples and has_prev:
+            first_id, first_date = tuples[0][0], tuples[0][1]
+            opening_balance += ledger_book.balance_before(
+                config['db_type'], rows_start, first_date, first_id)
+        rows = ledger_rows.build(tuples, to_satang(opening_balance),
+                                 locked_through=ledger_book.closed_through(config['db_type']))
+
+        page_args = dict(type=type, balance_start=balance_start_date.strftime('%Y-%m-%d'),
+                         balance_end=balance_end_date.strftime('%Y-%m-%d'))
+        if page_size != app.config['LEDGER_PAGE_SIZE']:
+            page_args['per_page'] = page_size
+        first_url = url_for('ledger_view', **page_args) if has_prev else None
+        prev_url = url_for('ledger_view', before=ledger_book.make_cursor(rows[0]), **page_args) if has_prev and rows else None
+        next_url = url_for('ledger_view', after=ledger_book.make_cursor(rows[-1]), **page_args) if has_next and rows else None
         
-    entries = query.options(
-        joinedload(LedgerEntry.created_by),
-        joinedload(LedgerEntry.expense_request).joinedload(ExpenseRequest.requester)
-    ).order_by(LedgerEntry.date).all()
-    
-    # Categories for dropdowns
-    categories = []
-    if type == 'subsidy':
-        categories = ['ค่าจัดการเรียนการสอน', 'ค่ากิจกรรมพัฒนาผู้เรียน', 'ค่าเครื่องแบบ', 'ค่าอุปกรณ์การเรียน', 'ค่าหนังสือเรียน', 'อื่นๆ']
-    elif type == 'income':
-        categories = ['เงินบริจาค', 'ทุนการศึกษา', 'ค่าจ้างครู', 'อื่นๆ']
-    
-    # Helper to calculate sum
-    def get_sum(transaction_type, start_date, end_date):
-        result = db.session.query(func.sum(LedgerEntry.amount)).filter(
-            LedgerEntry.ledger_type == config['db_type'],
-            LedgerEntry.transaction_type == transaction_type,
-            LedgerEntry.date >= start_date,
-            LedgerEntry.date <= end_date
-        ).scalar()
-        return result or 0.0
-
-    # Calculate monthly income (current month)
-    monthly_income = get_sum('Income', current_month_start, current_month_end)
-    
-    # Calculate monthly expenses (current month)
-    monthly_expense = get_sum('Expense', current_month_start, current_month_end)
-    
-    # Calculate balance for selected range
-    balance_income = get_sum('Income', balance_start_date, balance_end_date)
-    balance_expense = get_sum('Expense', balance_start_date, balance_end_date)
-    current_balance = balance_income - balance_expense
+        # Totals come from the daily balance table (one row per day, not per entry)
+        monthly_income, monthly_expense = ledger_book.period_totals(
+            config['db_type'], current_month_start, current_month_end)
+        
+        # Calculate balance for selected range
+        balance_income, balance_expense = ledger_book.period_totals(
+            config['db_type'], balance_start_date, balance_end_date)
+        current_balance = balance_income - balance_expense
+
+        return {
+            'ledger_cards': Markup(render_template(
+                '_ledger_cards.html',
+                monthly_income=monthly_income,
+                monthly_expense=monthly_expense,
+                current_balance=current_balance,
+                balance_start=balance_start_date.strftime('%Y-%m-%d'),
+                balance_end=balance_end_date.strftime('%Y-%m-%d'),
+                current_month=today.strftime('%B %Y')
+            )),
+            'ledger_table': Markup(render_template(
+                '_ledger_table.html',
+                rows=rows,
+                opening_balance=format_satang(to_satang(opening_balance)),
+                brought_forward=rows_start != balance_start_date,
+                first_url=first_url,
+                prev_url=prev_url,
+                next_url=next_url,
+                ledger_type=type,
+                # Row links are prefix + id: one url_for per page instead of two per row
+                edit_prefix=url_for('edit_ledger_entry', type=type, entry_id=0)[:-1],
+                history_prefix=url_for('ledger_history', entry_id=0)[:-1]
+            )),
+        }
+
+    # Rendered cards and table are reused until this ledger changes (see fragment_cache.py)
+    fragment_key = ('ledger', tenants.current_slug(), type, balance_start_date, balance_end_date, after, before,
+                    page_size, today, ledger_book.ledger_version(config['db_type']))
+    fragments = fragment_cache.cached(fragment_key, render_fragments)
     
     return render_template(
-        config['template'], 
-        entries=entries, 
-        categories=categories,
+        'ledger.html',
+        categories=ledger_book.LEDGER_CATEGORIES[type],
         header=config['header'],
         ledger_type=type,
-        monthly_income=monthly_income,
-        monthly_expense=monthly_expense,
-        current_balance=current_balance,
         balance_start=balance_start_date.strftime('%Y-%m-%d'),
         balance_end=balance_end_date.strftime('%Y-%m-%d'),
-        current_month=today.strftime('%B %Y')
+        **fragments
     )
 
 # --- Export Logic ---
-@app.route('/export/<type>')
+@app.route('/export/<type>', methods=['GET', 'POST'])
+@sqlite_tuning.writes('GET', 'POST')
 @login_required
 def export_ledger(type):
+    """Queue an export job (or reuse an identical one) and show its progress page."""
     if current_user.role not in ['finance', 'director']:
         return "Access denied", 403
 
-    type_map = {
-        'subsidy': 'Subsidy',
-        'income': 'Income',
-        'lunch': 'Lunch'
-    }
-    
     header_map = {
         'subsidy': 'ทะเบียนคุมเงินอุดหนุน',
         'income': 'ทะเบียนคุมเงินรายได้',
         'lunch': 'ทะเบียนคุมเงินอาหารกลางวัน'
     }
     
-    if type not in type_map:
+    if type not in ledger_book.LEDGER_TYPES:
         return "Invalid type", 404
-        
-    from sqlalchemy.orm import joinedload
-    
-    entries = LedgerEntry.query.filter_by(ledger_type=type_map[type]).options(
-        joinedload(LedgerEntry.created_by),
-        joinedload(LedgerEntry.expense_request).joinedload(ExpenseRequest.requester)
-    ).order_by(LedgerEntry.date).all()
-    
-    data = []
-    balance = 0.0
-    
-    # For Monthly Stats
+
     today = date.today()
     current_month_start = today.replace(day=1)
     current_month_end = (current_month_start + relativedelta(months=1)) - relativedelta(days=1)
-    
-    monthly_income = 0.0
-    monthly_expense = 0.0
-    
-    for e in entries:
-        # Resolve Creator
-        creator = "-"
-        if e.expense_request:
-            creator = e.expense_request.requester.name or e.expense_request.requester.username
-        elif e.created_by:
-            creator = e.created_by.name or e.created_by.username
-            
-        # Amounts
-        income = 0.0
-        expense = 0.0
-        if e.transaction_type == 'Income':
-            income = e.amount
-            balance += e.amount
-            # Monthly Stat Update
-            if current_month_start <= e.date <= current_month_end:
-                monthly_income += e.amount
-        else:
-            expense = e.amount
-            balance -= e.amount
-            # Monthly Stat Update
-            if current_month_start <= e.date <= current_month_end:
-                monthly_expense += e.amount
-                
-        data.append({
-            'วันที่': e.date.strftime('%d/%m/%Y'),
-            'หมวดหมู่': e.category,
-            'ผู้ทำรายการ': creator,
-            'รายละเอียด': e.description,
-            'รายรับ': income if income > 0 else None,
-            'รายจ่าย': expense if expense > 0 else None,
-            'คงเหลือ': balance,
-            'หมายเหตุ': e.note
-        })
-    
-    df = pd.DataFrame(data)
-    
-    # Create Excel with Summary
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Sheet1', startrow=1)
-        
-        workbook = writer.book
-        worksheet = writer.sheets['Sheet1']
-        
-        # Add Title and Date
-        worksheet.cell(row=1, column=1, value=f"{header_map.get(type, type)} - ข้อมูล ณ วันที่ {today.strftime('%d/%m/%Y')}")
-        
-        # Add Summary at the bottom
-        last_row = len(data) + 4
-        
-        worksheet.cell(row=last_row, column=1, value="สรุปยอด")
-        worksheet.cell(row=last_row+1, column=1, value="รายรับของเดือนนี้")
-        worksheet.cell(row=last_row+1, column=2, value=monthly_income)
-        
-        worksheet.cell(row=last_row+2, column=1, value="รายจ่ายของเดือนนี้")
-        worksheet.cell(row=last_row+2, column=2, value=monthly_expense)
-        
-        worksheet.cell(row=last_row+3, column=1, value="เงินคงเหลือสุทธิ")
-        worksheet.cell(row=last_row+3, column=2, value=balance) # Current Balance is the final running balance
+    ledger_type = ledger_book.LEDGER_TYPES[type]
+    params = {
+        'ledger_type': ledger_type,
+        'title': f"{header_map.get(type, type)} - ข้อมูล ณ วันที่ {today.strftime('%d/%m/%Y')}",
+        'month_start': current_month_start.isoformat(),
+        'month_end': current_month_end.isoformat(),
+        'format': 'csv' if request.values.get('format') == 'csv' else 'xlsx',
+        'filename': f'{type}_ledger_{today.strftime("%Y%m%d")}',
+    }
+    # Start after the latest closed month, from its frozen closing balance
+    latest = periods.latest_close(ledger_type)
+    if latest is not None:
+        params['start'] = periods.next_month(latest.month).isoformat()
+        params['opening_balance'] = str(latest.closing_balance)
+    jobs.prune()
+    job, created = jobs.submit('ledger_export', params, ledger_book.ledger_version(ledger_type), current_user.id)
+    if not created:
+        db.session.commit()  # artifacts expired by prune()
+        flash('ใช้ไฟล์ส่งออกที่สร้างไว้แล้ว (ข้อมูลยังไม่เปลี่ยนแปลง)' if job.status == 'DONE'
+              else 'กำลังสร้างไฟล์ส่งออกนี้อยู่แล้ว', 'info')
+    return redirect(url_for('job_status', job_id=job.id, back=url_for('ledger_view', type=type)))
 
-    output.seek(0)
-    
-    return send_file(output, download_name=f'{type}_ledger_{today.strftime("%Y%m%d")}.xlsx', as_attachment=True)
+# --- Background Jobs ---
+def _job_or_404(job_id):
+    if current_user.role not in ['finance', 'director']:
+        abort(403)
+    return Job.query.get_or_404(job_id)
+
+def _job_json(job):
+    return {
+        'id': job.id,
+        'status': job.status,
+        'error': job.error,
+        'download_url': url_for('job_download', job_id=job.id) if job.status == 'DONE' else None,
+        'download_name': job.download_name,
+    }
+
+@app.route('/jobs/<job_id>')
+@login_required
+def job_status(job_id):
+    job = _job_or_404(job_id)
+    back = request.args.get('back', '')
+    if not back.startswith('/'):
+        back = url_for('index')
+    return render_template('job_status.html', job=job, job_json=_job_json(job), back=back)
+
+@app.route('/jobs/<job_id>/status')
+@login_required
+def job_status_json(job_id):
+    response = jsonify(_job_json(_job_or_404(job_id)))
+    response.cache_control.no_store = True
+    return response
+
+@app.route('/jobs/<job_id>/download')
+@login_required
+def job_download(job_id):
+    job = _job_or_404(job_id)
+    if job.status != 'DONE' or not job.artifact_path or not os.path.exists(job.artifact_path):
+        flash('ไฟล์ส่งออกนี้หมดอายุแล้ว กรุณาส่งออกใหม่อีกครั้ง', 'warning')
+        return redirect(url_for('index'))
+    return send_file(job.artifact_path, mimetype=job.mimetype, download_name=job.download_name, as_attachment=True)
 
 if __name__ == '__main__':
-    if not os.path.exists('instance/financial_system.db'):
-        init_db()
-    else:
-        # Also run init_db to check for missing tables/users in case of partial setup
-        init_db()
-    # Production: Set debug=False, use environment variable to override if needed
+    # Development server (single process). Production: python serve.py
+    # Creates the database on first start and checks for missing tables/users after that
+    init_db()
     debug_mode = os.environ.get('FLASK_DEBUG', 'false').lower() == 'true'
     app.run(host='0.0.0.0', port=5000, debug=debug_mode)
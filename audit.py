@@ -0,0 +1,301 @@
+"""Append-only audit log for ledger entries, with snapshots for time travel.
+
+Every edit of a LedgerEntry appends one LedgerAudit row whose `changes`
+column is a compact JSON diff of all fields the edit touched:
+
+    {"amount": [150000, 120000], "note": ["", "แก้ยอด"]}
+
+(amounts in satang, dates as ISO strings). Rows are never updated or deleted.
+
+To reconstruct an entry "as of" a timestamp without replaying its whole
+history, LedgerEntrySnapshot keeps full copies of the audited fields: one
+of the entry as created (written with its first edit) and another after
+every AUDIT_SNAPSHOT_EVERY edits. A past state is the newest snapshot
+taken at or before the timestamp plus the few deltas after it. Entries
+that were never edited have neither; their current row is their history.
+"""
+import json
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import and_, func
+
+from models import db, LedgerEntry, LedgerAudit, LedgerEntrySnapshot
+from money import from_satang, to_satang
+import metrics
+
+# Fields recorded in snapshots and diffs
+AUDITED_FIELDS = ['date', 'amount', 'description', 'note', 'category', 'transaction_type']
+# Thai labels for the history page
+FIELD_LABELS = {
+    'date': 'วันที่',
+    'amount': 'จำนวนเงิน',
+    'description': 'รายละเอียด',
+    'note': 'หมายเหตุ',
+    'category': 'หมวดหมู่',
+    'transaction_type': 'ประเภท',
+}
+# Entries created before created_at was tracked are treated as always existing
+BEGINNING = datetime(1970, 1, 1)
+# Keep IN (...) lists well below SQLite's bound-parameter limit
+CHUNK = 500
+
+
+def _encode(field, value):
+    if value is None:
+        return None
+    if field == 'amount':
+        return to_satang(value)
+    if field == 'date':
+        return value.isoformat()
+    return value
+
+
+def _decode(field, value):
+    if value is None:
+        return None
+    if field == 'amount':
+        return from_satang(value) if isinstance(value, int) else value  # legacy text that was not a number
+    if field == 'date':
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    return value
+
+
+def _dumps(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def _state(entry):
+    return {field: _encode(field, getattr(entry, field)) for field in AUDITED_FIELDS}
+
+
+def _latest_snapshot(entry_id):
+    return LedgerEntrySnapshot.query.filter_by(ledger_entry_id=entry_id) \
+        .order_by(LedgerEntrySnapshot.id.desc()).first()
+
+
+def _append(entry_id, ledger_type, created_at, user_id, changed_at, changes, state_before):
+    """Write one audit row (plus snapshots as needed). `changes` and `state_before` are encoded."""
+    last = _latest_snapshot(entry_id)
+    if last is None:
+        # First edit: keep the entry as created, the base every reconstruction starts from
+        db.session.add(LedgerEntrySnapshot(ledger_entry_id=entry_id, audit_id=None,
+                                           taken_at=created_at or BEGINNING, state=_dumps(state_before)))
+    row = LedgerAudit(ledger_entry_id=entry_id, ledger_type=ledger_type, changed_by_id=user_id,
+                      changed_at=changed_at, changes=_dumps(changes))
+    db.session.add(row)
+    db.session.flush()
+
+    since = db.session.query(func.count(LedgerAudit.id)).filter(
+        LedgerAudit.ledger_entry_id == entry_id,
+        LedgerAudit.id > (last.audit_id or 0 if last is not None else 0)  # deltas since the last snapshot
+    ).scalar()
+    if since >= current_app.config['AUDIT_SNAPSHOT_EVERY']:
+        state = dict(state_before)
+        state.update({field: new for field, (old, new) in changes.items()})
+        db.session.add(LedgerEntrySnapshot(ledger_entry_id=entry_id, audit_id=row.id,
+                                           taken_at=changed_at, state=_dumps(state)))
+    return row
+
+
+def record_edit(entry, user_id, changes):
+    """Record an edit of `entry` in the current transaction.
+
+    `changes` maps field -> (old value, new value) for the fields that changed;
+    `entry` may already hold the new values. Returns the LedgerAudit row, or
+    None if nothing changed.
+    """
+    if not changes:
+        return None
+    metrics.on_commit(db.session, metrics.LEDGER_WRITES, ledger=entry.ledger_type, kind='edit')
+    encoded = {field: [_encode(field, old), _encode(field, new)] for field, (old, new) in changes.items()}
+    state_before = _state(entry)
+    state_before.update({field: old for field, (old, new) in encoded.items()})
+    return _append(entry.id, entry.ledger_type, entry.created_at, user_id, datetime.utcnow(),
+                   encoded, state_before)
+
+
+# --- Reading ---
+
+def entry_history(entry_id):
+    """Edits of one entry, newest first: dicts with changed_at, changed_by and [(field, old, new)]."""
+    rows = LedgerAudit.query.filter_by(ledger_entry_id=entry_id).options(
+        db.joinedload(LedgerAudit.changed_by)
+    ).order_by(LedgerAudit.id.desc()).all()
+    return [{
+        'changed_at': row.changed_at,
+        'changed_by': row.changed_by,
+        'changes': [(field, _decode(field, old), _decode(field, new))
+                    for field, (old, new) in json.loads(row.changes).items()],
+    } for row in rows]
+
+
+def states_as_of(entry_ids, at):
+    """{entry id: {field: value}} as of `at` for edited entries (one snapshot + deltas each).
+
+    Entries without a snapshot at or before `at` (never edited, or created
+    later) are left out; callers use the current row for those.
+    """
+    states = {}
+    entry_ids = list(entry_ids)
+    for i in range(0, len(entry_ids), CHUNK):
+        chunk = entry_ids[i:i + CHUNK]
+        newest = db.session.query(func.max(LedgerEntrySnapshot.id)).filter(
+            LedgerEntrySnapshot.ledger_entry_id.in_(chunk),
+            LedgerEntrySnapshot.taken_at <= at
+        ).group_by(LedgerEntrySnapshot.ledger_entry_id).subquery()
+        snapshots = LedgerEntrySnapshot.query.filter(LedgerEntrySnapshot.id.in_(db.select(newest))).all()
+        if not snapshots:
+            continue
+        for snapshot in snapshots:
+            states[snapshot.ledger_entry_id] = json.loads(snapshot.state)
+
+        # Deltas after each entry's snapshot, up to `at`: an index range per entry
+        deltas = db.session.query(LedgerAudit.ledger_entry_id, LedgerAudit.changes).join(
+            LedgerEntrySnapshot, and_(
+                LedgerEntrySnapshot.ledger_entry_id == LedgerAudit.ledger_entry_id,
+                LedgerAudit.id > func.coalesce(LedgerEntrySnapshot.audit_id, 0)
+            )
+        ).filter(
+            LedgerEntrySnapshot.id.in_([snapshot.id for snapshot in snapshots]),
+            LedgerAudit.changed_at <= at
+        ).order_by(LedgerAudit.id)
+        for entry_id, changes in deltas:
+            states[entry_id].update({field: new for field, (old, new) in json.loads(changes).items()})
+
+    return {entry_id: {field: _decode(field, value) for field, value in state.items()}
+            for entry_id, state in states.items()}
+
+
+def entry_as_of(entry, at):
+    """Field values of `entry` at `at`, or None if it did not exist yet."""
+    if entry.created_at is not None and entry.created_at > at:
+        return None
+    state = states_as_of([entry.id], at).get(entry.id)
+    if state is None:
+        # No snapshot means never edited: the current row is the only state there was
+        state = {field: getattr(entry, field) for field in AUDITED_FIELDS}
+    return state
+
+
+def ledger_as_of(ledger_type, at, start, end):
+    """Entries of one ledger dated start..end as they stood at `at`, ordered by date.
+
+    Returns a list of dicts (id, created_by, the audited fields, and `changed`:
+    True if the entry has been edited since). Only entries edited after `at`
+    are reconstructed; all others are read as they are now.
+    """
+    entries = LedgerEntry.query.filter(
+        LedgerEntry.ledger_type == ledger_type,
+        LedgerEntry.date >= start,
+        LedgerEntry.date <= end,
+        db.or_(LedgerEntry.created_at <= at, LedgerEntry.created_at.is_(None))
+    ).options(
+        db.joinedload(LedgerEntry.created_by)
+    ).order_by(LedgerEntry.date, LedgerEntry.id).all()
+
+    edited_since = {entry_id for (entry_id,) in db.session.query(LedgerAudit.ledger_entry_id).filter(
+        LedgerAudit.ledger_type == ledger_type,
+        LedgerAudit.changed_at > at
+    ).distinct()}
+    past = states_as_of([entry.id for entry in entries if entry.id in edited_since], at)
+
+    rows = []
+    for entry in entries:
+        state = past.get(entry.id) or {field: getattr(entry, field) for field in AUDITED_FIELDS}
+        rows.append(dict(state, id=entry.id, created_by=entry.created_by, changed=entry.id in edited_since))
+    # An edit may have moved an entry's date
+    rows.sort(key=lambda row: (row['date'], row['id']))
+    return rows
+
+
+# --- Maintenance ---
+
+def compact():
+    """Snapshot every entry with AUDIT_SNAPSHOT_EVERY or more deltas since its last snapshot.
+
+    Edits already snapshot as they go; this catches up after the setting is
+    lowered or history is imported. Returns the number of snapshots written.
+    """
+    every = current_app.config['AUDIT_SNAPSHOT_EVERY']
+    newest = db.session.query(
+        LedgerEntrySnapshot.ledger_entry_id.label('entry_id'),
+        func.max(LedgerEntrySnapshot.id).label('snapshot_id')
+    ).group_by(LedgerEntrySnapshot.ledger_entry_id).subquery()
+    pending = db.session.query(LedgerEntrySnapshot, func.count(LedgerAudit.id)).join(
+        newest, LedgerEntrySnapshot.id == newest.c.snapshot_id
+    ).join(
+        LedgerAudit, and_(LedgerAudit.ledger_entry_id == LedgerEntrySnapshot.ledger_entry_id,
+                          LedgerAudit.id > func.coalesce(LedgerEntrySnapshot.audit_id, 0))
+    ).group_by(LedgerEntrySnapshot.id).having(func.count(LedgerAudit.id) >= every).all()
+
+    written = 0
+    for snapshot, _ in pending:
+        state = json.loads(snapshot.state)
+        deltas = LedgerAudit.query.filter(
+            LedgerAudit.ledger_entry_id == snapshot.ledger_entry_id,
+            LedgerAudit.id > (snapshot.audit_id or 0)
+        ).order_by(LedgerAudit.id).all()
+        for count, delta in enumerate(deltas, start=1):
+            state.update({field: new for field, (old, new) in json.loads(delta.changes).items()})
+            if count % every == 0:
+                db.session.add(LedgerEntrySnapshot(ledger_entry_id=snapshot.ledger_entry_id, audit_id=delta.id,
+                                                   taken_at=delta.changed_at, state=_dumps(state)))
+                written += 1
+    db.session.commit()
+    return written
+
+
+def import_legacy_history(rows):
+    """Convert per-field history rows into audit rows and snapshots.
+
+    `rows` are (ledger_entry_id, edited_by_id, edited_at, field_name,
+    old_value, new_value) tuples in edit order. Fields changed by the same
+    user within the same second were one edit and become one audit row.
+    Returns the number of audit rows written; the caller commits.
+    """
+    def legacy(field, value):
+        if field == 'amount' and value not in (None, ''):
+            try:
+                return to_satang(value)
+            except ArithmeticError:
+                return value
+        return value
+
+    edits = []
+    for entry_id, user_id, edited_at, field, old, new in rows:
+        if isinstance(edited_at, str):
+            edited_at = datetime.fromisoformat(edited_at)
+        key = (entry_id, user_id, edited_at.replace(microsecond=0))
+        if not edits or edits[-1][0] != key:
+            edits.append((key, edited_at, {}))
+        edits[-1][2][field] = [legacy(field, old), legacy(field, new)]
+
+    entries = {}
+    for i in range(0, len(edits), CHUNK):
+        ids = {key[0] for key, _, _ in edits[i:i + CHUNK]}
+        entries.update({entry.id: entry for entry in LedgerEntry.query.filter(LedgerEntry.id.in_(ids))})
+
+    # The state before the first edit: each field's oldest recorded old value, else its current value
+    first_old = {}
+    for (entry_id, _, _), _, changes in edits:
+        for field, (old, new) in changes.items():
+            first_old.setdefault(entry_id, {}).setdefault(field, old)
+    states = {}
+    for entry_id, entry in entries.items():
+        states[entry_id] = _state(entry)
+        states[entry_id].update(first_old.get(entry_id, {}))
+
+    written = 0
+    for (entry_id, user_id, _), edited_at, changes in edits:
+        entry = entries.get(entry_id)
+        if entry is None:
+            continue  # history of a deleted entry
+        _append(entry_id, entry.ledger_type, entry.created_at, user_id, edited_at, changes, states[entry_id])
+        states[entry_id].update({field: new for field, (old, new) in changes.items()})
+        written += 1
+    return written
+
+
+def init_app(app):
+    app.config.setdefault('AUDIT_SNAPSHOT_EVERY', 10)
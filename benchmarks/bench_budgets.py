@@ -0,0 +1,100 @@
+"""Cost of the budget check behind request_page/approve_action, against scanning the ledger.
+
+Seeds --rows ledger entries, sets a budget for every category of the current
+fiscal year, then times:
+
+  check        budgets.check(): primary-key lookups in ledger_category_total
+  scan         the same answer computed from ledger_entry (category spend in
+               the fiscal year plus the whole ledger's balance)
+  utilisation  budgets.utilisation(): the report for all three ledgers
+  scan report  the same report as one grouped query over ledger_entry
+
+    python benchmarks/bench_budgets.py --rows 200000
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import seed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def median_ms(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100_000, help='ledger entries to seed')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench_budgets.db')
+    seed.create_schema(path)
+    seed.seed(path, ledger_rows=args.rows, requests=100, history=0)
+    os.environ.update(DATABASE_URI=f'sqlite:///{path}', SECRET_KEY='bench')
+    sys.path.insert(0, ROOT)
+    logging.disable(logging.CRITICAL)
+    from sqlalchemy import case, func
+
+    from app import app
+    from models import db, LedgerEntry
+    from money import ZERO
+    import budgets
+    import ledger_book
+
+    today = date.today()
+    fiscal_year = ledger_book.fiscal_year_label(today)
+    fy_start = ledger_book.fiscal_year_start(today)
+
+    def scan_check(ledger_type, category, amount):
+        is_income = LedgerEntry.transaction_type == 'Income'
+        spent = db.session.query(func.coalesce(func.sum(LedgerEntry.amount), 0)).filter(
+            LedgerEntry.ledger_type == ledger_type, LedgerEntry.category == category,
+            LedgerEntry.date >= fy_start, ~is_income).scalar()
+        income, expense = db.session.query(
+            func.coalesce(func.sum(case((is_income, LedgerEntry.amount), else_=0)), 0),
+            func.coalesce(func.sum(case((~is_income, LedgerEntry.amount), else_=0)), 0)
+        ).filter(LedgerEntry.ledger_type == ledger_type).one()
+        return amount > budgets.allocation(ledger_type, category, fiscal_year) - spent, amount > income - expense
+
+    def scan_report():
+        is_income = LedgerEntry.transaction_type == 'Income'
+        return db.session.query(
+            LedgerEntry.ledger_type, LedgerEntry.category,
+            func.sum(case((is_income, LedgerEntry.amount), else_=0)),
+            func.sum(case((~is_income, LedgerEntry.amount), else_=0))
+        ).filter(LedgerEntry.date >= fy_start).group_by(LedgerEntry.ledger_type, LedgerEntry.category).all()
+
+    with app.app_context():
+        ledger_type, category = db.session.query(LedgerEntry.ledger_type, LedgerEntry.category).first()
+        for url_type, name in ledger_book.LEDGER_TYPES.items():
+            for each in set(ledger_book.LEDGER_CATEGORIES[url_type] + seed.CATEGORIES):
+                budgets.set_budget(fiscal_year, name, each, ZERO + 1_000_000, None)
+        db.session.commit()
+        amount = ZERO + 5000
+
+        print(f'{args.rows} ledger entries, fiscal year {fiscal_year}\n')
+        print(f"{'':14} {'median ms':>9}")
+        for name, func_ in (('check', lambda: budgets.check(ledger_type, category, amount, today)),
+                            ('scan', lambda: scan_check(ledger_type, category, amount)),
+                            ('utilisation', lambda: budgets.utilisation(fiscal_year)),
+                            ('scan report', scan_report)):
+            print(f'{name:14} {median_ms(func_, args.repeat):9.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""Concurrent read/write load test against the real app.
+
+Seeds a database, then runs reader processes (ledger page, JSON balances,
+approval list) and writer processes (new ledger entries through the
+ledger_view POST) against it at the same time, each with its own copy of
+the app as separate server workers would. Two configurations are compared:
+
+  default  sqlite3 driver defaults (rollback journal, deferred writes)
+  tuned    sqlite_tuning.py: WAL, synchronous=NORMAL, busy_timeout, BEGIN IMMEDIATE in write views
+
+For each it prints read latency percentiles, write throughput and how many
+requests failed (e.g. "database is locked").
+
+    python benchmarks/bench_concurrency.py --readers 8 --writers 4 --seconds 10
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import seed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r'''
+import json, logging, os, sys, time
+from datetime import date
+sys.path.insert(0, os.getcwd())
+logging.disable(logging.CRITICAL)
+from app import app
+
+role, n = sys.argv[1], int(sys.argv[2])
+READ_PATHS = ['/ledger/subsidy', '/api/v1/balances', '/approve']
+c = app.test_client()
+c.post('/login', data={'username': 'finance', 'password': 'pass1234'})
+c.get(READ_PATHS[0])  # warm the identity cache and the connection pool
+latencies, errors = [], {}
+# Tell the parent we are ready, then wait for the common start/stop times
+print('READY', flush=True)
+start_at, stop_at = map(float, sys.stdin.readline().split())
+time.sleep(max(0, start_at - time.time()))
+i = n
+while time.time() < stop_at:
+    started = time.perf_counter()
+    try:
+        if role == 'read':
+            response = c.get(READ_PATHS[i % len(READ_PATHS)])
+        else:
+            response = c.post('/ledger/subsidy', data={
+                'date': date.today().isoformat(), 'amount': '12.50', 'description': f'load {n}',
+                'transaction_type': 'Income', 'category': 'load test'
+            })
+        failed = None if response.status_code < 400 else f'HTTP {response.status_code}'
+    except Exception as e:
+        failed = str(e)[:80]
+    if failed:
+        errors[failed] = errors.get(failed, 0) + 1
+    else:
+        latencies.append((time.perf_counter() - started) * 1000)
+    i += 1
+print(json.dumps({'latencies': latencies, 'errors': errors}))
+'''
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else None
+
+
+def run(path, tuned, args):
+    # One process per client, like separate server workers, so the only thing
+    # they share is the database file (no GIL between them)
+    env = dict(os.environ,
+               DATABASE_URI=f'sqlite:///{path}',
+               SQLITE_TUNING='true' if tuned else 'false',
+               SECRET_KEY='bench')
+    procs = [
+        (role, subprocess.Popen(
+            [sys.executable, '-c', CHILD, role, str(n)],
+            cwd=ROOT, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, text=True
+        ))
+        for role, count in [('read', args.readers), ('write', args.writers)]
+        for n in range(count)
+    ]
+    # Start everyone at once, after the slowest worker has imported the app and logged in
+    for _, proc in procs:
+        proc.stdout.readline()
+    start_at = time.time() + 0.5
+    for _, proc in procs:
+        proc.stdin.write(f'{start_at} {start_at + args.seconds}\n')
+        proc.stdin.flush()
+    result = {'read': [], 'write': [], 'read_errors': 0, 'write_errors': 0, 'errors': {}}
+    for role, proc in procs:
+        out, _ = proc.communicate()
+        lines = out.strip().splitlines()
+        if not lines:
+            result[role + '_errors'] += 1
+            result['errors']['worker crashed'] = result['errors'].get('worker crashed', 0) + 1
+            continue
+        data = json.loads(lines[-1])
+        result[role] += data['latencies']
+        for message, count in data['errors'].items():
+            result[role + '_errors'] += count
+            result['errors'][message] = result['errors'].get(message, 0) + count
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=50_000, help='ledger entries to seed')
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    template = os.path.join(workdir, 'template.db')
+    seed.create_schema(template)
+    seed.seed(template, ledger_rows=args.rows, requests=2_000, history=2_000)
+
+    print(f'{args.readers} readers, {args.writers} writers, {args.seconds:.0f}s, {args.rows:,} rows')
+    print(f"{'config':8} {'reads':>7} {'writes':>7} {'read p50':>9} {'read p95':>9} {'read max':>9} "
+          f"{'write p95':>9} {'errors r/w':>11}")
+    for name, tuned in [('default', False), ('tuned', True)]:
+        path = os.path.join(workdir, f'{name}.db')
+        shutil.copy(template, path)
+        r = run(path, tuned, args)
+        fmt = lambda v: f'{v:8.1f}ms' if v is not None else '        -'
+        print(f"{name:8} {len(r['read']):7d} {len(r['write']):7d} {fmt(pct(r['read'], 0.50))} "
+              f"{fmt(pct(r['read'], 0.95))} {fmt(max(r['read'], default=None))} {fmt(pct(r['write'], 0.95))} "
+              f"{r['read_errors']:5d}/{r['write_errors']:<5d}")
+        for message, count in r['errors'].items():
+            print(f'         {count:5d} x {message}')
+
+    shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Throughput benchmark for the bulk ledger import (ledger_import.py).
+
+Generates a CSV and an .xlsx file of N subsidy rows in the app's export
+layout (with a sprinkling of invalid rows), then imports each into a fresh
+database twice: once as a dry run (read + validate only) and once for real
+(batched executemany INSERT + daily balance bookkeeping + one commit per
+batch). Prints rows per second for every run and checks the stored
+balances afterwards.
+
+    python benchmarks/bench_import.py --rows 50000 --batch-size 1000
+"""
+import argparse
+import csv
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import seed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEADER = ['วันที่', 'หมวดหมู่', 'ผู้ทำรายการ', 'รายละเอียด', 'รายรับ', 'รายจ่าย', 'คงเหลือ', 'หมายเหตุ']
+CATEGORIES = ['ค่าจัดการเรียนการสอน', 'ค่าหนังสือเรียน', 'ค่าอุปกรณ์การเรียน', 'อื่นๆ']
+
+
+def rows(count, invalid_every):
+    rnd = random.Random(42)
+    start = date.today() - timedelta(days=365)
+    for i in range(count):
+        day = start + timedelta(days=(i * 365) // count)
+        amount = f'{rnd.randint(100, 500_000) / 100:.2f}'
+        income, expense = (amount, '') if rnd.random() < 0.3 else ('', amount)
+        if invalid_every and i % invalid_every == invalid_every - 1:
+            income, expense = '-5', ''
+        yield [day.strftime('%d/%m/%Y'), rnd.choice(CATEGORIES), 'finance', f'รายการ {i}',
+               income, expense, '', '']
+
+
+def write_csv(path, count, invalid_every):
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['ทะเบียนคุมเงินอุดหนุน'])
+        writer.writerow(HEADER)
+        writer.writerows(rows(count, invalid_every))
+
+
+def write_xlsx(path, count, invalid_every):
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet()
+    worksheet.append(['ทะเบียนคุมเงินอุดหนุน'])
+    worksheet.append(HEADER)
+    for row in rows(count, invalid_every):
+        worksheet.append(row)
+    workbook.save(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=50_000, help='rows per generated file')
+    parser.add_argument('--batch-size', type=int, default=1000, help='rows per INSERT/commit')
+    parser.add_argument('--invalid-every', type=int, default=100, help='make every Nth row invalid (0 = none)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, 'bench_import.db')
+    seed.create_schema(db_path)
+    seed.seed(db_path, users=2, ledger_rows=0, requests=0, history=0)
+    os.environ['DATABASE_URI'] = f'sqlite:///{db_path}'
+    sys.path.insert(0, ROOT)
+    logging.disable(logging.CRITICAL)
+
+    from app import app
+    import ledger_book
+    from ledger_import import LedgerImport
+
+    files = {'csv': os.path.join(workdir, 'import.csv'), 'xlsx': os.path.join(workdir, 'import.xlsx')}
+    print(f'Generating {args.rows:,} rows per file in {workdir} ...')
+    write_csv(files['csv'], args.rows, args.invalid_every)
+    write_xlsx(files['xlsx'], args.rows, args.invalid_every)
+
+    print(f"\n{'file':6} {'mode':8} {'rows':>8} {'valid':>8} {'errors':>7} {'seconds':>8} {'rows/s':>9}")
+    with app.app_context():
+        for name, path in files.items():
+            for dry_run in (True, False):
+                job = LedgerImport('subsidy', user_id=1, dry_run=dry_run, batch_size=args.batch_size)
+                started = time.perf_counter()
+                with open(path, 'rb') as f:
+                    result = job.run(f, path)
+                elapsed = time.perf_counter() - started
+                print(f"{name:6} {'dry-run' if dry_run else 'import':8} {result.total:8,} {result.valid:8,} "
+                      f'{result.error_count:7,} {elapsed:8.2f} {result.total / elapsed:9,.0f}')
+        mismatches = ledger_book.verify_balances()
+    print(f"\nDaily balances: {'OK' if not mismatches else f'{len(mismatches)} mismatching days'}")
+
+
+if __name__ == '__main__':
+    main()
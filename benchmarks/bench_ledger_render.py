@@ -0,0 +1,142 @@
+"""Render time and memory of the ledger entries table, before and after ledger_rows.py.
+
+Seeds a database, then renders one page holding every entry of a ledger
+over its whole range (about --rows / 3 entries) two ways, inside a request
+context as ledger_view would:
+
+  before  ORM query with joinedload (LedgerEntry, User, ExpenseRequest objects),
+          running balance, creator lookup and "{:,.2f}" formatting in the Jinja loop
+  after   column-only query + ledger_rows.build() in Python + _ledger_table.html
+
+For each it prints the median wall time and the peak memory allocated while
+rendering (tracemalloc), which tracks the objects built per request.
+
+    python benchmarks/bench_ledger_render.py --rows 30000
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import seed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The table loop as it was in page6_subsidy.html before ledger_rows.py
+LEGACY_TABLE = '''
+{% set ns = namespace(balance=opening_balance) %}
+{% for entry in entries %}
+{% if entry.transaction_type == 'Income' %}
+{% set ns.balance = ns.balance + entry.amount %}
+{% else %}
+{% set ns.balance = ns.balance - entry.amount %}
+{% endif %}
+<tr>
+    <td>{{ entry.date.strftime('%d/%m/%Y') }}</td>
+    <td>{{ entry.category }}</td>
+    <td>
+        {% if entry.expense_request %}
+        <span class="badge bg-info">{{ entry.expense_request.requester.name or
+            entry.expense_request.requester.username }}</span>
+        {% elif entry.created_by %}
+        <span class="badge bg-secondary">{{ entry.created_by.name or
+            entry.created_by.username }}</span>
+        {% else %}
+        <span class="text-muted">-</span>
+        {% endif %}
+    </td>
+    <td>{{ entry.description or '-' }}</td>
+    <td class="text-end text-success">
+        {% if entry.transaction_type == 'Income' %}{{ "{:,.2f}".format(entry.amount) }}{% endif %}
+    </td>
+    <td class="text-end text-danger">
+        {% if entry.transaction_type == 'Expense' %}{{ "{:,.2f}".format(entry.amount) }}{% endif %}
+    </td>
+    <td class="text-end fw-bold">{{ "{:,.2f}".format(ns.balance) }}</td>
+    <td>{{ entry.note or '-' }}</td>
+    <td class="text-center">
+        {% if current_user.role in ['finance', 'director'] %}
+        <a href="{{ url_for('edit_ledger_entry', type='subsidy', entry_id=entry.id) }}"
+            class="btn btn-sm btn-warning me-1">แก้ไข</a>
+        <a href="{{ url_for('ledger_history', entry_id=entry.id) }}"
+            class="btn btn-sm btn-info">ประวัติ</a>
+        {% endif %}
+    </td>
+</tr>
+{% endfor %}
+'''
+
+
+def measure(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(timings) * 1000, peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=30_000, help='ledger entries to seed (over 3 ledgers)')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per variant (median is reported)')
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench_render.db')
+    seed.create_schema(path)
+    seed.seed(path, ledger_rows=args.rows, requests=2_000, history=0)
+    os.environ['DATABASE_URI'] = f'sqlite:///{path}'
+    sys.path.insert(0, ROOT)
+    logging.disable(logging.CRITICAL)
+
+    from flask import render_template, render_template_string, url_for
+    from flask_login import login_user
+    from sqlalchemy.orm import joinedload
+    from app import app
+    from models import db, User, ExpenseRequest, LedgerEntry
+    import ledger_rows
+
+    start, end = date(2000, 1, 1), date(2100, 1, 1)
+
+    def before():
+        entries = LedgerEntry.query.filter_by(ledger_type='Subsidy').filter(
+            LedgerEntry.date >= start, LedgerEntry.date <= end
+        ).options(
+            joinedload(LedgerEntry.created_by),
+            joinedload(LedgerEntry.expense_request).joinedload(ExpenseRequest.requester)
+        ).order_by(LedgerEntry.date, LedgerEntry.id).all()
+        html = render_template_string(LEGACY_TABLE, entries=entries, opening_balance=0)
+        db.session.expunge_all()  # each request starts with an empty identity map
+        return html
+
+    def after():
+        tuples, _, _ = ledger_rows.fetch('Subsidy', start, end, limit=10 ** 9)
+        return render_template('_ledger_table.html', rows=ledger_rows.build(tuples), opening_balance='0.00',
+                               ledger_type='subsidy',
+                               edit_prefix=url_for('edit_ledger_entry', type='subsidy', entry_id=0)[:-1],
+                               history_prefix=url_for('ledger_history', entry_id=0)[:-1])
+
+    with app.test_request_context('/ledger/subsidy'):
+        login_user(User.query.filter_by(username='finance').first())
+        count = LedgerEntry.query.filter_by(ledger_type='Subsidy').count()
+        before(), after()  # compile templates, warm the page cache
+        print(f'Rendering {count:,} subsidy entries ({args.repeat} runs each)\n')
+        print(f"{'variant':8} {'median ms':>10} {'peak MiB':>9}")
+        for name, func in (('before', before), ('after', after)):
+            ms, peak = measure(func, args.repeat)
+            print(f'{name:8} {ms:10.1f} {peak:9.1f}')
+
+
+if __name__ == '__main__':
+    main()
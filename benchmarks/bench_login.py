@@ -0,0 +1,76 @@
+"""Cost of a login: password hashing per PASSWORD_HASH_METHOD, and a throttled attempt.
+
+Prints the CPU time of one password check for a few Werkzeug methods (what
+PASSWORD_HASH_METHOD trades against brute-force resistance), then, through
+the test client, the latency of a real login against one refused by
+login_throttle.py, which never reaches the hash.
+
+    python benchmarks/bench_login.py
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import seed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+METHODS = ['scrypt:32768:8:1', 'scrypt:16384:8:1', 'pbkdf2:sha256:600000', 'pbkdf2:sha256:260000']
+
+
+def median_ms(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'method':24} {'check ms':>9}")
+    for method in METHODS:
+        stored = generate_password_hash('pass1234', method=method)
+        print(f'{method:24} {median_ms(lambda: check_password_hash(stored, "pass1234"), args.repeat):9.1f}')
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench_login.db')
+    seed.create_schema(path)
+    seed.seed(path, users=10, ledger_rows=1_000, requests=100, history=0)
+    os.environ.update(DATABASE_URI=f'sqlite:///{path}', SECRET_KEY='bench')
+    sys.path.insert(0, ROOT)
+    logging.disable(logging.CRITICAL)
+    from app import app
+    import login_throttle
+
+    client = app.test_client()
+
+    def login():
+        client.post('/login', data={'username': 'finance', 'password': 'pass1234'})
+        client.get('/logout')
+
+    def refused():
+        response = client.post('/login', data={'username': 'director', 'password': 'wrong'})
+        assert response.status_code == 429
+
+    for _ in range(app.config['LOGIN_THROTTLE_USER_LIMIT']):
+        client.post('/login', data={'username': 'director', 'password': 'wrong'})
+    login()
+    print(f"\n{'request':24} {'median ms':>9}")
+    print(f"{'login (' + app.config['PASSWORD_HASH_METHOD'] + ')':24} {median_ms(login, args.repeat):9.1f}")
+    print(f"{'throttled attempt':24} {median_ms(refused, args.repeat):9.1f}")
+    print(f"\nthrottle: {login_throttle.stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Per-request cost of the metrics (metrics.py) and SQL profiling hooks.
+
+Seeds a small database, logs in as finance and times a few cheap routes
+through the test client with METRICS_ENABLED on and off. The two passes are
+interleaved in rounds so drift hits both alike; the difference of the
+medians is the overhead per request. Then times the building blocks on
+their own: Counter.inc(), Histogram.observe() and rendering /metrics.
+
+    python benchmarks/bench_metrics.py --iterations 2000
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import seed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'pass1234'
+
+ROUTES = [
+    ('login_page', '/login'),
+    ('api_balances', '/api/v1/balances'),
+    ('index', '/'),
+]
+
+
+def per_call_us(func, count):
+    started = time.perf_counter()
+    for _ in range(count):
+        func()
+    return (time.perf_counter() - started) / count * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10_000, help='ledger entries to seed')
+    parser.add_argument('--iterations', type=int, default=2_000, help='requests per route and setting')
+    parser.add_argument('--rounds', type=int, default=10)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench_metrics.db')
+    seed.create_schema(path)
+    seed.seed(path, users=10, ledger_rows=args.rows, requests=100, history=100)
+    os.environ.update(DATABASE_URI=f'sqlite:///{path}', SECRET_KEY='bench', SQL_PROFILE='false')
+    sys.path.insert(0, ROOT)
+    logging.disable(logging.CRITICAL)
+
+    from app import app
+    import metrics
+
+    app.config['SLOW_REQUEST_MS'] = 0  # time the hooks, not the slow-request log
+    client = app.test_client()
+    client.post('/login', data={'username': 'finance', 'password': PASSWORD})
+
+    per_round = max(args.iterations // args.rounds, 1)
+    print(f'{per_round * args.rounds} requests per route and setting\n')
+    print(f"{'route':14} {'off us':>9} {'on us':>9} {'overhead us':>12}")
+    for name, url in ROUTES:
+        timings = {False: [], True: []}
+        for enabled in (False, True):  # warm up both paths
+            app.config['METRICS_ENABLED'] = enabled
+            client.get(url)
+        for _ in range(args.rounds):
+            for enabled in (False, True):
+                app.config['METRICS_ENABLED'] = enabled
+                timings[enabled].append(per_call_us(lambda: client.get(url), per_round))
+        off, on = statistics.median(timings[False]), statistics.median(timings[True])
+        print(f'{name:14} {off:9.0f} {on:9.0f} {on - off:12.1f}')
+
+    count = 200_000
+    inc = per_call_us(lambda: metrics.REQUESTS.inc(endpoint='bench', method='GET', status='200'), count)
+    observe = per_call_us(lambda: metrics.REQUEST_SECONDS.observe(0.0123, endpoint='bench'), count)
+    series = sum(len(list(metric.samples())) for metric in metrics._registry)
+    render = per_call_us(metrics.exposition, 200)
+    print(f'\nCounter.inc {inc:.2f} us, Histogram.observe {observe:.2f} us, '
+          f'exposition {render / 1000:.2f} ms ({series} samples)')
+
+
+if __name__ == '__main__':
+    main()
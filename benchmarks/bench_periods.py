@@ -0,0 +1,107 @@
+"""Month-end close (periods.py): the hot ledger reads with every month open, closed, then archived.
+
+Seeds --rows ledger entries over --years years, then for one ledger times:
+
+  totals   ledger_book.period_totals() over the whole history (balance card)
+  before   ledger_book.balance_before() for the newest entry (running
+           balance of a deep page)
+  export   LedgerExport CSV of the ledger (rows written in brackets)
+
+first with no month closed, then after closing every finished month, then
+after archiving them (ledger_entry then only holds the open month).
+
+    python benchmarks/bench_periods.py --rows 300000
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import seed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def median_ms(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=300_000, help='ledger entries to seed')
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench_periods.db')
+    seed.create_schema(path)
+    seed.seed(path, ledger_rows=args.rows, requests=100, history=args.rows // 100, years=args.years)
+    os.environ.update(DATABASE_URI=f'sqlite:///{path}', SECRET_KEY='bench')
+    sys.path.insert(0, ROOT)
+    logging.disable(logging.CRITICAL)
+
+    from app import app
+    from ledger_export import LedgerExport
+    from models import db, LedgerEntry
+    import ledger_book
+    import periods
+
+    today = date.today()
+    first_day = today - timedelta(days=365 * args.years)
+    month_start = today.replace(day=1)
+
+    def export():
+        latest = periods.latest_close(ledger_type)
+        start = periods.next_month(latest.month) if latest else None
+        run = LedgerExport(ledger_type, 'bench', month_start, today, start=start,
+                           opening_balance=latest.closing_balance if latest else None)
+        for _ in run.iter_csv():
+            pass
+        return run.row_count
+
+    with app.app_context():
+        db.create_all()  # period/archive tables
+        ledger_type = db.session.query(LedgerEntry.ledger_type).first()[0]
+        print(f'{args.rows} ledger entries over {args.years} years, ledger {ledger_type}\n')
+        print(f"{'stage':10} {'entries':>8} {'totals ms':>10} {'before ms':>10} {'export ms':>16}")
+
+        def report(stage):
+            live = LedgerEntry.query.filter_by(ledger_type=ledger_type).count()
+            newest = LedgerEntry.query.filter_by(ledger_type=ledger_type).order_by(
+                LedgerEntry.date.desc(), LedgerEntry.id.desc()).first()
+            totals = median_ms(lambda: ledger_book.period_totals(ledger_type, first_day, today), args.repeat)
+            before = median_ms(lambda: ledger_book.balance_before(
+                ledger_type, first_day, newest.date, newest.id), args.repeat)
+            rows = export()
+            export_ms = median_ms(export, max(args.repeat // 5, 1))
+            print(f'{stage:10} {live:8d} {totals:10.2f} {before:10.2f} {export_ms:9.0f} ({rows:5d})')
+
+        report('open')
+        last_month = month_start - timedelta(days=1)
+        started = time.perf_counter()
+        closed = periods.close_through(ledger_type, last_month, None)
+        db.session.commit()
+        print(f'  closed {len(closed)} months in {(time.perf_counter() - started) * 1000:.0f} ms')
+        report('closed')
+        started = time.perf_counter()
+        moved = periods.archive_through(ledger_type, last_month)
+        db.session.commit()
+        print(f'  archived {moved} entries in {time.perf_counter() - started:.1f} s')
+        report('archived')
+        problems = ledger_book.verify_balances() + periods.verify()
+        print(f'\nverify: {"ok" if not problems else problems[:3]}')
+
+
+if __name__ == '__main__':
+    main()
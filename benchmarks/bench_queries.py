@@ -0,0 +1,109 @@
+"""Query-plan and latency benchmark for the hot route queries.
+
+Seeds a synthetic database, then runs the SQL issued by ledger_view,
+export_ledger, approve_page, my_requests and ledger_history twice: first
+without the composite indexes from models.py, then with them. For every
+query it prints the EXPLAIN QUERY PLAN output and the median latency.
+
+    python benchmarks/bench_queries.py --rows 1000000
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import seed
+
+YEAR_START = date(date.today().year, 1, 1).isoformat()
+TODAY = date.today().isoformat()
+MONTH_START = date.today().replace(day=1).isoformat()
+
+# (name, sql, params) mirroring the statements the routes emit
+QUERIES = [
+    ('ledger_view: entries in range',
+     'SELECT * FROM ledger_entry WHERE ledger_type = ? AND date >= ? AND date <= ? ORDER BY date',
+     ('Subsidy', YEAR_START, TODAY)),
+    ('ledger_view: deep keyset page',
+     'SELECT * FROM ledger_entry WHERE ledger_type = ? AND date >= ? AND date <= ? '
+     'AND (date, id) > (?, ?) ORDER BY date, id LIMIT 101',
+     ('Subsidy', MONTH_START, TODAY, MONTH_START, 0)),
+    ('ledger_view: period sum (legacy get_sum)',
+     'SELECT sum(amount) FROM ledger_entry WHERE ledger_type = ? AND transaction_type = ? '
+     'AND date >= ? AND date <= ?',
+     ('Subsidy', 'Income', YEAR_START, TODAY)),
+    ('ledger_view: period totals (daily table)',
+     'SELECT coalesce(sum(income), 0), coalesce(sum(expense), 0) FROM ledger_daily_balance '
+     'WHERE ledger_type = ? AND date >= ? AND date <= ?',
+     ('Subsidy', MONTH_START, TODAY)),
+    ('export_ledger: whole ledger',
+     'SELECT * FROM ledger_entry WHERE ledger_type = ? ORDER BY date',
+     ('Lunch',)),
+    ('approve_page: open requests',
+     "SELECT * FROM expense_request WHERE status != 'APPROVED' ORDER BY date, id",
+     ()),
+    ('my_requests: by requester',
+     'SELECT * FROM expense_request WHERE requester_id = ? ORDER BY date DESC',
+     (5,)),
+    ('ledger_history: by entry',
+     'SELECT * FROM ledger_audit WHERE ledger_entry_id = ? ORDER BY id DESC',
+     (1234,)),
+    ('ledger_as_of: entries edited since',
+     'SELECT DISTINCT ledger_entry_id FROM ledger_audit WHERE ledger_type = ? AND changed_at > ?',
+     ('Subsidy', MONTH_START)),
+]
+
+
+def run(path, repeat):
+    conn = sqlite3.connect(path)
+    results = {}
+    for name, sql, params in QUERIES:
+        plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            conn.execute(sql, params).fetchall()
+            timings.append((time.perf_counter() - started) * 1000)
+        results[name] = (plan, statistics.median(timings))
+    conn.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000, help='ledger entries to seed')
+    parser.add_argument('--requests', type=int, default=50_000, help='expense requests to seed')
+    parser.add_argument('--history', type=int, default=100_000, help='history rows to seed')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per query (median is reported)')
+    parser.add_argument('--db', help='database path (default: a temporary file)')
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), 'bench_queries.db')
+    print(f'Seeding {args.rows:,} ledger rows into {path} ...')
+    started = time.perf_counter()
+    seed.create_schema(path, with_indexes=False)
+    seed.seed(path, ledger_rows=args.rows, requests=args.requests, history=args.history)
+    print(f'Seeded in {time.perf_counter() - started:.1f}s')
+
+    before = run(path, args.repeat)
+    seed.create_indexes(path)
+    after = run(path, args.repeat)
+
+    for name, _, _ in QUERIES:
+        plan_before, ms_before = before[name]
+        plan_after, ms_after = after[name]
+        print(f'\n== {name}')
+        print(f'   before: {ms_before:9.2f} ms  | ' + ' / '.join(plan_before))
+        print(f'   after:  {ms_after:9.2f} ms  | ' + ' / '.join(plan_after))
+
+    if not args.db:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
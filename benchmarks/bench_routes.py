@@ -0,0 +1,338 @@
+"""Route-level benchmark suite with a JSON baseline for regression checks.
+
+Seeds a synthetic school (users, years of entries over the three ledgers,
+expense requests in every approval state, audit history), then measures the
+user-facing routes two ways:
+
+  client  each route through the Flask test client, one request at a time:
+          p50/p95/p99 latency, SQL statements per request (X-Query-Count from
+          query_profiler.py) and the peak memory allocated by one request
+          (tracemalloc, measured in a separate untimed pass)
+  load    the app served over HTTP by a threaded werkzeug server in its own
+          process, driven by --clients concurrent sessions for --seconds:
+          throughput and p50/p95/p99 latency per route
+
+Routes: login, index, ledger_view (cached and cold fragment cache, plus a
+deep page), export_ledger, approve_page, approve_action, my_requests and
+search.
+
+    python benchmarks/bench_routes.py --save baseline.json
+    python benchmarks/bench_routes.py --compare baseline.json
+
+--compare exits with status 1 when a route's p95 or peak memory grew by more
+than --tolerance (plus --slack-ms for very fast routes), or when a route
+issues more SQL statements than in the baseline. Use the same seed sizes for
+both runs; they are stored in the baseline and a mismatch is reported.
+"""
+import argparse
+import http.cookiejar
+import json
+import logging
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import seed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'pass1234'
+
+SERVER = r'''
+import logging, os, sys
+sys.path.insert(0, os.getcwd())
+logging.disable(logging.CRITICAL)
+from werkzeug.serving import make_server
+from app import app
+server = make_server('127.0.0.1', 0, app, threaded=True)
+print(server.server_port, flush=True)
+server.serve_forever()
+'''
+
+# (name, path) requests each load client cycles through after logging in as finance
+LOAD_MIX = [
+    ('index', '/'),
+    ('ledger_view', '/ledger/subsidy'),
+    ('ledger_view', '/ledger/income'),
+    ('ledger_view', '/ledger/lunch'),
+    ('approve_page', '/approve'),
+    ('api_balances', '/api/v1/balances'),
+]
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else None
+
+
+def summary(latencies):
+    return {
+        'n': len(latencies),
+        'p50_ms': round(pct(latencies, 0.50), 2),
+        'p95_ms': round(pct(latencies, 0.95), 2),
+        'p99_ms': round(pct(latencies, 0.99), 2),
+    }
+
+
+# --- Test client pass ---
+
+def client_scenarios(app, args):
+    """(name, username, iterations, make_request) per route; make_request(client, i) -> response.
+
+    make_request is called with i = 0 .. iterations (one warm-up, the timed runs, one traced run).
+    """
+    from models import ExpenseRequest
+    import fragment_cache
+
+    with app.app_context():
+        # Requests only the director has signed: a finance approval completes them and posts an entry
+        approvable = [req_id for (req_id,) in ExpenseRequest.query.with_entities(ExpenseRequest.id).filter(
+            ExpenseRequest.status != 'APPROVED',
+            ExpenseRequest.finance_approved_at.is_(None),
+            ExpenseRequest.director_approved_at.isnot(None)
+        ).order_by(ExpenseRequest.id).limit(args.iterations + 1).all()]
+
+    # A page halfway through the seeded years: the opening balance covers everything before it
+    start = date.today() - timedelta(days=365 * args.years)
+    middle = start + timedelta(days=365 * args.years // 2)
+    deep = f'/ledger/subsidy?balance_start={start}&balance_end={date.today()}&after={middle}_0'
+
+    def cold_ledger(client, i):
+        fragment_cache.clear()
+        return client.get('/ledger/subsidy')
+
+    def export(client, i):
+        # Alternating formats keeps one artifact per format; later runs reuse it as production would
+        return client.get(f'/export/{seed.LEDGER_TYPES[i % 3].lower()}?format={"csv" if i % 2 else "xlsx"}')
+
+    return [
+        ('login', None, args.login_iterations,
+         lambda client, i: client.post('/login', data={'username': 'finance', 'password': PASSWORD})),
+        ('index', 'finance', args.iterations, lambda client, i: client.get('/')),
+        ('ledger_view', 'finance', args.iterations, lambda client, i: client.get('/ledger/subsidy')),
+        ('ledger_view_cold', 'finance', args.iterations, cold_ledger),
+        ('ledger_view_deep_page', 'finance', args.iterations, lambda client, i: client.get(deep)),
+        ('export_ledger', 'finance', args.iterations, export),
+        ('approve_page', 'finance', args.iterations, lambda client, i: client.get('/approve')),
+        ('approve_action', 'finance', len(approvable) - 1,
+         lambda client, i: client.get(f'/approve/{approvable[i]}')),
+        ('my_requests', 'teacher003', args.iterations, lambda client, i: client.get('/my-requests')),
+        ('search', 'finance', args.iterations,
+         lambda client, i: client.get(f'/search?q={seed.ITEMS[i % len(seed.ITEMS)]}&ledger=subsidy')),
+    ]
+
+
+def run_client(app, args):
+    results = {}
+    for name, username, iterations, make_request in client_scenarios(app, args):
+        if iterations < 1:
+            continue
+        client = app.test_client()
+        if username:
+            client.post('/login', data={'username': username, 'password': PASSWORD})
+        make_request(client, 0)  # warm up: templates, connection pool, identity cache
+
+        latencies, queries = [], []
+        for i in range(1, iterations):
+            started = time.perf_counter()
+            response = make_request(client, i)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                raise SystemExit(f'{name}: HTTP {response.status_code}')
+            queries.append(int(response.headers.get('X-Query-Count', 0)))
+
+        # Peak allocation of one more request, outside the timed loop (tracemalloc slows everything)
+        tracemalloc.start()
+        make_request(client, iterations)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        results[name] = dict(summary(latencies or [0.0]), queries=max(queries, default=0),
+                             peak_kib=round(peak / 1024))
+        print(f"{name:22} {results[name]['n']:5d} {results[name]['p50_ms']:9.1f} {results[name]['p95_ms']:9.1f} "
+              f"{results[name]['p99_ms']:9.1f} {results[name]['queries']:8d} {results[name]['peak_kib']:9d}")
+    return results
+
+
+# --- Concurrent HTTP pass ---
+
+def run_load(env, args):
+    server = subprocess.Popen([sys.executable, '-c', SERVER], cwd=ROOT, env=env,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    try:
+        port = int(server.stdout.readline())
+        base = f'http://127.0.0.1:{port}'
+        latencies = {name: [] for name, _ in LOAD_MIX}
+        errors = {}
+        lock = threading.Lock()
+        # Everyone starts once the last client has logged in, and stops args.seconds later
+        deadline = []
+        ready = threading.Barrier(args.clients, action=lambda: deadline.append(time.time() + args.seconds))
+
+        def client(n):
+            opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+            opener.open(base + '/login', urllib.parse.urlencode(
+                {'username': 'finance', 'password': PASSWORD}).encode()).read()
+            mine = {name: [] for name, _ in LOAD_MIX}
+            failed = {}
+            ready.wait()
+            i = n
+            while time.time() < deadline[0]:
+                name, path = LOAD_MIX[i % len(LOAD_MIX)]
+                started = time.perf_counter()
+                try:
+                    opener.open(base + path, timeout=30).read()
+                    mine[name].append((time.perf_counter() - started) * 1000)
+                except (urllib.error.URLError, OSError) as e:
+                    message = str(getattr(e, 'code', None) or e)[:80]
+                    failed[message] = failed.get(message, 0) + 1
+                i += 1
+            with lock:
+                for name, values in mine.items():
+                    latencies[name] += values
+                for message, count in failed.items():
+                    errors[message] = errors.get(message, 0) + count
+
+        threads = [threading.Thread(target=client, args=(n,)) for n in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    total = sum(len(values) for values in latencies.values())
+    result = {
+        'clients': args.clients,
+        'seconds': args.seconds,
+        'requests': total,
+        'rps': round(total / args.seconds, 1),
+        'errors': errors,
+        'routes': {name: summary(values) for name, values in latencies.items() if values},
+    }
+    print(f"\n{args.clients} clients over HTTP for {args.seconds:.0f}s: {total} requests, "
+          f"{result['rps']} req/s, {sum(errors.values())} errors")
+    for name, stats in result['routes'].items():
+        print(f"{name:22} {stats['n']:5d} {stats['p50_ms']:9.1f} {stats['p95_ms']:9.1f} {stats['p99_ms']:9.1f}")
+    for message, count in errors.items():
+        print(f'    {count:5d} x {message}')
+    return result
+
+
+# --- Baseline comparison ---
+
+def compare(baseline, current, tolerance, slack_ms):
+    """Human-readable regressions of `current` against `baseline` (empty if none)."""
+    problems = []
+    if baseline.get('seed') != current['seed']:
+        problems.append(f"seed sizes differ: baseline {baseline.get('seed')} vs {current['seed']}")
+
+    def slower(section, name, old, new):
+        limit = old['p95_ms'] * (1 + tolerance) + slack_ms
+        if new['p95_ms'] > limit:
+            problems.append(f"{section} {name}: p95 {new['p95_ms']:.1f} ms > {limit:.1f} ms "
+                            f"(baseline {old['p95_ms']:.1f} ms)")
+
+    for name, old in baseline.get('client', {}).items():
+        new = current['client'].get(name)
+        if new is None:
+            problems.append(f'client {name}: not measured')
+            continue
+        slower('client', name, old, new)
+        if new['queries'] > old['queries']:
+            problems.append(f"client {name}: {new['queries']} queries per request (baseline {old['queries']})")
+        if new['peak_kib'] > old['peak_kib'] * (1 + tolerance) + 64:
+            problems.append(f"client {name}: peak {new['peak_kib']} KiB (baseline {old['peak_kib']} KiB)")
+
+    if baseline.get('load') and current.get('load'):
+        for name, old in baseline['load']['routes'].items():
+            new = current['load']['routes'].get(name)
+            if new is not None:
+                slower('load', name, old, new)
+        if sum(current['load']['errors'].values()) > sum(baseline['load']['errors'].values()):
+            problems.append(f"load: {sum(current['load']['errors'].values())} failed requests "
+                            f"(baseline {sum(baseline['load']['errors'].values())})")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=60, help='users to seed (2 approvers, the rest teachers)')
+    parser.add_argument('--rows', type=int, default=100_000, help='ledger entries to seed (over 3 ledgers)')
+    parser.add_argument('--requests', type=int, default=5_000, help='expense requests to seed')
+    parser.add_argument('--history', type=int, default=5_000, help='ledger edits to seed')
+    parser.add_argument('--years', type=int, default=3, help='years of entries')
+    parser.add_argument('--iterations', type=int, default=50, help='test client requests per route')
+    parser.add_argument('--login-iterations', type=int, default=10, help='logins (password hashing is slow)')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent HTTP clients (0 skips the load pass)')
+    parser.add_argument('--seconds', type=float, default=10, help='duration of the load pass')
+    parser.add_argument('--save', metavar='FILE', help='write the results as a JSON baseline')
+    parser.add_argument('--compare', metavar='FILE', help='fail if results regressed against this baseline')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed relative growth (0.5 = 50%%)')
+    parser.add_argument('--slack-ms', type=float, default=5.0, help='allowed absolute p95 growth on top')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    path = os.path.join(workdir, 'bench_routes.db')
+    seed.create_schema(path)
+    sizes = seed.seed(path, users=args.users, ledger_rows=args.rows, requests=args.requests,
+                      history=args.history, years=args.years)
+    sizes['years'] = args.years
+    template = os.path.join(workdir, 'template.db')
+    with sqlite3.connect(path) as source, sqlite3.connect(template) as target:
+        source.backup(target)  # the load pass gets the data untouched by approve_action
+
+    env = dict(os.environ, DATABASE_URI=f'sqlite:///{template}', SQL_PROFILE='true', SECRET_KEY='bench')
+    os.environ.update(env, DATABASE_URI=f'sqlite:///{path}')
+    sys.path.insert(0, ROOT)
+    logging.disable(logging.CRITICAL)
+    from app import app
+    app.config['JOB_ARTIFACT_DIR'] = os.path.join(workdir, 'artifacts')  # keep export files out of instance/
+    os.makedirs(app.config['JOB_ARTIFACT_DIR'])
+
+    print(f"Seeded {sizes['users']} users, {sizes['ledger_rows']:,} entries, {sizes['requests']:,} requests, "
+          f"{sizes['history']:,} edits\n")
+    print(f"{'route':22} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8} {'peak KiB':>9}")
+    results = {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+        },
+        'seed': sizes,
+        'client': run_client(app, args),
+        'load': run_load(env, args) if args.clients else None,
+    }
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f'\nBaseline written to {args.save}')
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            problems = compare(json.load(f), results, args.tolerance, args.slack_ms)
+        if problems:
+            print(f'\n{len(problems)} regression(s) against {args.compare}:')
+            for problem in problems:
+                print(f'  {problem}')
+            sys.exit(1)
+        print(f'\nNo regressions against {args.compare}')
+
+
+if __name__ == '__main__':
+    main()
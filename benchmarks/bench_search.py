@@ -0,0 +1,81 @@
+"""Full-text search (search.py, FTS5 trigram index) against LIKE scans of the ledger.
+
+Seeds --rows ledger entries (seed.py builds the search indexes too), then
+times one page (50 rows) of search_ledger() for a few queries, with and
+without filters, next to the same query as LIKE '%term%' over ledger_entry.
+
+    python benchmarks/bench_search.py --rows 1000000
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import seed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUERIES = [
+    ('common word', 'หนังสือ', {}),
+    ('two words', 'ประปา รายการที่', {}),
+    ('rare', 'รายการที่ 123456', {}),
+    ('no match', 'ไม่มีคำนี้', {}),
+    ('filtered', 'ค่ายลูกเสือ', {'ledger_type': 'Lunch', 'category': 'อื่นๆ'}),
+]
+
+
+def median_ms(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000, help='ledger entries to seed')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench_search.db')
+    seed.create_schema(path)
+    seed.seed(path, ledger_rows=args.rows, requests=1_000, history=0)
+    os.environ.update(DATABASE_URI=f'sqlite:///{path}', SECRET_KEY='bench')
+    sys.path.insert(0, ROOT)
+    logging.disable(logging.CRITICAL)
+    from sqlalchemy import or_
+
+    from app import app
+    from models import LedgerEntry
+    import search
+
+    with app.app_context():
+        started = time.perf_counter()
+        search.rebuild()
+        print(f'{args.rows} ledger entries, indexes rebuilt in {time.perf_counter() - started:.1f}s\n')
+
+        def like_scan(query, filters):
+            q = LedgerEntry.query
+            for term in query.split():
+                q = q.filter(or_(LedgerEntry.description.like(f'%{term}%'), LedgerEntry.note.like(f'%{term}%')))
+            for name, value in filters.items():
+                q = q.filter(getattr(LedgerEntry, name) == value)
+            return q.order_by(LedgerEntry.id.desc()).limit(51).all()
+
+        print(f"{'query':14} {'rows':>5} {'fts ms':>8} {'like ms':>9}")
+        for name, query, filters in QUERIES:
+            rows, _ = search.search_ledger(query, **filters)
+            fts = median_ms(lambda: search.search_ledger(query, **filters), args.repeat)
+            like = median_ms(lambda: like_scan(query, filters), max(args.repeat // 5, 1))
+            print(f'{name:14} {len(rows):5d} {fts:8.2f} {like:9.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Cold-start benchmark: import time and memory of the app module.
+
+Each sample runs in a fresh interpreter so nothing is cached between runs.
+The "legacy" line imports pandas alongside the app, which is what every
+worker paid before the export engine became lazily loaded.
+
+    python benchmarks/bench_startup.py --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r'''
+import json, sys, time
+started = time.perf_counter()
+for name in sys.argv[1:]:
+    __import__(name)
+elapsed = time.perf_counter() - started
+rss = None
+try:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss = rss / 1024 if sys.platform != 'darwin' else rss / (1024 * 1024)  # -> MB
+except ImportError:
+    try:
+        import psutil
+        rss = psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        pass
+print(json.dumps({'seconds': elapsed, 'rss_mb': rss, 'modules': len(sys.modules)}))
+'''
+
+
+def sample(modules, runs):
+    results = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, '-c', CHILD, *modules],
+            cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    return results
+
+
+def report(label, results):
+    seconds = statistics.median(r['seconds'] for r in results) * 1000
+    rss = [r['rss_mb'] for r in results if r['rss_mb'] is not None]
+    rss_text = f'{statistics.median(rss):7.1f} MB' if rss else '    n/a'
+    print(f'{label:<28} import {seconds:8.1f} ms   peak RSS {rss_text}   modules {results[0]["modules"]}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    report('app', sample(['app'], args.runs))
+    report('app + ledger_export', sample(['app', 'ledger_export'], args.runs))
+    try:
+        report('legacy (app + pandas)', sample(['app', 'pandas'], args.runs))
+    except subprocess.CalledProcessError:
+        print('legacy (app + pandas)        skipped: pandas is not installed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Several schools on one deployment (tenants.py, district.py).
+
+Seeds one school database of --rows ledger entries and copies it --schools
+times into a TENANCY=path deployment with TENANT_ENGINE_CACHE=--cache, then:
+
+  requests  GET /school/<slug>/api/v1/balances as finance, cycling over
+            --cache schools (every engine stays open) and over all of them
+            (each request past the cache opens an engine and evicts one)
+  district  district.balances() with one worker, then with --workers
+
+    python benchmarks/bench_tenants.py --schools 24 --cache 8
+"""
+import argparse
+import logging
+import os
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import seed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'pass1234'
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--schools', type=int, default=24)
+    parser.add_argument('--rows', type=int, default=20_000, help='ledger entries per school')
+    parser.add_argument('--cache', type=int, default=8, help='TENANT_ENGINE_CACHE')
+    parser.add_argument('--requests', type=int, default=500, help='requests per pass')
+    parser.add_argument('--workers', type=int, default=4, help='district report threads')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    template = os.path.join(workdir, 'template.db')
+    seed.create_schema(template)
+    seed.seed(template, users=10, ledger_rows=args.rows, requests=200, history=200)
+    schools = os.path.join(workdir, 'schools')
+    os.makedirs(schools)
+    slugs = [f'school-{i:02d}' for i in range(1, args.schools + 1)]
+    for slug in slugs:
+        path = os.path.join(schools, f'{slug}.db')
+        shutil.copyfile(template, path)
+        with sqlite3.connect(path) as conn:
+            conn.execute("INSERT INTO school (name, created_at) VALUES (?, datetime('now'))", (f'โรงเรียน {slug}',))
+
+    os.environ.update(TENANCY='path', TENANT_DB_DIR=schools, TENANT_ENGINE_CACHE=str(args.cache),
+                      SECRET_KEY='bench', DATABASE_URI=f'sqlite:///{template}')
+    sys.path.insert(0, ROOT)
+    logging.disable(logging.CRITICAL)
+
+    from app import app
+    import district
+    import tenants
+
+    client = app.test_client()
+    for slug in slugs:  # one session cookie per school path
+        client.post(f'/school/{slug}/login', data={'username': 'finance', 'password': PASSWORD})
+    print(f'{args.schools} schools x {args.rows} entries, engine cache {args.cache}\n')
+
+    print(f"{'requests':24} {'p50 ms':>8} {'p95 ms':>8} {'opened':>7} {'evicted':>8}")
+    for name, cycle in ((f'over {args.cache} schools', slugs[:args.cache]),
+                        (f'over {args.schools} schools', slugs)):
+        for slug in cycle:  # warm up: engines, rollups, page cache
+            client.get(f'/school/{slug}/api/v1/balances')
+        before = tenants.engine_stats()
+        latencies = []
+        for i in range(args.requests):
+            started = time.perf_counter()
+            response = client.get(f'/school/{cycle[i % len(cycle)]}/api/v1/balances')
+            latencies.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == 200, response.status_code
+        after = tenants.engine_stats()
+        print(f'{name:24} {pct(latencies, 50):8.2f} {pct(latencies, 95):8.2f} '
+              f"{after['opened'] - before['opened']:7d} {after['evicted'] - before['evicted']:8d}")
+
+    print(f"\n{'district report':24} {'ms':>8}")
+    with app.app_context():
+        report = district.balances(workers=1)  # warm up
+        assert not any('error' in school for school in report['schools']), report['schools'][:1]
+        for workers in (1, args.workers):
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                district.balances(workers=workers)
+                timings.append((time.perf_counter() - started) * 1000)
+            print(f'{workers} worker(s){"":14} {statistics.median(timings):8.1f}')
+    print(f'\nCPUs: {os.cpu_count()}')
+
+
+if __name__ == '__main__':
+    main()
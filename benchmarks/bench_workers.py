@@ -0,0 +1,150 @@
+"""Throughput of serve.py as the number of worker processes grows.
+
+Seeds a database, then for each --workers count starts `python serve.py`
+(gunicorn, --threads threads per worker) on a free port and drives it with
+--clients client processes for --seconds. Each client logs in once and then
+cycles through the read pages (dashboard, the three ledgers, approvals,
+JSON balances), so every request also checks that a session cookie signed
+by one worker is accepted by the others. A request that ends up on the
+login page counts as an error.
+
+    python benchmarks/bench_workers.py --workers 1 2 4 --clients 16 --seconds 15
+
+Throughput can only scale up to the number of CPU cores; the CPU count is
+printed with the results.
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import seed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r'''
+import http.cookiejar, json, sys, time, urllib.error, urllib.parse, urllib.request
+base, n = sys.argv[1], int(sys.argv[2])
+PATHS = ['/', '/ledger/subsidy', '/ledger/income', '/ledger/lunch', '/approve', '/api/v1/balances']
+opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+opener.open(base + '/login', urllib.parse.urlencode({'username': 'finance', 'password': 'pass1234'}).encode()).read()
+print('READY', flush=True)
+start_at, stop_at = map(float, sys.stdin.readline().split())
+time.sleep(max(0, start_at - time.time()))
+latencies, errors = [], {}
+i = n
+while time.time() < stop_at:
+    started = time.perf_counter()
+    try:
+        response = opener.open(base + PATHS[i % len(PATHS)], timeout=60)
+        response.read()
+        failed = 'logged out' if response.geturl().split('?')[0].endswith('/login') else None
+    except (urllib.error.URLError, OSError) as e:
+        failed = str(getattr(e, 'code', None) or e)[:80]
+    if failed:
+        errors[failed] = errors.get(failed, 0) + 1
+    else:
+        latencies.append((time.perf_counter() - started) * 1000)
+    i += 1
+print(json.dumps({'latencies': latencies, 'errors': errors}))
+'''
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else None
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(base, server, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f'serve.py exited with status {server.returncode}')
+        try:
+            urllib.request.urlopen(base + '/login', timeout=2).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit('serve.py did not start in time')
+
+
+def run(workers, env, args):
+    port = free_port()
+    base = f'http://127.0.0.1:{port}'
+    server = subprocess.Popen(
+        [sys.executable, 'serve.py', '--server', 'gunicorn', '--host', '127.0.0.1', '--port', str(port),
+         '--workers', str(workers), '--threads', str(args.threads)],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_until_up(base, server)
+        clients = [
+            subprocess.Popen([sys.executable, '-c', CHILD, base, str(n)], stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+            for n in range(args.clients)
+        ]
+        for proc in clients:
+            proc.stdout.readline()
+        start_at = time.time() + 0.5
+        for proc in clients:
+            proc.stdin.write(f'{start_at} {start_at + args.seconds}\n')
+            proc.stdin.flush()
+        latencies, errors = [], {}
+        for proc in clients:
+            out, _ = proc.communicate()
+            lines = out.strip().splitlines()
+            data = json.loads(lines[-1]) if lines else {'latencies': [], 'errors': {'client crashed': 1}}
+            latencies += data['latencies']
+            for message, count in data['errors'].items():
+                errors[message] = errors.get(message, 0) + count
+    finally:
+        server.terminate()
+        server.wait()
+    return latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=50_000, help='ledger entries to seed')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='worker counts to compare')
+    parser.add_argument('--threads', type=int, default=4, help='threads per worker')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent client processes')
+    parser.add_argument('--seconds', type=float, default=15)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    path = os.path.join(workdir, 'bench_workers.db')
+    seed.create_schema(path)
+    seed.seed(path, ledger_rows=args.rows, requests=2_000, history=2_000)
+    # No SECRET_KEY: serve.py's workers must agree on the generated one in SECRET_KEY_FILE
+    env = {key: value for key, value in os.environ.items() if key != 'SECRET_KEY'}
+    env.update(DATABASE_URI=f'sqlite:///{path}', SECRET_KEY_FILE=os.path.join(workdir, 'secret_key'),
+               USER_CACHE_BACKEND=f"sqlite:{os.path.join(workdir, 'user_cache.sqlite')}")
+
+    print(f'{args.clients} clients, {args.threads} threads per worker, {args.seconds:.0f}s per run, '
+          f'{os.cpu_count()} CPU(s)\n')
+    print(f"{'workers':>7} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for workers in args.workers:
+        latencies, errors = run(workers, env, args)
+        fmt = lambda v: f'{v:8.1f}' if v is not None else '       -'
+        print(f'{workers:7d} {len(latencies):9d} {len(latencies) / args.seconds:8.1f} {fmt(pct(latencies, 0.50))} '
+              f'{fmt(pct(latencies, 0.95))} {fmt(pct(latencies, 0.99))} {sum(errors.values()):7d}')
+        for message, count in errors.items():
+            print(f'        {count:5d} x {message}')
+
+
+if __name__ == '__main__':
+    main()
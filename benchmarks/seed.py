@@ -0,0 +1,161 @@
+"""Synthetic data for the benchmark scripts.
+
+Builds a standalone SQLite file with the app's schema (from models.py) and
+fills it with a fake school's users, ledger entries, expense requests and
+edit history. Rows are inserted with the sqlite3 module directly so that a
+million-row ledger takes seconds, not minutes.
+"""
+import os
+import random
+import sqlite3
+import sys
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from werkzeug.security import generate_password_hash
+
+from models import db
+import search
+
+LEDGER_TYPES = ['Subsidy', 'Income', 'Lunch']
+ACCOUNT_TYPES = ['เงินอุดหนุนอื่น', 'เงินรายได้สถานศึกษา', 'เงินอาหารกลางวัน']
+CATEGORIES = ['ค่าจัดการเรียนการสอน', 'ค่ากิจกรรมพัฒนาผู้เรียน', 'ค่าเครื่องแบบ', 'อื่นๆ']
+# Description words for the search benchmark; picked by row number so the random stream is unchanged
+ITEMS = ['ซื้อหนังสือเรียน', 'ค่าน้ำประปา', 'ค่าไฟฟ้า', 'จัดซื้อวัสดุสำนักงาน', 'ค่าอาหารกลางวันนักเรียน',
+         'ซ่อมแซมอาคารเรียน', 'ค่าเดินทางไปราชการ', 'จ้างเหมาทำความสะอาด', 'ค่าอินเทอร์เน็ต', 'ทัศนศึกษา',
+         'ค่าวัสดุกีฬา', 'ชุดนักเรียน', 'ค่าถ่ายเอกสาร', 'อุปกรณ์คอมพิวเตอร์', 'ค่าน้ำมันเชื้อเพลิง',
+         'เงินบริจาคผู้ปกครอง', 'ค่าตอบแทนวิทยากร', 'อบรมพัฒนาครู', 'ค่ายลูกเสือ', 'วันเด็กแห่งชาติ']
+
+
+def create_schema(path, with_indexes=True):
+    """Create an empty database with every table from models.py."""
+    if os.path.exists(path):
+        os.remove(path)
+    engine = create_engine(f'sqlite:///{path}')
+    db.metadata.create_all(engine)
+    if not with_indexes:
+        drop_indexes(engine)
+    engine.dispose()
+
+
+def drop_indexes(engine):
+    """Drop the secondary indexes declared on the models (keeps unique constraints)."""
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                conn.exec_driver_sql(f'DROP INDEX IF EXISTS {index.name}')
+
+
+def create_indexes(path):
+    engine = create_engine(f'sqlite:///{path}')
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    with engine.begin() as conn:
+        conn.exec_driver_sql('ANALYZE')
+    engine.dispose()
+
+
+def seed(path, users=30, ledger_rows=100_000, requests=5_000, history=5_000, years=3, seed=42):
+    """Fill an existing schema with synthetic rows. Returns a dict of row counts."""
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=OFF')
+    conn.execute('PRAGMA synchronous=OFF')
+
+    # A single hash is reused: hashing thousands of passwords would dominate seeding time
+    password_hash = generate_password_hash('pass1234')
+    # The first three are init_db's default accounts (finance, director, teacher)
+    roles = ['finance', 'director'] + ['teacher'] * max(users - 2, 0)
+    conn.executemany(
+        'INSERT INTO user (id, username, name, password_hash, role) VALUES (?, ?, ?, ?, ?)',
+        [(i + 1, role if i < 3 else f'teacher{i:03d}', f'ผู้ใช้ {i + 1}', password_hash, role)
+         for i, role in enumerate(roles[:users])]
+    )
+
+    start = date.today() - timedelta(days=365 * years)
+    span = 365 * years
+
+    def ledger_rows_iter():
+        # Entries arrive roughly in date order, as they do in a real ledger
+        for i in range(ledger_rows):
+            day = start + timedelta(days=(i * span) // max(ledger_rows, 1))
+            is_income = rnd.random() < 0.3
+            yield (
+                i + 1, day.isoformat(), rnd.randint(1_000, 5_000_000),  # satang
+                f'{ITEMS[i * 7 % len(ITEMS)]} {ITEMS[i * 13 % 17]} รายการที่ {i + 1}', None, rnd.choice(LEDGER_TYPES), rnd.choice(CATEGORIES),
+                'Income' if is_income else 'Expense', None, rnd.randint(1, users),
+                datetime.combine(day, datetime.min.time()).isoformat(sep=' ')
+            )
+
+    conn.executemany(
+        'INSERT INTO ledger_entry (id, date, amount, description, note, ledger_type, category, '
+        'transaction_type, expense_request_id, created_by_id, created_at) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        ledger_rows_iter()
+    )
+
+    statuses = rnd.choices(['APPROVED', 'PENDING'], weights=[85, 15], k=requests)
+    request_rows = []
+    for i, status in enumerate(statuses):
+        day = start + timedelta(days=rnd.randrange(span + 1))
+        stamp = datetime.combine(day, datetime.min.time()).isoformat(sep=' ')
+        # Open requests are spread over every approval state: none yet, finance only, director only
+        waiting_on = None if status == 'APPROVED' else rnd.choice(['both', 'director', 'finance'])
+        finance_done = waiting_on in (None, 'director')
+        director_done = waiting_on in (None, 'finance')
+        request_rows.append((
+            i + 1, rnd.randint(3, max(users, 3)), day.isoformat(), rnd.randint(10_000, 2_000_000),
+            f'คำขอ{ITEMS[i % len(ITEMS)]} {i + 1}', rnd.choice(ACCOUNT_TYPES), status,
+            1 if finance_done else None, stamp if finance_done else None,
+            2 if director_done else None, stamp if director_done else None
+        ))
+    conn.executemany(
+        'INSERT INTO expense_request (id, requester_id, date, amount, description, account_type, status, '
+        'finance_approver_id, finance_approved_at, director_approver_id, director_approved_at) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        request_rows
+    )
+
+    # Audit log: note edits within a month of each entry's creation, plus the
+    # base snapshot audit.py writes with an entry's first edit
+    conn.executemany(
+        'INSERT INTO ledger_audit (ledger_entry_id, ledger_type, changed_by_id, changed_at, changes) '
+        "SELECT id, ledger_type, 1, datetime(created_at, ?), ? FROM ledger_entry WHERE id = ?",
+        ((f'+{rnd.randrange(30 * 1440)} minutes', f'{{"note":[null,"แก้ไข {i}"]}}', rnd.randint(1, max(ledger_rows, 1)))
+         for i in range(history if ledger_rows else 0))
+    )
+    conn.execute(
+        'INSERT INTO ledger_entry_snapshot (ledger_entry_id, audit_id, taken_at, state) '
+        "SELECT id, NULL, created_at, json_object('date', date, 'amount', amount, 'description', description, "
+        "'note', note, 'category', category, 'transaction_type', transaction_type) "
+        'FROM ledger_entry WHERE id IN (SELECT ledger_entry_id FROM ledger_audit)'
+    )
+
+    # Keep the materialized daily balances consistent with the seeded entries
+    conn.execute(
+        "INSERT INTO ledger_daily_balance (ledger_type, date, income, expense) "
+        "SELECT ledger_type, date, "
+        "SUM(CASE WHEN transaction_type = 'Income' THEN amount ELSE 0 END), "
+        "SUM(CASE WHEN transaction_type = 'Income' THEN 0 ELSE amount END) "
+        "FROM ledger_entry GROUP BY ledger_type, date"
+    )
+    # ... and the per fiscal year / category totals (October starts the next Buddhist-era year)
+    conn.execute(
+        "INSERT INTO ledger_category_total (fiscal_year, ledger_type, category, income, expense) "
+        "SELECT fy, ledger_type, category, "
+        "SUM(CASE WHEN transaction_type = 'Income' THEN amount ELSE 0 END), "
+        "SUM(CASE WHEN transaction_type = 'Income' THEN 0 ELSE amount END) "
+        "FROM (SELECT *, CAST(strftime('%Y', date) AS INTEGER) + 543 + (strftime('%m', date) >= '10') AS fy "
+        "FROM ledger_entry) GROUP BY fy, ledger_type, category"
+    )
+    conn.commit()
+    conn.close()
+
+    # Search indexes and their triggers, as init_db creates them on a real database
+    engine = create_engine(f'sqlite:///{path}')
+    search.ensure_indexes(engine)
+    engine.dispose()
+    return {'users': users, 'ledger_rows': ledger_rows, 'requests': requests, 'history': history}
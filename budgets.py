@@ -0,0 +1,134 @@
+"""Budgets: allocations per fiscal year, ledger and category, and the checks against them.
+
+Spend is read from LedgerCategoryTotal, which ledger_book updates on every
+ledger write, so checking a request costs a few primary-key lookups instead
+of a scan of the ledger:
+
+  remaining budget  allocation - expense already recorded in that category
+                    in the request's fiscal year (only if an allocation exists)
+  ledger balance    income - expense of the whole ledger, all years
+                    (one row per fiscal year and category)
+
+Open requests do not reserve money; a request counts once it is approved
+and its ledger entry is posted.
+
+BUDGET_ENFORCEMENT decides what happens when a request or the approval
+that would post it goes over: 'warn' (default) lets it through with a
+warning, 'block' refuses it, 'off' skips the checks.
+"""
+from sqlalchemy import Integer, func, literal, select, type_coerce, union_all
+
+from models import db, Budget, LedgerCategoryTotal
+import ledger_book
+from money import ZERO, from_satang
+
+ENFORCEMENT_MODES = ('warn', 'block', 'off')
+
+_settings = {'enforcement': 'warn'}
+
+
+def blocking():
+    return _settings['enforcement'] == 'block'
+
+
+def allocation(ledger_type, category, fiscal_year):
+    """Budget.amount for the key, or None if no budget was set."""
+    return db.session.query(Budget.amount).filter_by(
+        fiscal_year=fiscal_year, ledger_type=ledger_type, category=category).scalar()
+
+
+def spent(ledger_type, category, fiscal_year):
+    return db.session.query(LedgerCategoryTotal.expense).filter_by(
+        fiscal_year=fiscal_year, ledger_type=ledger_type, category=category).scalar() or ZERO
+
+
+def ledger_balance(ledger_type):
+    income, expense = db.session.query(
+        func.coalesce(func.sum(LedgerCategoryTotal.income), 0),
+        func.coalesce(func.sum(LedgerCategoryTotal.expense), 0)
+    ).filter(LedgerCategoryTotal.ledger_type == ledger_type).one()
+    return income - expense
+
+
+def check(ledger_type, category, amount, day, pending_category=ZERO, pending_ledger=ZERO):
+    """Problems (Thai messages) with spending `amount` from `category` of `ledger_type` on `day`.
+
+    `pending_category` / `pending_ledger` are spend not yet in the totals that
+    should count too (earlier requests of the same bulk approval) against this
+    category's budget and against the ledger balance. Returns [] when it fits
+    or checks are off.
+    """
+    if _settings['enforcement'] == 'off':
+        return []
+    problems = []
+    fiscal_year = ledger_book.fiscal_year_label(day)
+    budget = allocation(ledger_type, category, fiscal_year)
+    if budget is not None:
+        left = budget - spent(ledger_type, category, fiscal_year) - pending_category
+        if amount > left:
+            problems.append(f'เกินงบประมาณหมวด "{category}" ปีงบประมาณ {fiscal_year} '
+                            f'(คงเหลือ {left:,.2f} บาท จากงบ {budget:,.2f} บาท)')
+    balance = ledger_balance(ledger_type) - pending_ledger
+    if amount > balance:
+        problems.append(f'เกินยอดเงินคงเหลือในทะเบียน (คงเหลือ {balance:,.2f} บาท)')
+    return problems
+
+
+def set_budget(fiscal_year, ledger_type, category, amount, user_id):
+    """Create or replace an allocation (no commit)."""
+    budget = Budget.query.filter_by(fiscal_year=fiscal_year, ledger_type=ledger_type, category=category).first()
+    if budget is None:
+        budget = Budget(fiscal_year=fiscal_year, ledger_type=ledger_type, category=category)
+        db.session.add(budget)
+    budget.amount = amount
+    budget.updated_by_id = user_id
+    return budget
+
+
+def utilisation(fiscal_year):
+    """Allocation vs spend per category for all three ledgers, from one grouped query.
+
+    Returns {url ledger name: [row, ...]} where each row is a dict with category,
+    budget (None if unset), income, expense, remaining and percent used.
+    """
+    # Amounts stay raw satang through the union and the sums (converted below)
+    allocations = select(
+        Budget.ledger_type, Budget.category, type_coerce(Budget.amount, Integer).label('budget'),
+        literal(1).label('has_budget'), literal(0).label('income'), literal(0).label('expense')
+    ).where(Budget.fiscal_year == fiscal_year)
+    totals = select(
+        LedgerCategoryTotal.ledger_type, LedgerCategoryTotal.category, literal(0), literal(0),
+        type_coerce(LedgerCategoryTotal.income, Integer), type_coerce(LedgerCategoryTotal.expense, Integer)
+    ).where(LedgerCategoryTotal.fiscal_year == fiscal_year)
+    both = union_all(allocations, totals).subquery()
+    rows = db.session.execute(
+        select(both.c.ledger_type, both.c.category, func.sum(both.c.budget), func.max(both.c.has_budget),
+               func.sum(both.c.income), func.sum(both.c.expense))
+        .group_by(both.c.ledger_type, both.c.category)
+        .order_by(both.c.ledger_type, both.c.category)
+    ).all()
+
+    names = {ledger_type: url_type for url_type, ledger_type in ledger_book.LEDGER_TYPES.items()}
+    report = {url_type: [] for url_type in ledger_book.LEDGER_TYPES}
+    for ledger_type, category, budget, has_budget, income, expense in rows:
+        if ledger_type not in names:
+            continue
+        budget = from_satang(budget) if has_budget else None
+        expense = from_satang(expense)
+        report[names[ledger_type]].append({
+            'category': category,
+            'budget': budget,
+            'income': from_satang(income),
+            'expense': expense,
+            'remaining': budget - expense if budget is not None else None,
+            'percent': round(expense * 100 / budget, 1) if budget else None,
+        })
+    return report
+
+
+def init_app(app):
+    app.config.setdefault('BUDGET_ENFORCEMENT', 'warn')
+    if app.config['BUDGET_ENFORCEMENT'] not in ENFORCEMENT_MODES:
+        raise ValueError(f"BUDGET_ENFORCEMENT must be one of {ENFORCEMENT_MODES}, "
+                         f"not {app.config['BUDGET_ENFORCEMENT']!r}")
+    _settings['enforcement'] = app.config['BUDGET_ENFORCEMENT']
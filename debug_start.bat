@@ -19,7 +19,7 @@ echo venv checked.
 pause
 
 echo Step 3: Installing dependencies...
-.venv\Scripts\python.exe -m pip install Flask Flask-SQLAlchemy Flask-Login pandas openpyxl python-dateutil
+.venv\Scripts\python.exe -m pip install Flask Flask-SQLAlchemy Flask-Login openpyxl python-dateutil
 echo Dependencies installed.
 pause
 
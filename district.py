@@ -0,0 +1,113 @@
+"""District report: every school's ledger balances side by side, with district totals.
+
+balances() reads the schools in parallel on a pool of DISTRICT_REPORT_WORKERS
+threads. Each thread binds its own app context to one school
+(tenants.activate), so it gets that school's pooled engine and session;
+sqlite3 releases the GIL while a query runs, so several schools' queries do
+run at once. Per school it is one grouped query over the daily balance
+table (a row per ledger per day with entries, archived months included):
+each ledger's balance to date and its income and expense in the current
+fiscal year. A school that cannot be read is reported with its error
+instead of failing the whole report.
+
+Served as JSON at /district/balances (no school in the URL) and printed by
+`flask district-report`. Like /metrics it answers localhost only unless
+DISTRICT_TOKEN is set, then any client sending it as a bearer token.
+"""
+import hmac
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from flask import abort, current_app, jsonify, request
+from sqlalchemy import case, func
+
+from models import db, LedgerDailyBalance
+import ledger_book
+import tenants
+from money import ZERO
+
+DEFAULT_WORKERS = 4
+
+
+def school_balances(today):
+    """Balances of the current app context's school (one query)."""
+    in_fiscal_year = LedgerDailyBalance.date >= ledger_book.fiscal_year_start(today)
+    rows = db.session.query(
+        LedgerDailyBalance.ledger_type,
+        func.sum(LedgerDailyBalance.income),
+        func.sum(LedgerDailyBalance.expense),
+        func.sum(case((in_fiscal_year, LedgerDailyBalance.income), else_=0)),
+        func.sum(case((in_fiscal_year, LedgerDailyBalance.expense), else_=0))
+    ).filter(LedgerDailyBalance.date <= today).group_by(LedgerDailyBalance.ledger_type).all()
+    found = {ledger_type: totals for ledger_type, *totals in rows}
+    ledgers = {}
+    for url_type, ledger_type in ledger_book.LEDGER_TYPES.items():
+        income, expense, fy_income, fy_expense = found.get(ledger_type, (ZERO,) * 4)
+        ledgers[url_type] = {'balance': income - expense,
+                             'fiscal_year_income': fy_income, 'fiscal_year_expense': fy_expense}
+    return ledgers
+
+
+def _read_school(app, slug, today):
+    with app.app_context():
+        tenants.activate(slug)
+        try:
+            return {'school': slug, 'name': tenants.school_name(), 'ledgers': school_balances(today)}
+        except Exception as e:
+            app.logger.exception('District report: school %s could not be read', slug)
+            return {'school': slug, 'error': str(e)[:200]}
+
+
+def balances(today=None, workers=None):
+    """{'schools': [...], 'totals': {ledger: {...}}} over every provisioned school."""
+    app = current_app._get_current_object()
+    today = today or date.today()
+    slugs = tenants.school_slugs()
+    workers = max(min(workers or app.config['DISTRICT_REPORT_WORKERS'], len(slugs)), 1)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='district') as pool:
+        schools = list(pool.map(lambda slug: _read_school(app, slug, today), slugs))
+
+    totals = {url_type: dict.fromkeys(('balance', 'fiscal_year_income', 'fiscal_year_expense'), ZERO)
+              for url_type in ledger_book.LEDGER_TYPES}
+    for school in schools:
+        for url_type, figures in school.get('ledgers', {}).items():
+            for name, value in figures.items():
+                totals[url_type][name] += value
+    return {'today': today, 'fiscal_year': ledger_book.fiscal_year_label(today),
+            'schools': schools, 'totals': totals}
+
+
+def _allowed():
+    token = current_app.config['DISTRICT_TOKEN']
+    if token:
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        return hmac.compare_digest(supplied.encode(), token.encode())
+    return request.remote_addr in ('127.0.0.1', '::1')
+
+
+def _jsonable(value):
+    if isinstance(value, dict):
+        return {key: _jsonable(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_jsonable(item) for item in value]
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, (int, float, str)) or value is None:
+        return value
+    return str(value)  # Decimal amounts as exact strings, like the JSON API
+
+
+def init_app(app):
+    app.config.setdefault('DISTRICT_TOKEN', None)
+    app.config.setdefault('DISTRICT_REPORT_WORKERS', DEFAULT_WORKERS)
+
+    def district_balances():
+        if app.config['TENANCY'] == 'off' or tenants.current_slug() is not None:
+            abort(404)  # district level only
+        if not _allowed():
+            abort(401 if app.config['DISTRICT_TOKEN'] else 403)
+        response = jsonify(_jsonable(balances()))
+        response.cache_control.no_store = True
+        return response
+
+    app.add_url_rule('/district/balances', 'district_balances', district_balances)
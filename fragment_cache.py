@@ -0,0 +1,130 @@
+"""Cache of rendered HTML fragments (the ledger pages' balance cards and entries table).
+
+ledger_view keys its fragments on everything they are built from: school, ledger,
+date range, page cursor and size, today's date (for the month card) and
+ledger_book.ledger_version() of that ledger. Every write path that changes a
+ledger (new entry, approval, bulk approval, import, edit) advances that
+version, in this worker or any other, so a changed ledger simply misses and
+renders fresh; superseded fragments age out of the LRU. A repeat view of an
+unchanged ledger costs the two version lookups and no entry query or render.
+
+The cache is per process, bounded by FRAGMENT_CACHE_SIZE entries and
+FRAGMENT_CACHE_MAX_BYTES of HTML, least recently used out first. Entries
+also expire after FRAGMENT_CACHE_TTL seconds, and the whole cache is dropped
+after a commit that changes a User, since fragments show user names.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import User
+
+DEFAULT_SIZE = 256
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_TTL = 600
+
+_data = OrderedDict()  # key -> (expires_at, size, fragments)
+_lock = threading.Lock()
+_bytes = 0
+_limits = {'size': DEFAULT_SIZE, 'max_bytes': DEFAULT_MAX_BYTES, 'ttl': DEFAULT_TTL}
+_counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def _size(fragments):
+    return sum(len(value) for value in fragments.values())
+
+
+def _drop(key):
+    global _bytes
+    _, size, _ = _data.pop(key)
+    _bytes -= size
+
+
+def get(key):
+    """Cached fragments (a dict of name -> Markup) for `key`, or None."""
+    with _lock:
+        item = _data.get(key)
+        if item is not None and item[0] < time.monotonic():
+            _drop(key)
+            item = None
+        if item is None:
+            _counters['misses'] += 1
+            return None
+        _data.move_to_end(key)
+        _counters['hits'] += 1
+        return item[2]
+
+
+def put(key, fragments):
+    global _bytes
+    size = _size(fragments)
+    with _lock:
+        if size > _limits['max_bytes']:
+            return  # one huge page (e.g. ?per_page=1000 of long rows) must not flush everything else
+        if key in _data:
+            _drop(key)
+        _data[key] = (time.monotonic() + _limits['ttl'], size, fragments)
+        _bytes += size
+        while len(_data) > _limits['size'] or _bytes > _limits['max_bytes']:
+            _drop(next(iter(_data)))
+            _counters['evictions'] += 1
+
+
+def cached(key, render):
+    """Return the fragments for `key`, calling render() -> dict of fragments on a miss."""
+    fragments = get(key)
+    if fragments is None:
+        fragments = render()
+        put(key, fragments)
+    return fragments
+
+
+def clear():
+    global _bytes
+    with _lock:
+        _data.clear()
+        _bytes = 0
+
+
+def stats():
+    """Hit/miss/eviction counters and current size of this process's cache."""
+    with _lock:
+        counters = dict(_counters, entries=len(_data), bytes=_bytes,
+                        max_entries=_limits['size'], max_bytes=_limits['max_bytes'])
+    lookups = counters['hits'] + counters['misses']
+    counters['hit_ratio'] = round(counters['hits'] / lookups, 4) if lookups else None
+    return counters
+
+
+# --- Invalidation: user names are part of the rendered rows ---
+
+def _remember(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info['fragment_cache_dirty'] = True
+
+
+def _after_commit(session):
+    if session.info.pop('fragment_cache_dirty', False):
+        clear()
+
+
+def _after_rollback(session):
+    session.info.pop('fragment_cache_dirty', None)
+
+
+def init_app(app):
+    app.config.setdefault('FRAGMENT_CACHE_SIZE', DEFAULT_SIZE)
+    app.config.setdefault('FRAGMENT_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+    app.config.setdefault('FRAGMENT_CACHE_TTL', DEFAULT_TTL)
+    _limits.update(size=app.config['FRAGMENT_CACHE_SIZE'], max_bytes=app.config['FRAGMENT_CACHE_MAX_BYTES'],
+                   ttl=app.config['FRAGMENT_CACHE_TTL'])
+
+    if not event.contains(User, 'after_update', _remember):
+        event.listen(User, 'after_update', _remember)
+        event.listen(User, 'after_delete', _remember)
+        event.listen(Session, 'after_commit', _after_commit)
+        event.listen(Session, 'after_rollback', _after_rollback)
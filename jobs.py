@@ -0,0 +1,204 @@
+"""Background jobs: exports and other slow reports, off the request worker.
+
+A job is a row in the `job` table plus a function registered with @job_kind.
+submit() either returns an existing job or queues a new one on an in-process
+thread pool; the browser then polls the job's status and downloads the
+finished file from the artifact directory (JOB_ARTIFACT_DIR).
+
+Each job carries a dedupe key: sha1 of its kind, its parameters and the
+`version` of the data it reads (for ledger exports, ledger_book.ledger_version).
+While a job with the same key is queued or running, submitting again returns
+that job instead of starting a second one, and a finished job's file is
+handed out again until the ledger changes (which changes the key) or the
+artifact expires after JOB_ARTIFACT_TTL seconds.
+
+Jobs live in the database of the school that submitted them (tenants.py);
+the worker thread binds its app context to that school before it runs one,
+and recover() re-queues the current school's jobs.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import update
+
+from models import db, Job
+import metrics
+import tenants
+
+ACTIVE = ('QUEUED', 'RUNNING')
+
+_kinds = {}
+_executor = None
+_executor_lock = threading.Lock()
+_app = None
+
+
+def job_kind(name):
+    """Register `func(params, path) -> (download_name, mimetype)` as a job kind.
+
+    The function runs inside an app context and must write its output to `path`.
+    """
+    def decorator(func):
+        _kinds[name] = func
+        return func
+    return decorator
+
+
+def dedupe_key(kind, params, version):
+    raw = json.dumps([kind, params, version], sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def _artifact_dir():
+    return _app.config['JOB_ARTIFACT_DIR']
+
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_app.config['JOB_WORKERS'],
+                                           thread_name_prefix='job')
+        return _executor
+
+
+def _usable(job):
+    if job.status in ACTIVE:
+        return True
+    return job.status == 'DONE' and job.artifact_path and os.path.exists(job.artifact_path)
+
+
+def submit(kind, params, version, user_id):
+    """Return (job, created): an in-flight or finished job with the same key, or a new queued one."""
+    if kind not in _kinds:
+        raise ValueError(f'unknown job kind: {kind!r}')
+    key = dedupe_key(kind, params, version)
+    for job in Job.query.filter(Job.dedupe_key == key, Job.status.in_(ACTIVE + ('DONE',))) \
+            .order_by(Job.created_at.desc()):
+        if _usable(job):
+            return job, False
+
+    job = Job(id=uuid.uuid4().hex, kind=kind, params=json.dumps(params, default=str),
+              dedupe_key=key, status='QUEUED', created_by_id=user_id)
+    db.session.add(job)
+    db.session.commit()
+    _pool().submit(run, job.id, tenants.current_slug())
+    return job, True
+
+
+def run(job_id, school=None):
+    """Worker entry point. Claims the job atomically so it only ever runs once."""
+    with _app.app_context():
+        tenants.activate(school)
+        claimed = db.session.execute(
+            update(Job).where(Job.id == job_id, Job.status == 'QUEUED')
+            .values(status='RUNNING', started_at=datetime.utcnow())
+        ).rowcount
+        db.session.commit()
+        if not claimed:
+            return
+
+        kind, params = db.session.query(Job.kind, Job.params).filter(Job.id == job_id).one()
+        path = os.path.join(_artifact_dir(), job_id)
+        try:
+            download_name, mimetype = _kinds[kind](json.loads(params), path)
+            values = dict(status='DONE', artifact_path=path, download_name=download_name, mimetype=mimetype)
+        except Exception as e:
+            _app.logger.error('Job %s (%s) failed:\n%s', job_id, kind, traceback.format_exc())
+            values = dict(status='FAILED', error=str(e)[:1000])
+            if os.path.exists(path):
+                os.remove(path)
+        metrics.JOBS.inc(kind=kind, status=values['status'])
+        # End the export's read transaction first: writing from an old WAL
+        # snapshot fails if anything else committed in the meantime
+        db.session.rollback()
+        db.session.execute(update(Job).where(Job.id == job_id).values(finished_at=datetime.utcnow(), **values))
+        db.session.commit()
+        db.session.remove()
+
+
+def prune():
+    """Expire finished artifacts older than JOB_ARTIFACT_TTL and delete their files.
+
+    Not committed here: the caller commits (submit() does when it queues a job),
+    so a view marked @writes keeps one write transaction. Committing in between
+    would leave submit() reading a deferred snapshot that a worker's commit can
+    invalidate, and its INSERT would then fail with "database is locked".
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=_app.config['JOB_ARTIFACT_TTL'])
+    expired = Job.query.filter(Job.status == 'DONE', Job.finished_at < cutoff).all()
+    for job in expired:
+        if job.artifact_path and os.path.exists(job.artifact_path):
+            os.remove(job.artifact_path)
+        job.status = 'EXPIRED'
+    db.session.flush()
+    return len(expired)
+
+
+def recover():
+    """At startup: re-queue jobs nobody picked up, fail jobs whose worker died mid-run.
+
+    A RUNNING job is only given up on after JOB_TIMEOUT, since with several
+    server processes it may still be running in another one.
+    """
+    stale = datetime.utcnow() - timedelta(seconds=_app.config['JOB_TIMEOUT'])
+    db.session.execute(
+        update(Job).where(Job.status == 'RUNNING', Job.started_at < stale)
+        .values(status='FAILED', error='worker stopped before the job finished', finished_at=datetime.utcnow())
+    )
+    queued = [job_id for (job_id,) in db.session.query(Job.id).filter(Job.status == 'QUEUED')]
+    db.session.commit()
+    school = tenants.current_slug()
+    for job_id in queued:
+        _pool().submit(run, job_id, school)
+    return len(queued)
+
+
+def init_app(app):
+    global _app
+    _app = app
+    app.config.setdefault('JOB_WORKERS', 2)
+    app.config.setdefault('JOB_ARTIFACT_DIR', os.path.join(app.instance_path, 'artifacts'))
+    app.config.setdefault('JOB_ARTIFACT_TTL', 24 * 3600)
+    app.config.setdefault('JOB_TIMEOUT', 3600)
+    os.makedirs(app.config['JOB_ARTIFACT_DIR'], exist_ok=True)
+
+
+# --- Job kinds ---
+
+@job_kind('ledger_export')
+def ledger_export_job(params, path):
+    # Imported here so openpyxl is only loaded by workers that actually export
+    from ledger_export import LedgerExport
+
+    # Closed months are not re-read: the export starts from the latest closing balance
+    start = datetime.strptime(params['start'], '%Y-%m-%d').date() if params.get('start') else None
+    opening_balance = Decimal(params['opening_balance']) if params.get('opening_balance') else None
+    started = time.perf_counter()
+    export = LedgerExport(params['ledger_type'], params['title'],
+                          datetime.strptime(params['month_start'], '%Y-%m-%d').date(),
+                          datetime.strptime(params['month_end'], '%Y-%m-%d').date(),
+                          start=start, opening_balance=opening_balance)
+    if params['format'] == 'csv':
+        # iter_csv() starts with the BOM, so Excel opens the UTF-8 file correctly
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            for chunk in export.iter_csv():
+                f.write(chunk)
+        result = f"{params['filename']}.csv", 'text/csv'
+    else:
+        with open(path, 'wb') as f:
+            export.write_xlsx(f)
+        result = (f"{params['filename']}.xlsx",
+                  'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    metrics.EXPORT_SECONDS.observe(time.perf_counter() - started, format=params['format'])
+    metrics.EXPORT_BYTES.observe(os.path.getsize(path), format=params['format'])
+    metrics.EXPORT_ROWS.inc(export.row_count, format=params['format'])
+    return result
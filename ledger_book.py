@@ -0,0 +1,317 @@
+"""Bookkeeping that runs alongside every LedgerEntry write.
+
+LedgerDailyBalance keeps one row of income/expense totals per ledger per day,
+so balance cards and summaries read O(days in range) rows instead of summing
+every LedgerEntry. LedgerCategoryTotal keeps the same totals per fiscal year,
+ledger and category, which budgets.py compares with the allocations. Every
+code path that adds or changes an entry must call one of the record_*
+helpers inside the same transaction; they update both tables, and refuse
+(PeriodClosedError) an entry dated in a month closed by periods.py.
+
+Closed months also shortcut period_totals(): a closed month is one frozen
+PeriodClose row instead of a month of daily rows.
+"""
+import calendar
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import Integer, case, cast, func, select, union_all
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import (db, LedgerEntry, LedgerAudit, LedgerDailyBalance, LedgerCategoryTotal, PeriodClose,
+                    LedgerEntryArchive)
+from money import ZERO
+import metrics
+
+# URL ledger name -> LedgerEntry.ledger_type
+LEDGER_TYPES = {
+    'subsidy': 'Subsidy',
+    'income': 'Income',
+    'lunch': 'Lunch'
+}
+
+# Categories offered for each ledger (the lunch ledger has a single fixed one)
+LEDGER_CATEGORIES = {
+    'subsidy': ['ค่าจัดการเรียนการสอน', 'ค่ากิจกรรมพัฒนาผู้เรียน', 'ค่าเครื่องแบบ', 'ค่าอุปกรณ์การเรียน', 'ค่าหนังสือเรียน', 'อื่นๆ'],
+    'income': ['เงินบริจาค', 'ทุนการศึกษา', 'ค่าจ้างครู', 'อื่นๆ'],
+    'lunch': ['อาหารกลางวัน']
+}
+
+# ExpenseRequest.account_type -> LedgerEntry.ledger_type of the auto-created entry
+ACCOUNT_LEDGER_TYPES = {
+    'เงินอุดหนุนอื่น': 'Subsidy',
+    'เงินรายได้สถานศึกษา': 'Income',
+    'เงินอาหารกลางวัน': 'Lunch'
+}
+
+
+def fiscal_year_start(day):
+    """The Thai government fiscal year runs 1 October - 30 September."""
+    return date(day.year if day.month >= 10 else day.year - 1, 10, 1)
+
+
+def fiscal_year_label(day):
+    """Buddhist-era year of the fiscal year containing `day`, e.g. 2569 for Oct 2025 - Sep 2026."""
+    return fiscal_year_start(day).year + 1 + 543
+
+
+def month_end(day):
+    return day.replace(day=calendar.monthrange(day.year, day.month)[1])
+
+
+class PeriodClosedError(Exception):
+    """An entry dated in a closed accounting period was added or changed. str() is a Thai message."""
+
+
+def closed_through(ledger_type):
+    """Last day of the ledger's latest closed month, or None if no month is closed."""
+    month = db.session.query(func.max(PeriodClose.month)).filter(PeriodClose.ledger_type == ledger_type).scalar()
+    return month_end(month) if month else None
+
+
+def closed_message(through, day):
+    return (f'ปิดงวดบัญชีถึงวันที่ {through.strftime("%d/%m/%Y")} แล้ว '
+            f'ไม่สามารถบันทึกหรือแก้ไขรายการวันที่ {day.strftime("%d/%m/%Y")} ได้')
+
+
+def check_open(ledger_type, day):
+    """Raise PeriodClosedError if `day` falls in a closed month of the ledger."""
+    through = closed_through(ledger_type)
+    if through is not None and day <= through:
+        raise PeriodClosedError(closed_message(through, day))
+
+
+def _upsert_totals(model, keys, transaction_type, delta):
+    """Add `delta` to the income or expense of the `model` row identified by `keys`."""
+    income = delta if transaction_type == 'Income' else ZERO
+    expense = ZERO if transaction_type == 'Income' else delta
+    stmt = sqlite_insert(model).values(**keys, income=income, expense=expense)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={
+            'income': model.income + stmt.excluded.income,
+            'expense': model.expense + stmt.excluded.expense,
+        }
+    )
+    db.session.execute(stmt)
+
+
+def _upsert_day(ledger_type, day, transaction_type, delta):
+    _upsert_totals(LedgerDailyBalance, {'ledger_type': ledger_type, 'date': day}, transaction_type, delta)
+
+
+def _upsert_category(ledger_type, fiscal_year, category, transaction_type, delta):
+    _upsert_totals(LedgerCategoryTotal, {'fiscal_year': fiscal_year, 'ledger_type': ledger_type,
+                                         'category': category}, transaction_type, delta)
+
+
+def _record(ledger_type, day, category, transaction_type, delta):
+    _upsert_day(ledger_type, day, transaction_type, delta)
+    _upsert_category(ledger_type, fiscal_year_label(day), category, transaction_type, delta)
+
+
+def record_entry(entry):
+    """Add a new (not yet committed) entry to the daily and category totals."""
+    check_open(entry.ledger_type, entry.date)
+    _record(entry.ledger_type, entry.date, entry.category, entry.transaction_type, entry.amount)
+    metrics.on_commit(db.session, metrics.LEDGER_WRITES, ledger=entry.ledger_type, kind='insert')
+
+
+def record_entries(rows):
+    """Add many new entries (dicts of column values, e.g. from a bulk INSERT).
+
+    Amounts are summed per ledger/day/type and per ledger/fiscal year/category/type
+    first, so the tables get one upsert per distinct day or category rather
+    than one per entry.
+    """
+    earliest, counts = {}, {}
+    for row in rows:
+        earliest[row['ledger_type']] = min(earliest.get(row['ledger_type'], row['date']), row['date'])
+        counts[row['ledger_type']] = counts.get(row['ledger_type'], 0) + 1
+    for ledger_type, day in earliest.items():
+        check_open(ledger_type, day)
+        metrics.on_commit(db.session, metrics.LEDGER_WRITES, counts[ledger_type], ledger=ledger_type, kind='insert')
+
+    days, categories = {}, {}
+    for row in rows:
+        key = (row['ledger_type'], row['date'], row['transaction_type'])
+        days[key] = days.get(key, ZERO) + row['amount']
+        key = (row['ledger_type'], fiscal_year_label(row['date']), row['category'], row['transaction_type'])
+        categories[key] = categories.get(key, ZERO) + row['amount']
+    for (ledger_type, day, transaction_type), amount in days.items():
+        _upsert_day(ledger_type, day, transaction_type, amount)
+    for (ledger_type, fiscal_year, category, transaction_type), amount in categories.items():
+        _upsert_category(ledger_type, fiscal_year, category, transaction_type, amount)
+
+
+def record_amount_change(entry, old_amount):
+    """Apply an edit of entry.amount (already set to the new value)."""
+    delta = entry.amount - old_amount
+    if delta:
+        check_open(entry.ledger_type, entry.date)
+        _record(entry.ledger_type, entry.date, entry.category, entry.transaction_type, delta)
+
+
+def period_totals(ledger_type, start_date, end_date):
+    """Return (income, expense) for a ledger between two dates, inclusive.
+
+    Closed months lying wholly inside the range are summed from their
+    PeriodClose rows; only the days outside them are read from the daily table.
+    """
+    # Closed months are contiguous, so the ones in range form one block [first, last]
+    first, last, closed_income, closed_expense = db.session.query(
+        func.min(PeriodClose.month), func.max(PeriodClose.month),
+        func.coalesce(func.sum(PeriodClose.income), 0), func.coalesce(func.sum(PeriodClose.expense), 0)
+    ).filter(
+        PeriodClose.ledger_type == ledger_type,
+        PeriodClose.month >= start_date,
+        PeriodClose.month < (end_date + timedelta(days=1)).replace(day=1)  # the month ends by end_date
+    ).one()
+    if first is None:
+        return _daily_totals(ledger_type, start_date, end_date)
+    before_income, before_expense = _daily_totals(ledger_type, start_date, first - timedelta(days=1))
+    after_income, after_expense = _daily_totals(ledger_type, month_end(last) + timedelta(days=1), end_date)
+    return (closed_income + before_income + after_income,
+            closed_expense + before_expense + after_expense)
+
+
+def _daily_totals(ledger_type, start_date, end_date):
+    if start_date > end_date:
+        return ZERO, ZERO
+    income, expense = db.session.query(
+        func.coalesce(func.sum(LedgerDailyBalance.income), 0),
+        func.coalesce(func.sum(LedgerDailyBalance.expense), 0)
+    ).filter(
+        LedgerDailyBalance.ledger_type == ledger_type,
+        LedgerDailyBalance.date >= start_date,
+        LedgerDailyBalance.date <= end_date
+    ).one()
+    return income, expense
+
+
+def balance_before(ledger_type, start_date, day, entry_id):
+    """Net balance of the entries from start_date up to, but excluding, entry (day, entry_id).
+
+    Whole days before `day` come from the daily table; only `day` itself is
+    read from LedgerEntry (through the (ledger_type, date, id) index).
+    """
+    income, expense = period_totals(ledger_type, start_date, day - timedelta(days=1))
+    signed = case((LedgerEntry.transaction_type == 'Income', LedgerEntry.amount), else_=-LedgerEntry.amount)
+    same_day = db.session.query(func.coalesce(func.sum(signed), 0)).filter(
+        LedgerEntry.ledger_type == ledger_type,
+        LedgerEntry.date == day,
+        LedgerEntry.id < entry_id
+    ).scalar()
+    return income - expense + same_day
+
+
+def ledger_version(ledger_type=None):
+    """Value that changes whenever the ledger's (or, with None, any ledger's) content may have changed.
+
+    (newest created_at, newest audited edit, newest period close change) within
+    the ledger(s): entries are only added or edited, every edit appends an audit
+    row, and closing, archiving (which removes entries) or reopening a month
+    changes PeriodClose. All are index lookups or tiny tables, so this is cheap
+    enough to check on every request.
+    """
+    # One index lookup per ledger and column; a plain max() over all ledgers
+    # could not use the (ledger_type, ...) indexes and would scan the table
+    ledger_types = [ledger_type] if ledger_type is not None else LEDGER_TYPES.values()
+
+    def newest(column, type_column):
+        stamps = [db.session.query(func.max(column)).filter(type_column == t).scalar() for t in ledger_types]
+        stamps = [stamp for stamp in stamps if stamp is not None]
+        return max(stamps) if stamps else None
+
+    return (newest(LedgerEntry.created_at, LedgerEntry.ledger_type),
+            newest(LedgerAudit.changed_at, LedgerAudit.ledger_type),
+            newest(PeriodClose.updated_at, PeriodClose.ledger_type))
+
+
+def parse_cursor(value):
+    """Keyset cursor 'YYYY-MM-DD_<id>' -> (date, id), or None if missing/invalid."""
+    try:
+        day, entry_id = value.split('_')
+        return datetime.strptime(day, '%Y-%m-%d').date(), int(entry_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def make_cursor(entry):
+    """Cursor pointing at an entry (anything with .date and .id)."""
+    return f"{entry.date.strftime('%Y-%m-%d')}_{entry.id}"
+
+
+def _all_entries():
+    """Live and archived entries: months moved to the archive still count in every total."""
+    def columns(model):
+        return select(model.ledger_type, model.date, model.category, model.amount, model.transaction_type)
+    return union_all(columns(LedgerEntry), columns(LedgerEntryArchive)).subquery()
+
+
+def _aggregate_entries():
+    """Daily totals computed straight from the entries (the source of truth)."""
+    # The amount branch comes first so each CASE takes the Money type (satang <-> Decimal)
+    entries = _all_entries()
+    is_income = entries.c.transaction_type == 'Income'
+    return db.session.query(
+        entries.c.ledger_type,
+        entries.c.date,
+        func.sum(case((is_income, entries.c.amount), else_=0)),
+        func.sum(case((~is_income, entries.c.amount), else_=0))
+    ).group_by(entries.c.ledger_type, entries.c.date)
+
+
+def _aggregate_categories():
+    """(fiscal_year, ledger_type, category, income, expense) straight from the entries."""
+    entries = _all_entries()
+    is_income = entries.c.transaction_type == 'Income'
+    # fiscal_year_label() in SQL: October onwards belongs to the next year's label
+    fiscal_year = (cast(func.strftime('%Y', entries.c.date), Integer) + 543
+                   + case((func.strftime('%m', entries.c.date) >= '10', 1), else_=0))
+    return db.session.query(
+        fiscal_year,
+        entries.c.ledger_type,
+        entries.c.category,
+        func.sum(case((is_income, entries.c.amount), else_=0)),
+        func.sum(case((~is_income, entries.c.amount), else_=0))
+    ).group_by(fiscal_year, entries.c.ledger_type, entries.c.category)
+
+
+def rebuild_balances():
+    """Recompute the daily and category tables from the entries. Returns the number of day rows."""
+    LedgerDailyBalance.query.delete()
+    LedgerCategoryTotal.query.delete()
+    rows = [
+        {'ledger_type': ledger_type, 'date': day, 'income': income, 'expense': expense}
+        for ledger_type, day, income, expense in _aggregate_entries()
+    ]
+    if rows:
+        db.session.execute(LedgerDailyBalance.__table__.insert(), rows)
+    categories = [
+        {'fiscal_year': fiscal_year, 'ledger_type': ledger_type, 'category': category,
+         'income': income, 'expense': expense}
+        for fiscal_year, ledger_type, category, income, expense in _aggregate_categories()
+    ]
+    if categories:
+        db.session.execute(LedgerCategoryTotal.__table__.insert(), categories)
+    db.session.commit()
+    return len(rows)
+
+
+def verify_balances():
+    """Compare both tables with the entries (live and archived), exact to the satang. Returns a list of mismatches."""
+    problems = []
+    checks = [
+        ({(t, d): (i, e) for t, d, i, e in _aggregate_entries()},
+         {(row.ledger_type, row.date): (row.income, row.expense) for row in LedgerDailyBalance.query}),
+        ({(y, t, c): (i, e) for y, t, c, i, e in _aggregate_categories()},
+         {(row.fiscal_year, row.ledger_type, row.category): (row.income, row.expense)
+          for row in LedgerCategoryTotal.query}),
+    ]
+    for expected, stored in checks:
+        for key in sorted(set(expected) | set(stored)):
+            want = expected.get(key, (ZERO, ZERO))
+            have = stored.get(key, (ZERO, ZERO))
+            if want != have:
+                problems.append(f'{" ".join(map(str, key))}: expected income/expense {want}, stored {have}')
+    return problems
@@ -0,0 +1,149 @@
+"""Constant-memory ledger exports (Excel and CSV).
+
+Entries are read with a column-only query in batches (yield_per), so no ORM
+objects are built and only one batch is in memory at a time. The running
+balance is carried along while rows are written. Excel output uses openpyxl's
+write-only workbook, which spools rows to a temporary file; CSV output is a
+generator that the route streams chunk by chunk.
+
+The sheet layout matches the original pandas export: a title in row 1, the
+column headers in row 2, one row per entry, a blank row, then the summary.
+Once months are closed (periods.py) the export starts after the latest
+closed month: a ยอดยกมา row carries its frozen closing balance and only
+open-period entries are read.
+"""
+import csv
+import io
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
+from sqlalchemy.orm import aliased
+
+from models import db, User, ExpenseRequest, LedgerEntry
+import ledger_book
+from money import ZERO
+
+EXPORT_HEADERS = ['วันที่', 'หมวดหมู่', 'ผู้ทำรายการ', 'รายละเอียด', 'รายรับ', 'รายจ่าย', 'คงเหลือ', 'หมายเหตุ']
+BROUGHT_FORWARD = 'ยอดยกมา'  # ledger_import skips this row
+
+# Same header look as pandas' DataFrame.to_excel
+_THIN = Side(style='thin')
+_HEADER_FONT = Font(bold=True)
+_HEADER_BORDER = Border(left=_THIN, right=_THIN, top=_THIN, bottom=_THIN)
+_HEADER_ALIGNMENT = Alignment(horizontal='center', vertical='top')
+
+
+class LedgerExport:
+    """One export run over a single ledger."""
+
+    def __init__(self, ledger_type, title, month_start, month_end, batch_size=1000,
+                 start=None, opening_balance=None):
+        """`start` / `opening_balance`: export entries from that date on, continuing from that balance."""
+        self.ledger_type = ledger_type
+        self.title = title
+        self.batch_size = batch_size
+        self.start = start
+        self.opening_balance = opening_balance
+        self.balance = ZERO
+        self.row_count = 0
+        self.monthly_income, self.monthly_expense = ledger_book.period_totals(
+            ledger_type, month_start, month_end)
+
+    def _query(self):
+        requester = aliased(User)
+        creator = aliased(User)
+        query = db.session.query(
+            LedgerEntry.date, LedgerEntry.category, LedgerEntry.description, LedgerEntry.note,
+            LedgerEntry.amount, LedgerEntry.transaction_type, ExpenseRequest.id,
+            requester.name, requester.username, creator.name, creator.username
+        ).outerjoin(
+            ExpenseRequest, LedgerEntry.expense_request_id == ExpenseRequest.id
+        ).outerjoin(
+            requester, ExpenseRequest.requester_id == requester.id
+        ).outerjoin(
+            creator, LedgerEntry.created_by_id == creator.id
+        ).filter(
+            LedgerEntry.ledger_type == self.ledger_type
+        )
+        if self.start is not None:
+            query = query.filter(LedgerEntry.date >= self.start)
+        return query.order_by(LedgerEntry.date, LedgerEntry.id).yield_per(self.batch_size)
+
+    def rows(self):
+        """Yield one list of cell values per entry, updating the running balance."""
+        self.balance = self.opening_balance or ZERO
+        self.row_count = 0
+        if self.opening_balance is not None:
+            yield ['', '', '', BROUGHT_FORWARD, None, None, self.balance, None]
+        for (day, category, description, note, amount, transaction_type, request_id,
+             requester_name, requester_username, creator_name, creator_username) in self._query():
+            # Resolve Creator
+            creator = '-'
+            if request_id is not None:
+                creator = requester_name or requester_username
+            elif creator_username is not None:
+                creator = creator_name or creator_username
+
+            if transaction_type == 'Income':
+                self.balance += amount
+                income, expense = amount, None
+            else:
+                self.balance -= amount
+                income, expense = None, amount
+
+            self.row_count += 1
+            yield [day.strftime('%d/%m/%Y'), category, creator, description,
+                   income, expense, self.balance, note]
+
+    def summary_rows(self):
+        """Summary block written after the entries (call once rows() is exhausted)."""
+        return [
+            ['สรุปยอด'],
+            ['รายรับของเดือนนี้', self.monthly_income],
+            ['รายจ่ายของเดือนนี้', self.monthly_expense],
+            ['เงินคงเหลือสุทธิ', self.balance],  # Current Balance is the final running balance
+        ]
+
+    def write_xlsx(self, fileobj):
+        workbook = Workbook(write_only=True)
+        worksheet = workbook.create_sheet('Sheet1')
+        worksheet.append([self.title])
+
+        header = []
+        for name in EXPORT_HEADERS:
+            cell = WriteOnlyCell(worksheet, value=name)
+            cell.font = _HEADER_FONT
+            cell.border = _HEADER_BORDER
+            cell.alignment = _HEADER_ALIGNMENT
+            header.append(cell)
+        worksheet.append(header)
+
+        for row in self.rows():
+            worksheet.append(row)
+        worksheet.append([])
+        for row in self.summary_rows():
+            worksheet.append(row)
+        workbook.save(fileobj)
+
+    def iter_csv(self):
+        """Yield the export as UTF-8 CSV text chunks (with a BOM so Excel reads Thai)."""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        def drain():
+            chunk = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            return chunk
+
+        buffer.write('\ufeff')
+        writer.writerow([self.title])
+        writer.writerow(EXPORT_HEADERS)
+        for row in self.rows():
+            writer.writerow(row)
+            if self.row_count % self.batch_size == 0:
+                yield drain()
+        writer.writerow([])
+        writer.writerows(self.summary_rows())
+        yield drain()
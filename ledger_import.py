@@ -0,0 +1,237 @@
+"""Bulk import of ledger entries from Excel (.xlsx) or CSV.
+
+Rows are streamed: CSV through csv.reader, Excel through openpyxl's
+read-only mode, so a file with tens of thousands of rows is never held in
+memory at once. Each row is checked with the same rules as the ledger form
+(money.parse_amount / amount_in_range, a category from
+ledger_book.LEDGER_CATEGORIES) and valid rows are inserted batch by batch,
+one executemany INSERT and one commit per batch. Invalid rows are skipped
+and reported with their row number. With dry_run nothing is written.
+
+Accepted layouts: the app's own export (title row, then วันที่ / หมวดหมู่ /
+ผู้ทำรายการ / รายละเอียด / รายรับ / รายจ่าย / คงเหลือ / หมายเหตุ), or any
+sheet with a date column plus either รายรับ/รายจ่าย columns or an amount
+and a ประเภท (Income/Expense) column. Thai or English headers both work;
+columns the import does not use (e.g. คงเหลือ) are ignored. Reading stops at
+the first completely empty row, which is where exports put their summary;
+the ยอดยกมา (brought forward) row an export starts with is skipped. Rows
+dated in a closed accounting period (periods.py) are rejected.
+"""
+import codecs
+import csv
+import os
+from datetime import date, datetime
+
+from sqlalchemy import insert
+
+from models import db, LedgerEntry
+import ledger_book
+from money import amount_in_range, parse_amount
+
+# Canonical field -> accepted header spellings (compared lower-cased, stripped)
+HEADER_ALIASES = {
+    'date': ['วันที่', 'date'],
+    'category': ['หมวดหมู่', 'category'],
+    'description': ['รายละเอียด', 'description'],
+    'note': ['หมายเหตุ', 'note'],
+    'income': ['รายรับ', 'income'],
+    'expense': ['รายจ่าย', 'expense'],
+    'amount': ['จำนวนเงิน', 'amount'],
+    'transaction_type': ['ประเภท', 'transaction_type', 'type'],
+}
+TRANSACTION_TYPES = {'income': 'Income', 'รายรับ': 'Income', 'expense': 'Expense', 'รายจ่าย': 'Expense'}
+DATE_FORMATS = ['%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y']
+# Approved expense requests are booked under this category (see approval_ledger_values
+# in app.py), so it appears in exports and must survive an export -> import round trip
+APPROVAL_CATEGORY = 'รายจ่าย'
+# Description of the opening-balance row exports write after the header (ledger_export.BROUGHT_FORWARD)
+BROUGHT_FORWARD = 'ยอดยกมา'
+HEADER_SEARCH_ROWS = 10
+
+
+class LedgerImportError(ValueError):
+    """The file as a whole cannot be imported (unknown type, no header row)."""
+
+
+class ImportResult:
+    def __init__(self, max_errors):
+        self.max_errors = max_errors
+        self.total = 0
+        self.valid = 0
+        self.inserted = 0
+        self.error_count = 0
+        self.errors = []  # (row number in the file, message), first max_errors only
+
+    def add_error(self, row_number, message):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((row_number, message))
+
+
+def _is_blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _text(value):
+    return '' if value is None else str(value).strip()
+
+
+def _parse_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = _text(value)
+    for fmt in DATE_FORMATS:
+        try:
+            day = datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+        # Thai documents often use Buddhist-era years (2569 = 2026)
+        if day.year > 2400:
+            day = day.replace(year=day.year - 543)
+        return day
+    raise ValueError(f'วันที่ไม่ถูกต้อง: {text!r}')
+
+
+class LedgerImport:
+    """One import run of a file into a single ledger (URL type: 'subsidy', 'income' or 'lunch')."""
+
+    def __init__(self, ledger, user_id, dry_run=False, batch_size=1000, max_errors=500):
+        if ledger not in ledger_book.LEDGER_TYPES:
+            raise LedgerImportError(f'unknown ledger: {ledger!r}')
+        self.ledger_type = ledger_book.LEDGER_TYPES[ledger]
+        self.categories = ledger_book.LEDGER_CATEGORIES[ledger]
+        # Lunch has a single category, so it may be left blank; elsewhere blank means อื่นๆ
+        self.default_category = self.categories[0] if len(self.categories) == 1 else 'อื่นๆ'
+        self.closed_through = ledger_book.closed_through(self.ledger_type)
+        self.user_id = user_id
+        self.dry_run = dry_run
+        self.batch_size = batch_size
+        self.result = ImportResult(max_errors)
+
+    # --- Reading ---
+
+    def _iter_file_rows(self, fileobj, filename):
+        """Yield (row number, list of cell values) from an .xlsx or .csv file object (binary)."""
+        extension = os.path.splitext(filename or '')[1].lower()
+        if extension == '.csv':
+            text = codecs.getreader('utf-8-sig')(fileobj)
+            for number, row in enumerate(csv.reader(text), start=1):
+                yield number, row
+        elif extension == '.xlsx':
+            # Imported here so openpyxl is only loaded by workers that actually import
+            from openpyxl import load_workbook
+            workbook = load_workbook(fileobj, read_only=True, data_only=True)
+            try:
+                worksheet = workbook.worksheets[0]
+                for number, row in enumerate(worksheet.iter_rows(values_only=True), start=1):
+                    yield number, list(row)
+            finally:
+                workbook.close()
+        else:
+            raise LedgerImportError('รองรับเฉพาะไฟล์ .xlsx และ .csv')
+
+    def _map_header(self, row):
+        columns = {}
+        for index, value in enumerate(row):
+            name = _text(value).lower()
+            for field, aliases in HEADER_ALIASES.items():
+                if name in aliases and field not in columns:
+                    columns[field] = index
+        if 'date' in columns and ('income' in columns or 'expense' in columns or
+                                  ('amount' in columns and 'transaction_type' in columns)):
+            return columns
+        return None
+
+    def _records(self, fileobj, filename):
+        """Yield (row number, {field: raw value}) for every data row."""
+        rows = self._iter_file_rows(fileobj, filename)
+        columns = None
+        for number, row in rows:
+            columns = self._map_header(row)
+            if columns:
+                break
+            if number >= HEADER_SEARCH_ROWS:
+                break
+        if not columns:
+            raise LedgerImportError('ไม่พบแถวหัวตาราง (ต้องมีคอลัมน์ วันที่ และ รายรับ/รายจ่าย หรือ จำนวนเงิน + ประเภท)')
+
+        for number, row in rows:
+            if all(_is_blank(value) for value in row):
+                break
+            yield number, {field: row[index] if index < len(row) else None
+                           for field, index in columns.items()}
+
+    # --- Validation ---
+
+    def _entry(self, record):
+        """Column values for LedgerEntry from one record. Raises ValueError with a Thai message."""
+        day = _parse_date(record.get('date'))
+        if self.closed_through is not None and day <= self.closed_through:
+            raise ValueError(ledger_book.closed_message(self.closed_through, day))
+
+        income, expense = record.get('income'), record.get('expense')
+        if not _is_blank(income) or not _is_blank(expense):
+            if not _is_blank(income) and not _is_blank(expense):
+                raise ValueError('ระบุได้เพียงรายรับหรือรายจ่ายอย่างใดอย่างหนึ่ง')
+            transaction_type = 'Income' if not _is_blank(income) else 'Expense'
+            raw_amount = income if transaction_type == 'Income' else expense
+        else:
+            transaction_type = TRANSACTION_TYPES.get(_text(record.get('transaction_type')).lower())
+            if transaction_type is None:
+                raise ValueError(f"ประเภทไม่ถูกต้อง: {_text(record.get('transaction_type'))!r} (ใช้ รายรับ/รายจ่าย)")
+            raw_amount = record.get('amount')
+
+        try:
+            amount = parse_amount(raw_amount)
+        except ValueError:
+            raise ValueError(f'จำนวนเงินไม่ถูกต้อง: {_text(raw_amount)!r}')
+        if not amount_in_range(amount):
+            raise ValueError('จำนวนเงินต้องมากกว่า 0 และไม่เกิน 100,000,000 บาท')
+
+        category = _text(record.get('category')) or self.default_category
+        if category not in self.categories and not (category == APPROVAL_CATEGORY and transaction_type == 'Expense'):
+            raise ValueError(f"หมวดหมู่ไม่ถูกต้อง: {category!r} (ใช้ได้: {', '.join(self.categories)})")
+
+        return {
+            'date': day,
+            'amount': amount,
+            'description': _text(record.get('description')) or None,
+            'note': _text(record.get('note')) or None,
+            'category': category,
+            'transaction_type': transaction_type,
+            'ledger_type': self.ledger_type,
+            'created_by_id': self.user_id,
+        }
+
+    # --- Writing ---
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        if not self.dry_run:
+            db.session.execute(insert(LedgerEntry), batch)
+            ledger_book.record_entries(batch)
+            db.session.commit()
+            self.result.inserted += len(batch)
+        batch.clear()
+
+    def run(self, fileobj, filename):
+        """Import the file. Returns an ImportResult; raises LedgerImportError if the file is unusable."""
+        result = self.result
+        batch = []
+        for number, record in self._records(fileobj, filename):
+            if _is_blank(record.get('date')) and _text(record.get('description')) == BROUGHT_FORWARD:
+                continue
+            result.total += 1
+            try:
+                batch.append(self._entry(record))
+            except ValueError as e:
+                result.add_error(number, str(e))
+                continue
+            result.valid += 1
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+        self._flush(batch)
+        return result
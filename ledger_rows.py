@@ -0,0 +1,97 @@
+"""Display rows for the ledger page, precomputed in Python.
+
+The entries table used to walk ORM objects in Jinja, resolving the creator
+through two relationships and formatting every amount and the running
+balance with "{:,.2f}".format per row. Here one column-only query (no ORM
+objects, amounts read as raw integer satang) feeds a single pass that keeps
+the running balance in integers and produces LedgerRow records holding
+ready-to-print strings, so the template only places them.
+"""
+from sqlalchemy import Integer, tuple_, type_coerce
+from sqlalchemy.orm import aliased
+
+from models import db, User, ExpenseRequest, LedgerEntry
+from money import format_satang
+
+
+class LedgerRow:
+    """One entries-table row. `date` and `id` are kept for the page cursors."""
+    __slots__ = ('id', 'date', 'date_text', 'category', 'creator', 'creator_badge',
+                 'description', 'note', 'income', 'expense', 'balance', 'locked')
+
+
+def fetch(ledger_type, start, end, after=None, before=None, limit=100):
+    """One keyset page of entries in (date, id) order as plain tuples.
+
+    `after` / `before` are (date, id) cursors. Returns (tuples, has_prev, has_next).
+    """
+    requester = aliased(User)
+    creator = aliased(User)
+    position = tuple_(LedgerEntry.date, LedgerEntry.id)
+
+    # The cursor's date also narrows the plain date bounds: SQLite seeks the index
+    # on those, so deep pages start at the cursor instead of the range start
+    range_start = max(start, after[0]) if after else start
+    range_end = min(end, before[0]) if before else end
+
+    query = db.session.query(
+        LedgerEntry.id, LedgerEntry.date, LedgerEntry.category, LedgerEntry.description, LedgerEntry.note,
+        type_coerce(LedgerEntry.amount, Integer), LedgerEntry.transaction_type, ExpenseRequest.id,
+        requester.name, requester.username, creator.name, creator.username
+    ).outerjoin(
+        ExpenseRequest, LedgerEntry.expense_request_id == ExpenseRequest.id
+    ).outerjoin(
+        requester, ExpenseRequest.requester_id == requester.id
+    ).outerjoin(
+        creator, LedgerEntry.created_by_id == creator.id
+    ).filter(
+        LedgerEntry.ledger_type == ledger_type,
+        LedgerEntry.date >= range_start,
+        LedgerEntry.date <= range_end
+    )
+
+    if before:
+        tuples = query.filter(position < before).order_by(
+            LedgerEntry.date.desc(), LedgerEntry.id.desc()).limit(limit + 1).all()
+        has_prev = len(tuples) > limit
+        return tuples[:limit][::-1], has_prev, True
+    if after:
+        query = query.filter(position > after)
+    tuples = query.order_by(LedgerEntry.date, LedgerEntry.id).limit(limit + 1).all()
+    return tuples[:limit], after is not None, len(tuples) > limit
+
+
+def build(tuples, opening_balance=0, locked_through=None):
+    """LedgerRow list from fetch() tuples; the running balance starts at `opening_balance` satang.
+
+    Rows dated on or before `locked_through` (a closed period) are marked locked.
+    """
+    rows = []
+    append = rows.append
+    balance = opening_balance
+    for (entry_id, day, category, description, note, amount, transaction_type, request_id,
+         requester_name, requester_username, creator_name, creator_username) in tuples:
+        row = LedgerRow()
+        row.id = entry_id
+        row.date = day
+        row.date_text = day.strftime('%d/%m/%Y')
+        row.locked = locked_through is not None and day <= locked_through
+        row.category = category
+        # Requests show who asked for the money; manual entries show who recorded them
+        if request_id is not None:
+            row.creator, row.creator_badge = requester_name or requester_username, 'bg-info'
+        elif creator_username is not None:
+            row.creator, row.creator_badge = creator_name or creator_username, 'bg-secondary'
+        else:
+            row.creator, row.creator_badge = None, None
+        row.description = description or '-'
+        row.note = note or '-'
+        if transaction_type == 'Income':
+            balance += amount
+            row.income, row.expense = format_satang(amount), ''
+        else:
+            balance -= amount
+            row.income, row.expense = '', format_satang(amount)
+        row.balance = format_satang(balance)
+        append(row)
+    return rows
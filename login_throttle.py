@@ -0,0 +1,115 @@
+"""Sliding-window throttle for failed logins, checked before any password hashing.
+
+Each failed login is recorded under its username and under the client IP.
+While a username has LOGIN_THROTTLE_USER_LIMIT failures, or an IP has
+LOGIN_THROTTLE_IP_LIMIT failures, within the last LOGIN_THROTTLE_WINDOW
+seconds, further attempts for it are rejected without touching the password
+hash, so a guessing bot costs a dictionary lookup per request instead of a
+full hash. Usernames are counted per school (tenants.py); IPs across all of
+them. The IP limit is the higher one because a school's staff usually
+share one address. A successful login clears that username's failures.
+
+State is in memory and per process: with N workers a client can get up to N
+times the limit before every worker has seen it. The table holds at most
+LOGIN_THROTTLE_MAX_KEYS keys, oldest activity dropped first.
+Behind a reverse proxy, request.remote_addr is the proxy unless the app is
+wrapped in werkzeug's ProxyFix.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+
+import tenants
+
+DEFAULTS = {
+    'LOGIN_THROTTLE': True,
+    'LOGIN_THROTTLE_WINDOW': 300,      # seconds
+    'LOGIN_THROTTLE_USER_LIMIT': 5,
+    'LOGIN_THROTTLE_IP_LIMIT': 30,
+    'LOGIN_THROTTLE_MAX_KEYS': 10000,
+}
+
+_settings = dict(DEFAULTS)
+_failures = OrderedDict()  # key -> deque of failure times (time.monotonic)
+_lock = threading.Lock()
+_counters = {'rejected': 0, 'failures_recorded': 0}
+
+
+def _keys(username, ip):
+    return (('user', tenants.current_slug(), (username or '').strip().lower()),
+            _settings['LOGIN_THROTTLE_USER_LIMIT']), \
+           (('ip', ip or ''), _settings['LOGIN_THROTTLE_IP_LIMIT'])
+
+
+def _recent(key, now):
+    """Failure times of `key` still inside the window (expired ones dropped). Caller holds the lock."""
+    times = _failures.get(key)
+    if times is None:
+        return None
+    cutoff = now - _settings['LOGIN_THROTTLE_WINDOW']
+    while times and times[0] <= cutoff:
+        times.popleft()
+    if not times:
+        del _failures[key]
+        return None
+    return times
+
+
+def retry_after(username, ip):
+    """Seconds until this username/IP may try again, or 0 if the attempt may go ahead.
+
+    A positive answer counts as a rejected attempt.
+    """
+    if not _settings['LOGIN_THROTTLE']:
+        return 0
+    now = time.monotonic()
+    wait = 0
+    with _lock:
+        for key, limit in _keys(username, ip):
+            times = _recent(key, now)
+            if times is not None and len(times) >= limit:
+                # Free again once the oldest failure that keeps it at the limit leaves the window
+                wait = max(wait, times[-limit] + _settings['LOGIN_THROTTLE_WINDOW'] - now)
+        if wait:
+            _counters['rejected'] += 1
+    return int(wait) + 1 if wait else 0
+
+
+def record_failure(username, ip):
+    if not _settings['LOGIN_THROTTLE']:
+        return
+    now = time.monotonic()
+    with _lock:
+        for key, limit in _keys(username, ip):
+            times = _recent(key, now)
+            if times is None:
+                times = _failures[key] = deque(maxlen=limit)
+            times.append(now)
+            _failures.move_to_end(key)
+        _counters['failures_recorded'] += 1
+        while len(_failures) > _settings['LOGIN_THROTTLE_MAX_KEYS']:
+            _failures.popitem(last=False)
+
+
+def record_success(username):
+    with _lock:
+        _failures.pop(_keys(username, None)[0][0], None)
+
+
+def clear():
+    with _lock:
+        _failures.clear()
+
+
+def stats():
+    with _lock:
+        return dict(_counters, tracked_keys=len(_failures),
+                    window=_settings['LOGIN_THROTTLE_WINDOW'],
+                    user_limit=_settings['LOGIN_THROTTLE_USER_LIMIT'],
+                    ip_limit=_settings['LOGIN_THROTTLE_IP_LIMIT'])
+
+
+def init_app(app):
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+        _settings[key] = app.config[key]
@@ -0,0 +1,295 @@
+"""Request metrics in the Prometheus text exposition format, and a slow-request log.
+
+Every request adds to per-endpoint latency, DB time and query-count
+histograms (the DB figures come from query_profiler, which collects them
+on every request), and every rendered template to a render-time histogram.
+Other modules count what they do through the metric objects below: ledger
+writes and approvals are added with on_commit(), so a transaction that
+rolls back counts nothing. GET /metrics serves everything in the text
+format Prometheus scrapes.
+
+Metrics are kept per process, like the other stats in this app: with
+several gunicorn workers each scrape reaches one worker (label the target
+by instance, or run one worker per port).
+
+A request slower than SLOW_REQUEST_MS is logged with its timing breakdown
+(DB, templates, the rest) and its most expensive SQL statements; the last
+SLOW_REQUEST_KEEP are also kept for /api/v1/stats/slow-requests.
+
+/metrics is open to localhost only unless METRICS_TOKEN is set, in which
+case it needs "Authorization: Bearer <token>" from anywhere.
+"""
+import hmac
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from datetime import datetime
+
+from flask import (Response, abort, before_render_template, current_app, g, got_request_exception, request,
+                   template_rendered)
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Seconds; the last finite bucket is well past SLOW_REQUEST_MS's default
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+EXPORT_SECONDS_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+EXPORT_BYTES_BUCKETS = (10_000, 100_000, 1_000_000, 10_000_000, 50_000_000, 100_000_000, 500_000_000)
+SLOW_STATEMENTS = 10  # statements kept per slow request
+
+_registry = []
+_slow = deque(maxlen=50)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per label combination (exposed as <name>_total)."""
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels[name] for name in self.labelnames), 0)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f'{self.name}_total{_format_labels(self.labelnames, key)} {_format_number(value)}'
+
+
+class Histogram:
+    """Observations per label combination in cumulative buckets, with their sum and count."""
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # label values -> [count per bucket (+Inf last), sum]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def count(self, **labels):
+        entry = self._values.get(tuple(labels[name] for name in self.labelnames))
+        return sum(entry[0]) if entry else 0
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else _format_number(float(bound))
+                labels = _format_labels(self.labelnames, key, f'le="{le}"')
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labelnames, key)
+            yield f'{self.name}_sum{labels} {_format_number(float(total))}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+
+# --- Metrics ---
+
+REQUESTS = Counter('http_requests', 'Requests by endpoint, method and status code.',
+                   ('endpoint', 'method', 'status'))
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Time from the start of the request to the response.',
+                            ('endpoint',))
+REQUEST_DB_SECONDS = Histogram('http_request_db_seconds', 'Time spent in SQL statements per request.',
+                               ('endpoint',))
+REQUEST_QUERIES = Histogram('http_request_queries', 'SQL statements per request.', ('endpoint',),
+                            buckets=QUERY_BUCKETS)
+REQUEST_EXCEPTIONS = Counter('http_request_exceptions', 'Unhandled exceptions by endpoint.', ('endpoint',))
+SLOW_REQUESTS = Counter('http_slow_requests', 'Requests slower than SLOW_REQUEST_MS.', ('endpoint',))
+TEMPLATE_SECONDS = Histogram('template_render_seconds', 'Jinja render time per template.', ('template',))
+EXPORT_SECONDS = Histogram('ledger_export_duration_seconds', 'Time to write a ledger export file.',
+                           ('format',), buckets=EXPORT_SECONDS_BUCKETS)
+EXPORT_BYTES = Histogram('ledger_export_bytes', 'Size of written ledger export files.',
+                         ('format',), buckets=EXPORT_BYTES_BUCKETS)
+EXPORT_ROWS = Counter('ledger_export_rows', 'Ledger entries written to export files.', ('format',))
+JOBS = Counter('jobs', 'Finished background jobs by kind and status.', ('kind', 'status'))
+LEDGER_WRITES = Counter('ledger_writes', 'Committed ledger entry inserts and edits.', ('ledger', 'kind'))
+APPROVALS = Counter('approvals', 'Approval attempts by role and outcome.', ('role', 'outcome'))
+
+
+# --- Counting on commit ---
+
+def on_commit(session, metric, amount=1, **labels):
+    """metric.inc() once `session`'s current transaction commits; dropped if it rolls back."""
+    session.info.setdefault('metrics_pending', []).append((metric, amount, labels))
+
+
+def _after_commit(session):
+    for metric, amount, labels in session.info.pop('metrics_pending', ()):
+        metric.inc(amount, **labels)
+
+
+def _after_rollback(session, previous_transaction):
+    if previous_transaction.parent is None:  # the whole transaction, not a savepoint
+        session.info.pop('metrics_pending', None)
+
+
+# --- Exposition ---
+
+def exposition():
+    """Every metric in the Prometheus text format (version 0.0.4)."""
+    lines = []
+    for metric in _registry:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+def slow_threshold_ms():
+    return current_app.config['SLOW_REQUEST_MS']
+
+
+def slow_requests():
+    """The latest slow requests in this worker process, newest first."""
+    return list(reversed(_slow))
+
+
+# --- Request hooks ---
+
+def _endpoint():
+    return request.endpoint or 'unmatched'  # 404s: one label, not one per URL
+
+
+def _start_template(sender, template, context, **extra):
+    if 'metrics_start' in g:
+        g.metrics_templates.append(time.perf_counter())
+
+
+def _end_template(sender, template, context, **extra):
+    if 'metrics_start' in g and g.metrics_templates:
+        elapsed = time.perf_counter() - g.metrics_templates.pop()
+        TEMPLATE_SECONDS.observe(elapsed, template=template.name or '<string>')
+        if not g.metrics_templates:  # nested renders are already inside the outer one
+            g.metrics_template_time += elapsed
+
+
+def _exception(sender, exception, **extra):
+    if sender.config['METRICS_ENABLED']:
+        REQUEST_EXCEPTIONS.inc(endpoint=_endpoint())
+
+
+def _record_slow(app, response, elapsed, profile):
+    db_time = profile['time'] if profile else 0.0
+    template_time = g.metrics_template_time
+    statements = []
+    if profile:
+        timings = profile['statement_time']
+        for statement in sorted(timings, key=timings.get, reverse=True)[:SLOW_STATEMENTS]:
+            statements.append({'sql': ' '.join(statement.split())[:500],
+                               'count': profile['statements'][statement],
+                               'ms': round(timings[statement] * 1000, 2)})
+    record = {
+        'at': datetime.utcnow().isoformat(timespec='seconds'),
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'endpoint': _endpoint(),
+        'status': response.status_code,
+        'total_ms': round(elapsed * 1000, 2),
+        'db_ms': round(db_time * 1000, 2),
+        'queries': profile['count'] if profile else 0,
+        'template_ms': round(template_time * 1000, 2),
+        'other_ms': round((elapsed - db_time - template_time) * 1000, 2),
+        'statements': statements,
+    }
+    _slow.append(record)
+    SLOW_REQUESTS.inc(endpoint=record['endpoint'])
+    app.logger.warning(
+        'Slow request %s %s (%s): %.0f ms total, %.0f ms in %d queries, %.0f ms templates, %.0f ms other%s',
+        record['method'], record['path'], record['status'], record['total_ms'], record['db_ms'],
+        record['queries'], record['template_ms'], record['other_ms'],
+        ''.join(f"\n  {s['ms']:8.2f} ms x{s['count']:<4} {s['sql'][:200]}" for s in statements))
+
+
+def init_app(app):
+    app.config.setdefault('METRICS_ENABLED', True)
+    app.config.setdefault('METRICS_TOKEN', None)
+    app.config.setdefault('SLOW_REQUEST_MS', 1000)
+    app.config.setdefault('SLOW_REQUEST_KEEP', 50)
+    global _slow
+    _slow = deque(_slow, maxlen=app.config['SLOW_REQUEST_KEEP'])
+
+    if not event.contains(Session, 'after_commit', _after_commit):
+        event.listen(Session, 'after_commit', _after_commit)
+        event.listen(Session, 'after_soft_rollback', _after_rollback)
+    before_render_template.connect(_start_template, app)
+    template_rendered.connect(_end_template, app)
+    got_request_exception.connect(_exception, app)
+
+    @app.before_request
+    def start_metrics():
+        if app.config['METRICS_ENABLED']:
+            g.metrics_start = time.perf_counter()
+            g.metrics_templates = []
+            g.metrics_template_time = 0.0
+
+    @app.after_request
+    def record_metrics(response):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        endpoint = _endpoint()
+        REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        REQUEST_SECONDS.observe(elapsed, endpoint=endpoint)
+        profile = g.get('sql_profile')
+        if profile is not None:
+            REQUEST_DB_SECONDS.observe(profile['time'], endpoint=endpoint)
+            REQUEST_QUERIES.observe(profile['count'], endpoint=endpoint)
+        slow_ms = app.config['SLOW_REQUEST_MS']
+        if slow_ms and elapsed * 1000 >= slow_ms:
+            _record_slow(app, response, elapsed, profile)
+        return response
+
+    def metrics_view():
+        token = app.config['METRICS_TOKEN']
+        if token:
+            supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+            if not hmac.compare_digest(supplied.encode(), token.encode()):
+                abort(401)
+        elif request.remote_addr not in ('127.0.0.1', '::1'):
+            abort(403)
+        response = Response(exposition(), mimetype='text/plain')
+        response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+        response.cache_control.no_store = True
+        return response
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
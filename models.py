@@ -1,8 +1,16 @@
-from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from datetime import datetime
 
-db = SQLAlchemy()
+from money import Money
+from tenants import TenantSQLAlchemy
+
+db = TenantSQLAlchemy()  # each school's own database when TENANCY is on (see tenants.py)
+
+# NEW: The school this database belongs to (one row; its name heads every page)
+class School(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -15,10 +23,11 @@ class ExpenseRequest(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     requester_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     date = db.Column(db.Date, nullable=False, default=datetime.utcnow)
-    amount = db.Column(db.Float, nullable=False)
+    amount = db.Column(Money, nullable=False)  # stored as integer satang
     description = db.Column(db.String(500), nullable=True)  # NEW: รายละเอียดคำขอ
     account_type = db.Column(db.String(50), nullable=False) # 'Subsidy', 'Income', 'Lunch'
     status = db.Column(db.String(20), default='PENDING') # 'PENDING', 'APPROVED' (requires both)
+    category = db.Column(db.String(100), nullable=True)  # NEW: budget category of the ledger entry it becomes
     
     # Dual Approval System
     finance_approver_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
@@ -31,10 +40,18 @@ class ExpenseRequest(db.Model):
     finance_approver = db.relationship('User', foreign_keys=[finance_approver_id], backref='finance_approvals')
     director_approver = db.relationship('User', foreign_keys=[director_approver_id], backref='director_approvals')
 
+    __table_args__ = (
+        # my_requests: filter by requester, newest first
+        db.Index('ix_expense_request_requester_date', 'requester_id', 'date'),
+        # approve_page: partial index holding only the requests still waiting for approval
+        db.Index('ix_expense_request_open', 'date', 'id',
+                 sqlite_where=db.text("status != 'APPROVED'")),
+    )
+
 class LedgerEntry(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.Date, nullable=False, default=datetime.utcnow)
-    amount = db.Column(db.Float, nullable=False)
+    amount = db.Column(Money, nullable=False)  # stored as integer satang
     description = db.Column(db.String(255), nullable=True)
     note = db.Column(db.String(255), nullable=True)
     ledger_type = db.Column(db.String(50), nullable=False) # 'Subsidy', 'Income', 'Lunch'
@@ -52,18 +69,164 @@ class LedgerEntry(db.Model):
     expense_request = db.relationship('ExpenseRequest', backref=db.backref('ledger_entry', uselist=False))
     created_by = db.relationship('User', foreign_keys=[created_by_id])
 
-# NEW: Audit history table for ledger entries
-class LedgerEntryHistory(db.Model):
+    __table_args__ = (
+        # ledger_view / export_ledger: one ledger, date range, ordered by date
+        db.Index('ix_ledger_entry_type_date', 'ledger_type', 'date', 'id'),
+        # Period sums per transaction type (covering: answered from the index alone)
+        db.Index('ix_ledger_entry_type_txn_date', 'ledger_type', 'transaction_type', 'date', 'amount'),
+        db.Index('ix_ledger_entry_expense_request', 'expense_request_id'),
+        # API validators: newest entry per ledger (ETag)
+        db.Index('ix_ledger_entry_type_created', 'ledger_type', 'created_at'),
+    )
+
+# NEW: Append-only audit log for ledger entries (written by audit.py)
+class LedgerAudit(db.Model):
+    """One row per edit of a LedgerEntry, holding every field the edit changed."""
     id = db.Column(db.Integer, primary_key=True)
     ledger_entry_id = db.Column(db.Integer, db.ForeignKey('ledger_entry.id'), nullable=False)
-    edited_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    edited_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
-    
-    # Store what changed
-    field_name = db.Column(db.String(50), nullable=False)  # e.g., 'amount', 'description'
-    old_value = db.Column(db.String(500))
-    new_value = db.Column(db.String(500))
-    
+    ledger_type = db.Column(db.String(50), nullable=False)  # copied from the entry, for ledger-wide queries
+    changed_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Compact JSON diff {"field": [old, new], ...}; amounts in satang, dates ISO
+    changes = db.Column(db.Text, nullable=False)
+
     # Relationships
-    ledger_entry = db.relationship('LedgerEntry', backref='history')
-    edited_by = db.relationship('User', foreign_keys=[edited_by_id])
+    ledger_entry = db.relationship('LedgerEntry', backref=db.backref('audits', lazy='dynamic'))
+    changed_by = db.relationship('User', foreign_keys=[changed_by_id])
+
+    __table_args__ = (
+        # Deltas of one entry after a snapshot
+        db.Index('ix_ledger_audit_entry', 'ledger_entry_id', 'id'),
+        # Time travel / ledger_version: edits of one ledger after a point in time
+        db.Index('ix_ledger_audit_type_changed', 'ledger_type', 'changed_at'),
+    )
+
+# NEW: Full copies of an entry's audited fields, so reconstructing a past state
+# needs one snapshot plus at most AUDIT_SNAPSHOT_EVERY deltas
+class LedgerEntrySnapshot(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    ledger_entry_id = db.Column(db.Integer, db.ForeignKey('ledger_entry.id'), nullable=False)
+    # State right after this audit row; NULL = the entry as originally created
+    audit_id = db.Column(db.Integer, db.ForeignKey('ledger_audit.id'), nullable=True)
+    taken_at = db.Column(db.DateTime, nullable=False)  # the state is valid from this time
+    state = db.Column(db.Text, nullable=False)  # JSON {"field": value, ...}
+
+    __table_args__ = (
+        db.Index('ix_ledger_entry_snapshot_entry_taken', 'ledger_entry_id', 'taken_at'),
+    )
+
+# NEW: Materialized per-ledger, per-day totals (maintained by ledger_book.py)
+class LedgerDailyBalance(db.Model):
+    ledger_type = db.Column(db.String(50), primary_key=True)  # 'Subsidy', 'Income', 'Lunch'
+    date = db.Column(db.Date, primary_key=True)
+    income = db.Column(Money, nullable=False, default=0)
+    expense = db.Column(Money, nullable=False, default=0)
+
+# NEW: Materialized per-fiscal-year, per-ledger, per-category totals (maintained by ledger_book.py)
+class LedgerCategoryTotal(db.Model):
+    fiscal_year = db.Column(db.Integer, primary_key=True)  # Buddhist-era label, e.g. 2569 = Oct 2025 - Sep 2026
+    ledger_type = db.Column(db.String(50), primary_key=True)
+    category = db.Column(db.String(100), primary_key=True)
+    income = db.Column(Money, nullable=False, default=0)
+    expense = db.Column(Money, nullable=False, default=0)
+
+class Budget(db.Model):
+    """Allocation for one category of one ledger in one fiscal year (see budgets.py)."""
+    id = db.Column(db.Integer, primary_key=True)
+    fiscal_year = db.Column(db.Integer, nullable=False)  # Buddhist-era label, as LedgerCategoryTotal
+    ledger_type = db.Column(db.String(50), nullable=False)
+    category = db.Column(db.String(100), nullable=False)
+    amount = db.Column(Money, nullable=False)  # stored as integer satang
+    updated_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('fiscal_year', 'ledger_type', 'category', name='uq_budget_year_ledger_category'),
+    )
+
+# NEW: Month-end close of one ledger (written by periods.py). Entries dated in a
+# closed month are locked; the totals here are frozen at closing time
+class PeriodClose(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    ledger_type = db.Column(db.String(50), nullable=False)
+    month = db.Column(db.Date, nullable=False)  # first day of the closed month
+    opening_balance = db.Column(Money, nullable=False)  # stored as integer satang
+    income = db.Column(Money, nullable=False)
+    expense = db.Column(Money, nullable=False)
+    closing_balance = db.Column(Money, nullable=False)
+    closed_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    closed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=True)  # entries moved to ledger_entry_archive
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # for ledger_version
+
+    closed_by = db.relationship('User', foreign_keys=[closed_by_id])
+
+    __table_args__ = (
+        db.UniqueConstraint('ledger_type', 'month', name='uq_period_close_ledger_month'),
+    )
+
+# NEW: Archived rows of closed months, same columns as the live tables (moved by periods.archive_through)
+class LedgerEntryArchive(db.Model):
+    id = db.Column(db.Integer, primary_key=True)  # the original LedgerEntry.id
+    date = db.Column(db.Date, nullable=False)
+    amount = db.Column(Money, nullable=False)
+    description = db.Column(db.String(255), nullable=True)
+    note = db.Column(db.String(255), nullable=True)
+    ledger_type = db.Column(db.String(50), nullable=False)
+    category = db.Column(db.String(100), nullable=False)
+    transaction_type = db.Column(db.String(20), nullable=False)
+    expense_request_id = db.Column(db.Integer, nullable=True)
+    created_by_id = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=True)
+    archived_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_ledger_entry_archive_type_date', 'ledger_type', 'date', 'id'),
+    )
+
+class LedgerAuditArchive(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    ledger_entry_id = db.Column(db.Integer, nullable=False)
+    ledger_type = db.Column(db.String(50), nullable=False)
+    changed_by_id = db.Column(db.Integer, nullable=False)
+    changed_at = db.Column(db.DateTime, nullable=False)
+    changes = db.Column(db.Text, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_ledger_audit_archive_entry', 'ledger_entry_id', 'id'),
+    )
+
+class LedgerEntrySnapshotArchive(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    ledger_entry_id = db.Column(db.Integer, nullable=False)
+    audit_id = db.Column(db.Integer, nullable=True)
+    taken_at = db.Column(db.DateTime, nullable=False)
+    state = db.Column(db.Text, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_ledger_entry_snapshot_archive_entry', 'ledger_entry_id', 'taken_at'),
+    )
+
+class Job(db.Model):
+    """Background job (exports, reports) run by the in-process worker pool in jobs.py."""
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex
+    kind = db.Column(db.String(50), nullable=False)  # e.g. 'ledger_export'
+    params = db.Column(db.Text, nullable=False)  # JSON
+    # Same kind + params + data version -> same key; used to de-duplicate and reuse artifacts
+    dedupe_key = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='QUEUED')  # QUEUED, RUNNING, DONE, FAILED, EXPIRED
+    artifact_path = db.Column(db.String(500))
+    download_name = db.Column(db.String(200))
+    mimetype = db.Column(db.String(100))
+    error = db.Column(db.Text)
+    created_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    created_by = db.relationship('User', foreign_keys=[created_by_id])
+
+    __table_args__ = (
+        db.Index('ix_job_dedupe_status', 'dedupe_key', 'status'),
+        db.Index('ix_job_status_created', 'status', 'created_at'),
+    )
@@ -0,0 +1,66 @@
+"""Fixed-point money.
+
+Amounts are stored as integer satang (1/100 baht) and exposed to Python as
+Decimal with two places. SUM() in SQLite then runs over integers and is
+exact, and no float rounding ever reaches a balance.
+"""
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from sqlalchemy.types import Integer, TypeDecorator
+
+SATANG = Decimal('0.01')
+ZERO = Decimal('0.00')
+MAX_AMOUNT = Decimal('100000000')  # Max 100 million baht per entry/request
+
+
+def to_satang(value):
+    """Baht (Decimal, int, float or numeric string) -> integer satang, rounded half up."""
+    if isinstance(value, float):
+        value = repr(value)  # shortest round-trip text, avoids binary float artefacts
+    return int(Decimal(value).quantize(SATANG, rounding=ROUND_HALF_UP).scaleb(2))
+
+
+def from_satang(value):
+    """Integer satang -> Decimal baht with two places."""
+    return Decimal(int(value)).scaleb(-2).quantize(SATANG)
+
+
+def format_satang(value):
+    """Integer satang -> '1,234.50' (exact integer arithmetic, no Decimal or float)."""
+    whole, fraction = divmod(abs(value), 100)
+    return f"{'-' if value < 0 else ''}{whole:,}.{fraction:02d}"
+
+
+def parse_amount(text):
+    """Parse a form value into a Decimal amount. Raises ValueError if it is not a finite number."""
+    try:
+        amount = Decimal(str(text).strip().replace(',', ''))
+    except (InvalidOperation, TypeError):
+        raise ValueError(f'invalid amount: {text!r}')
+    if not amount.is_finite():
+        raise ValueError(f'invalid amount: {text!r}')
+    try:
+        return amount.quantize(SATANG, rounding=ROUND_HALF_UP)
+    except InvalidOperation:  # too many digits for the decimal context, e.g. 1e30
+        raise ValueError(f'invalid amount: {text!r}')
+
+
+def amount_in_range(amount):
+    """The rule every entry and request amount must pass: more than 0, at most MAX_AMOUNT."""
+    return ZERO < amount <= MAX_AMOUNT
+
+
+class Money(TypeDecorator):
+    """INTEGER column holding satang; Python side sees Decimal baht."""
+    impl = Integer
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return to_satang(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return from_satang(value)
@@ -0,0 +1,83 @@
+"""Password hashing with a configurable cost, rehash-on-login and CPU metrics.
+
+PASSWORD_HASH_METHOD is any Werkzeug method string, e.g. 'scrypt:32768:8:1'
+(Werkzeug's default, ~100 ms of CPU per hash) or 'pbkdf2:sha256:260000'.
+New passwords are hashed with it, and when a user logs in with a hash made
+by a different method or cost, verify() also returns the password rehashed
+with the current one for the caller to store. Lowering or raising the cost
+therefore takes effect for each user at their next login, with no reset.
+
+Every verification's CPU time (time.thread_time, so other threads' work is
+not counted) goes into per-process counters returned by stats().
+"""
+import threading
+import time
+from collections import deque
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+RECENT = 1000  # verifications kept for the percentiles
+
+_settings = {'method': DEFAULT_METHOD}
+_prefixes = {}
+_lock = threading.Lock()
+_counters = {'verified': 0, 'failed': 0, 'rehashed': 0, 'cpu_seconds': 0.0, 'max_cpu_ms': 0.0}
+_recent = deque(maxlen=RECENT)
+
+
+def _prefix(method):
+    """Canonical '<method>:<params>' that Werkzeug writes before the salt, e.g. 'pbkdf2:sha256:600000'."""
+    if method not in _prefixes:
+        _prefixes[method] = generate_password_hash('', method=method, salt_length=1).split('$', 1)[0]
+    return _prefixes[method]
+
+
+def hash_password(password):
+    return generate_password_hash(password, method=_settings['method'])
+
+
+def needs_rehash(password_hash):
+    return password_hash.split('$', 1)[0] != _prefix(_settings['method'])
+
+
+def verify(password_hash, password):
+    """Check `password` against `password_hash`. Returns (ok, new_hash).
+
+    new_hash is the password hashed with the current method when it matched
+    but `password_hash` was made with another method or cost, else None.
+    """
+    started = time.thread_time()
+    ok = check_password_hash(password_hash, password)
+    new_hash = hash_password(password) if ok and needs_rehash(password_hash) else None
+    cpu = time.thread_time() - started
+
+    with _lock:
+        _counters['verified' if ok else 'failed'] += 1
+        _counters['rehashed'] += new_hash is not None
+        _counters['cpu_seconds'] += cpu
+        _counters['max_cpu_ms'] = max(_counters['max_cpu_ms'], cpu * 1000)
+        _recent.append(cpu * 1000)
+    return ok, new_hash
+
+
+def stats():
+    """Verification counters and hashing CPU time per login in this worker process."""
+    with _lock:
+        counters = dict(_counters)
+        recent = sorted(_recent)
+    attempts = counters['verified'] + counters['failed']
+    counters['cpu_seconds'] = round(counters['cpu_seconds'], 3)
+    counters['max_cpu_ms'] = round(counters['max_cpu_ms'], 2)
+    counters['mean_cpu_ms'] = round(counters['cpu_seconds'] * 1000 / attempts, 2) if attempts else None
+    for name, p in (('p50_cpu_ms', 0.50), ('p95_cpu_ms', 0.95)):
+        counters[name] = round(recent[min(len(recent) - 1, int(len(recent) * p))], 2) if recent else None
+    counters['method'] = _settings['method']
+    return counters
+
+
+def init_app(app):
+    app.config.setdefault('PASSWORD_HASH_METHOD', DEFAULT_METHOD)
+    method = app.config['PASSWORD_HASH_METHOD']
+    _prefix(method)  # fail at startup, not at the first login, on a method Werkzeug does not know
+    _settings['method'] = method
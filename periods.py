@@ -0,0 +1,189 @@
+"""Month-end close of the ledgers, and the archive of closed months.
+
+Closing a month of a ledger stores its opening balance, income, expense and
+closing balance in a PeriodClose row, read from the daily balance table (one
+grouped query, however many entries the month has). From then on
+ledger_book refuses any entry dated in that month or earlier
+(PeriodClosedError), so the frozen figures stay true: period_totals() reads
+a closed month as its one row, and the ledger page and exports start from
+the latest closing balance instead of the ledger's first entry.
+
+Months close in order with no gaps: closing through a month first closes
+every open month before it, starting with the month of the ledger's first
+entry. Only the latest closed month can be reopened, and not once archived.
+
+Archiving moves the entries of closed months, with their audit rows and
+snapshots, into the *_archive tables. The daily and category totals still
+count them (ledger_book rebuilds and verifies from live and archived rows),
+but they leave ledger_entry, its search index and the history/as-of views,
+so the tables every request reads only hold the open months.
+"""
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import delete, func, insert, literal, select
+
+from models import (db, PeriodClose, LedgerEntry, LedgerAudit, LedgerEntrySnapshot, LedgerDailyBalance,
+                    LedgerEntryArchive, LedgerAuditArchive, LedgerEntrySnapshotArchive)
+import ledger_book
+from money import ZERO
+
+THAI_MONTHS = ['มกราคม', 'กุมภาพันธ์', 'มีนาคม', 'เมษายน', 'พฤษภาคม', 'มิถุนายน',
+               'กรกฎาคม', 'สิงหาคม', 'กันยายน', 'ตุลาคม', 'พฤศจิกายน', 'ธันวาคม']
+
+
+class PeriodError(Exception):
+    """A close, reopen or archive that is not allowed. str() is a Thai message."""
+
+
+def month_label(month):
+    """'กันยายน 2569' (Buddhist-era year)."""
+    return f'{THAI_MONTHS[month.month - 1]} {month.year + 543}'
+
+
+def next_month(month):
+    return ledger_book.month_end(month) + timedelta(days=1)
+
+
+def latest_close(ledger_type):
+    return PeriodClose.query.filter_by(ledger_type=ledger_type).order_by(PeriodClose.month.desc()).first()
+
+
+def archived_through(ledger_type):
+    """Last day of the ledger's latest archived month, or None."""
+    month = db.session.query(func.max(PeriodClose.month)).filter(
+        PeriodClose.ledger_type == ledger_type, PeriodClose.archived_at.isnot(None)).scalar()
+    return ledger_book.month_end(month) if month else None
+
+
+def first_open_month(ledger_type):
+    """First day of the month the next close would cover, or None if the ledger has no entries yet."""
+    latest = latest_close(ledger_type)
+    if latest is not None:
+        return next_month(latest.month)
+    first_day = db.session.query(func.min(LedgerDailyBalance.date)).filter(
+        LedgerDailyBalance.ledger_type == ledger_type).scalar()
+    return first_day.replace(day=1) if first_day else None
+
+
+def _monthly_totals(ledger_type, start, end):
+    """{'YYYY-MM': (income, expense)} from the daily table, for the months between two dates."""
+    month = func.strftime('%Y-%m', LedgerDailyBalance.date)
+    return {key: (income, expense) for key, income, expense in db.session.query(
+        month, func.sum(LedgerDailyBalance.income), func.sum(LedgerDailyBalance.expense)
+    ).filter(
+        LedgerDailyBalance.ledger_type == ledger_type,
+        LedgerDailyBalance.date >= start,
+        LedgerDailyBalance.date <= end
+    ).group_by(month)}
+
+
+def close_through(ledger_type, month, user_id, today=None):
+    """Close every open month of the ledger up to and including `month` (no commit).
+
+    Returns the new PeriodClose rows, oldest first. Raises PeriodError if the
+    month has not ended yet, is already closed, or the ledger has no entries.
+    """
+    month = month.replace(day=1)
+    if ledger_book.month_end(month) >= (today or date.today()):
+        raise PeriodError(f'ปิดงวดได้เฉพาะเดือนที่สิ้นสุดแล้ว ({month_label(month)} ยังไม่สิ้นเดือน)')
+    start = first_open_month(ledger_type)
+    if start is None:
+        raise PeriodError('ยังไม่มีรายการในทะเบียนนี้ ไม่มีงวดให้ปิด')
+    if month < start:
+        raise PeriodError(f'{month_label(month)} ปิดงวดไปแล้ว')
+
+    latest = latest_close(ledger_type)
+    balance = latest.closing_balance if latest is not None else ZERO
+    totals = _monthly_totals(ledger_type, start, ledger_book.month_end(month))
+    now = datetime.utcnow()
+    closed = []
+    while start <= month:
+        income, expense = totals.get(start.strftime('%Y-%m'), (ZERO, ZERO))
+        close = PeriodClose(ledger_type=ledger_type, month=start, opening_balance=balance,
+                            income=income, expense=expense, closing_balance=balance + income - expense,
+                            closed_by_id=user_id, closed_at=now, updated_at=now)
+        db.session.add(close)
+        closed.append(close)
+        balance = close.closing_balance
+        start = next_month(start)
+    db.session.flush()
+    return closed
+
+
+def reopen_latest(ledger_type):
+    """Reopen the ledger's latest closed month (no commit). Returns its first day."""
+    latest = latest_close(ledger_type)
+    if latest is None:
+        raise PeriodError('ยังไม่มีงวดที่ปิดไว้')
+    if latest.archived_at is not None:
+        raise PeriodError(f'{month_label(latest.month)} ย้ายรายการไปเก็บถาวรแล้ว ไม่สามารถเปิดงวดได้')
+    db.session.delete(latest)
+    db.session.flush()
+    return latest.month
+
+
+def _move(archive, live, condition, **extra):
+    """INSERT ... SELECT the `live` rows matching `condition` into `archive`, then delete them."""
+    columns = [column.name for column in live.__table__.columns]
+    values = [live.__table__.c[name] for name in columns] + [literal(value) for value in extra.values()]
+    db.session.execute(insert(archive).from_select(columns + list(extra), select(*values).where(condition)))
+    return db.session.execute(delete(live).where(condition).execution_options(synchronize_session=False)).rowcount
+
+
+def archive_through(ledger_type, month):
+    """Move the entries of closed months up to `month`, with their audit trail, to the archive (no commit).
+
+    Returns the number of entries moved. The search index drops them through
+    its delete trigger; the daily and category totals are left as they are.
+    """
+    through = ledger_book.month_end(month)
+    closed = ledger_book.closed_through(ledger_type)
+    if closed is None or through > closed:
+        raise PeriodError(f'ต้องปิดงวด {month_label(month)} ก่อนจึงจะย้ายไปเก็บถาวรได้')
+    months = PeriodClose.query.filter(
+        PeriodClose.ledger_type == ledger_type,
+        PeriodClose.month <= through,
+        PeriodClose.archived_at.is_(None)
+    ).all()
+    if not months:
+        raise PeriodError(f'รายการถึง{month_label(month)}ย้ายไปเก็บถาวรแล้ว')
+
+    now = datetime.utcnow()
+    entry_ids = select(LedgerEntry.id).where(LedgerEntry.ledger_type == ledger_type, LedgerEntry.date <= through)
+    # Snapshots and audits point at the entries, so they go first
+    _move(LedgerEntrySnapshotArchive, LedgerEntrySnapshot, LedgerEntrySnapshot.ledger_entry_id.in_(entry_ids))
+    _move(LedgerAuditArchive, LedgerAudit, LedgerAudit.ledger_entry_id.in_(entry_ids))
+    moved = _move(LedgerEntryArchive, LedgerEntry,
+                  (LedgerEntry.ledger_type == ledger_type) & (LedgerEntry.date <= through), archived_at=now)
+    for close in months:
+        close.archived_at = now
+    db.session.flush()
+    return moved
+
+
+def verify():
+    """Check every ledger's closes against the daily table and each other. Returns a list of problems."""
+    problems = []
+    for ledger_type in ledger_book.LEDGER_TYPES.values():
+        closes = PeriodClose.query.filter_by(ledger_type=ledger_type).order_by(PeriodClose.month).all()
+        if not closes:
+            continue
+        first, last = closes[0].month, closes[-1].month
+        income, expense = ledger_book.period_totals(ledger_type, date(1, 1, 1), first - timedelta(days=1))
+        balance = income - expense
+        totals = _monthly_totals(ledger_type, first, ledger_book.month_end(last))
+        month = first
+        for close in closes:
+            label = f'{ledger_type} {close.month.strftime("%Y-%m")}'
+            if close.month != month:
+                problems.append(f'{label}: expected month {month.strftime("%Y-%m")} (closes must be contiguous)')
+            want = totals.get(close.month.strftime('%Y-%m'), (ZERO, ZERO))
+            if (close.income, close.expense) != want:
+                problems.append(f'{label}: daily totals income/expense {want}, frozen {(close.income, close.expense)}')
+            if close.opening_balance != balance:
+                problems.append(f'{label}: expected opening balance {balance}, frozen {close.opening_balance}')
+            if close.closing_balance != close.opening_balance + close.income - close.expense:
+                problems.append(f'{label}: closing balance {close.closing_balance} does not add up')
+            balance = close.closing_balance
+            month = next_month(close.month)
+    return problems
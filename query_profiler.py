@@ -0,0 +1,74 @@
+"""Per-request SQL instrumentation.
+
+Every request (with METRICS_ENABLED, or in debug mode / with SQL_PROFILE)
+counts the statements it sends through SQLAlchemy and the time spent in
+the database, per statement text too (g.sql_profile); the metrics module
+turns these into histograms and the slow-request log. The time is cursor
+execution only: building and compiling statements is not included.
+
+When the app runs in debug mode (or SQL_PROFILE is set), the totals are
+also returned as X-Query-Count / X-DB-Time headers and logged, and a
+statement that repeats SQL_PROFILE_N_PLUS_ONE times or more in one request
+is logged as a likely N+1 lazy load.
+"""
+import time
+from collections import Counter, defaultdict
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+N_PLUS_ONE_THRESHOLD = 5
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'sql_profile' in g:
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not (has_request_context() and 'sql_profile' in g):
+        return
+    starts = conn.info.get('query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    profile = g.sql_profile
+    profile['count'] += 1
+    profile['time'] += elapsed
+    # Statements are parametrized, so a lazy load repeated per row has identical text
+    profile['statements'][statement] += 1
+    profile['statement_time'][statement] += elapsed
+
+
+def init_app(app):
+    app.config.setdefault('SQL_PROFILE', False)
+    app.config.setdefault('SQL_PROFILE_N_PLUS_ONE', N_PLUS_ONE_THRESHOLD)
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def start_profile():
+        if app.debug or app.config['SQL_PROFILE'] or app.config.get('METRICS_ENABLED'):
+            g.sql_profile = {'count': 0, 'time': 0.0, 'statements': Counter(),
+                             'statement_time': defaultdict(float)}
+
+    @app.after_request
+    def report_profile(response):
+        profile = g.get('sql_profile')
+        if profile is None or not (app.debug or app.config['SQL_PROFILE']):
+            return response
+        db_ms = profile['time'] * 1000
+        response.headers['X-Query-Count'] = str(profile['count'])
+        response.headers['X-DB-Time'] = f'{db_ms:.2f}ms'
+        app.logger.info('%s %s: %d queries, %.2f ms in DB',
+                        request.method, request.path, profile['count'], db_ms)
+
+        threshold = app.config['SQL_PROFILE_N_PLUS_ONE']
+        for statement, times in profile['statements'].items():
+            if times >= threshold:
+                app.logger.warning('Possible N+1 in %s (endpoint %s): statement ran %d times: %s',
+                                   request.path, request.endpoint, times, ' '.join(statement.split())[:200])
+        return response
@@ -0,0 +1,97 @@
+"""School-wide totals for the dashboard: Thai fiscal year, current month, trailing 12 months.
+
+Everything comes from one grouped query over LedgerDailyBalance (ledger x
+month), which already holds income and expense per ledger per day, so the
+query reads at most ~12-24 months x 3 ledgers worth of day rows no matter
+how many entries exist. The result is cached per process and school and
+keyed on ledger_book.ledger_version(), so any new or edited entry (from any
+worker) produces a fresh rollup on the next request.
+"""
+import threading
+from datetime import date
+
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import func
+
+from models import db, LedgerDailyBalance
+import ledger_book
+import tenants
+from money import ZERO
+
+_cache = {}  # school slug (None: single school) -> (key, rollups)
+_lock = threading.Lock()
+
+
+def _totals(income=ZERO, expense=ZERO):
+    return {'income': income, 'expense': expense, 'balance': income - expense}
+
+
+def compute(today):
+    """Build the rollups for `today` (one query)."""
+    month_start = today.replace(day=1)
+    trailing_start = month_start - relativedelta(months=11)
+    fy_start = ledger_book.fiscal_year_start(today)
+    month_key = func.strftime('%Y-%m', LedgerDailyBalance.date)
+    rows = db.session.query(
+        LedgerDailyBalance.ledger_type,
+        month_key,
+        func.sum(LedgerDailyBalance.income),
+        func.sum(LedgerDailyBalance.expense)
+    ).filter(
+        LedgerDailyBalance.date >= min(fy_start, trailing_start),
+        LedgerDailyBalance.date <= today
+    ).group_by(LedgerDailyBalance.ledger_type, month_key).all()
+
+    months = [(trailing_start + relativedelta(months=i)).strftime('%Y-%m') for i in range(12)]
+    fy_months = {(fy_start + relativedelta(months=i)).strftime('%Y-%m') for i in range(12)}
+    by_month = {(ledger_type, month): (income, expense) for ledger_type, month, income, expense in rows}
+
+    ledgers = {}
+    for url_type, ledger_type in ledger_book.LEDGER_TYPES.items():
+        periods = {'fiscal_year': [ZERO, ZERO], 'month': [ZERO, ZERO], 'trailing_12': [ZERO, ZERO]}
+        series = []
+        for (row_type, month), (income, expense) in by_month.items():
+            if row_type != ledger_type:
+                continue
+            for name, included in (('fiscal_year', month in fy_months),
+                                   ('month', month == months[-1]),
+                                   ('trailing_12', month in months)):
+                if included:
+                    periods[name][0] += income
+                    periods[name][1] += expense
+        for month in months:
+            series.append({'month': month, **_totals(*by_month.get((ledger_type, month), (ZERO, ZERO)))})
+        ledgers[url_type] = {
+            'ledger_type': ledger_type,
+            **{name: _totals(*values) for name, values in periods.items()},
+            'months': series,
+        }
+
+    school = {}
+    for name in ('fiscal_year', 'month', 'trailing_12'):
+        school[name] = _totals(sum((l[name]['income'] for l in ledgers.values()), ZERO),
+                               sum((l[name]['expense'] for l in ledgers.values()), ZERO))
+
+    return {
+        'today': today,
+        'fiscal_year': ledger_book.fiscal_year_label(today),
+        'fiscal_year_start': fy_start,
+        'trailing_start': trailing_start,
+        'ledgers': ledgers,
+        'school': school,
+    }
+
+
+def dashboard_rollups(today=None):
+    """Cached compute(): recomputed only when the date or any ledger changes."""
+    today = today or date.today()
+    key = (today, ledger_book.ledger_version())
+    school = tenants.current_slug()
+    with _lock:
+        cached = _cache.get(school)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    result = compute(today)
+    with _lock:
+        _cache[school] = (key, result)
+    return result
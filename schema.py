@@ -0,0 +1,148 @@
+"""Lightweight, idempotent schema upgrades for existing SQLite databases.
+
+db.create_all() only creates missing tables; it never touches tables that
+already exist. Everything here brings an older instance/financial_system.db
+up to the current models and is safe to run on every start.
+"""
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateTable
+
+from models import db, ExpenseRequest, LedgerEntry, LedgerDailyBalance
+from money import to_satang
+import audit
+import search
+
+# Columns that moved from FLOAT baht to INTEGER satang (money.Money)
+MONEY_COLUMNS = [
+    (ExpenseRequest.__table__, ['amount']),
+    (LedgerEntry.__table__, ['amount']),
+    (LedgerDailyBalance.__table__, ['income', 'expense']),
+]
+
+
+def add_missing_columns():
+    """Add nullable columns declared on the models but missing from existing tables."""
+    existing_tables = set(inspect(db.engine).get_table_names())
+    added = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {column['name'] for column in inspect(db.engine).get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable or column.primary_key:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as conn:
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            added.append(f'{table.name}.{column.name}')
+    return added
+
+
+def create_missing_indexes():
+    """Create indexes declared on the models but missing from the database."""
+    existing_tables = set(inspect(db.engine).get_table_names())
+    created = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {ix['name'] for ix in inspect(db.engine).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+                created.append(index.name)
+    if created:
+        # Give the query planner fresh statistics for the new indexes
+        with db.engine.begin() as conn:
+            conn.execute(text('ANALYZE'))
+    return created
+
+
+def _rebuild_table(conn, table, select_sql):
+    """Recreate `table` from the current model and fill it with `select_sql`.
+
+    Follows SQLite's recommended procedure (create new, copy, drop old, rename)
+    so foreign keys in other tables keep pointing at the right name. Indexes
+    are dropped with the old table and recreated by create_missing_indexes().
+    """
+    new_name = f'{table.name}__new'
+    ddl = str(CreateTable(table).compile(db.engine)).strip()
+    ddl = ddl.replace(f'CREATE TABLE {table.name} ', f'CREATE TABLE {new_name} ', 1)
+    columns = ', '.join(column.name for column in table.columns)
+    conn.execute(f'DROP TABLE IF EXISTS {new_name}')
+    conn.execute(ddl)
+    conn.execute(f'INSERT INTO {new_name} ({columns}) {select_sql}')
+    conn.execute(f'DROP TABLE {table.name}')
+    conn.execute(f'ALTER TABLE {new_name} RENAME TO {table.name}')
+
+
+def _legacy_satang(value):
+    return None if value is None else to_satang(value)
+
+
+def convert_money_columns():
+    """Convert legacy FLOAT amount columns to integer satang, exactly once per table."""
+    converted = []
+    raw = db.engine.raw_connection()
+    conn = raw.driver_connection
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None  # we issue BEGIN/COMMIT ourselves so DDL is transactional too
+    # Same rounding as the Money column: ROUND(x * 100) would round the binary value (1.005 -> 1.00)
+    conn.create_function('to_satang', 1, _legacy_satang, deterministic=True)
+    try:
+        for table, money_columns in MONEY_COLUMNS:
+            declared = {row[1]: row[2].upper() for row in conn.execute(f'PRAGMA table_info({table.name})')}
+            legacy = [name for name in money_columns if declared.get(name) not in (None, 'INTEGER')]
+            if not legacy:
+                continue
+            select_list = ', '.join(
+                f'to_satang({column.name})' if column.name in legacy else column.name
+                for column in table.columns
+            )
+            conn.execute('BEGIN')
+            try:
+                _rebuild_table(conn, table, f'SELECT {select_list} FROM {table.name}')
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            converted.append(table.name)
+    finally:
+        conn.isolation_level = isolation_level
+        raw.close()
+    return converted
+
+
+def migrate_legacy_history():
+    """Move the old per-field ledger_entry_history table into the audit log, then drop it.
+
+    Returns the number of audit rows written, or None if there was nothing to migrate.
+    """
+    if 'ledger_entry_history' not in inspect(db.engine).get_table_names():
+        return None
+    rows = db.session.execute(text(
+        'SELECT ledger_entry_id, edited_by_id, edited_at, field_name, old_value, new_value '
+        'FROM ledger_entry_history ORDER BY edited_at, id'
+    )).all()
+    try:
+        written = audit.import_legacy_history(rows)
+        db.session.execute(text('DROP TABLE ledger_entry_history'))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return written
+
+
+def upgrade_schema():
+    """Run every upgrade step. Returns a list of human readable changes."""
+    changes = []
+    # Before the money conversion, which copies every model column into a rebuilt table
+    changes += [f'added column {name}' for name in add_missing_columns()]
+    changes += [f'converted {name} amounts to integer satang' for name in convert_money_columns()]
+    changes += [f'created index {name}' for name in create_missing_indexes()]
+    # After the money conversion: rebuilding a table drops the triggers that keep its search index current
+    changes += [f'built search index {name}' for name in search.ensure_indexes()]
+    migrated = migrate_legacy_history()
+    if migrated is not None:
+        changes.append(f'moved edit history into the audit log ({migrated} edits)')
+    return changes
@@ -0,0 +1,158 @@
+"""Full-text search over ledger entry and expense request descriptions.
+
+Each searchable table has an external-content FTS5 index (only the index is
+stored, the text stays in the table) with the trigram tokenizer: Thai is
+written without spaces between words, so instead of needing a word
+segmenter every 3-character substring is indexed and any part of a word can
+be found. SQLite triggers keep the indexes in step with every INSERT, UPDATE
+of the text columns and DELETE, whichever code path does it (forms, bulk
+approval, imports, edit_ledger_entry).
+
+A query is split on whitespace and every term must appear (in any indexed
+column). Terms of 3+ characters are answered by the index; shorter ones
+cannot be (trigrams) and are checked with LIKE on the rows the long terms
+matched, or, if the query has only short terms, by scanning the table.
+Results come newest first (highest id) and pages are keyed on the last id,
+so a page costs the same however deep it is.
+"""
+from sqlalchemy import column, literal_column, or_, table, text
+from sqlalchemy.orm import joinedload
+
+from models import db, ExpenseRequest, LedgerEntry
+
+# FTS table -> (content table, indexed columns)
+INDEXES = {
+    'ledger_entry_fts': ('ledger_entry', ('description', 'note')),
+    'expense_request_fts': ('expense_request', ('description',)),
+}
+MIN_INDEXED_TERM = 3  # trigram tokenizer: shorter terms never MATCH
+MAX_TERMS = 10
+
+
+def _statements(fts, content, columns):
+    """CREATE statements for one FTS table, keyed by object name."""
+    cols = ', '.join(columns)
+    new = ', '.join(f'new.{c}' for c in columns)
+    old = ', '.join(f'old.{c}' for c in columns)
+    delete = f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old});"
+    insert = f'INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new});'
+    return {
+        fts: f"CREATE VIRTUAL TABLE {fts} USING fts5({cols}, content='{content}', content_rowid='id', "
+             f"tokenize='trigram')",
+        f'{fts}_ai': f'CREATE TRIGGER {fts}_ai AFTER INSERT ON {content} BEGIN {insert} END',
+        f'{fts}_ad': f'CREATE TRIGGER {fts}_ad AFTER DELETE ON {content} BEGIN {delete} END',
+        f'{fts}_au': f'CREATE TRIGGER {fts}_au AFTER UPDATE OF {cols} ON {content} BEGIN {delete} {insert} END',
+    }
+
+
+def ensure_indexes(engine=None):
+    """Create missing FTS tables/triggers and (re)fill those indexes from their tables.
+
+    A table rebuilt by schema.py loses its triggers, so a missing trigger also
+    means the index may be stale and is rebuilt. Returns the FTS tables filled.
+    `engine` defaults to the app's (benchmarks/seed.py passes its own).
+    """
+    filled = []
+    with (engine or db.engine).begin() as conn:
+        existing = {name for name, in conn.execute(text("SELECT name FROM sqlite_master"))}
+        for fts, (content, columns) in INDEXES.items():
+            statements = _statements(fts, content, columns)
+            missing = [name for name in statements if name not in existing]
+            if not missing:
+                continue
+            for name in missing:
+                conn.execute(text(statements[name]))
+            conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+            filled.append(fts)
+    return filled
+
+
+def rebuild():
+    """Refill every index from its table (e.g. after editing the database outside the app)."""
+    with db.engine.begin() as conn:
+        for fts in INDEXES:
+            conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+
+
+def verify():
+    """FTS5 integrity check of every index against its table. Returns a list of problems."""
+    problems = []
+    for fts in INDEXES:
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(text(f"INSERT INTO {fts}({fts}, rank) VALUES ('integrity-check', 1)"))
+        except Exception as e:
+            problems.append(f'{fts}: {e}')
+    return problems
+
+
+def parse_query(query):
+    """Split a search string into terms: (index terms, short terms)."""
+    terms = list(dict.fromkeys((query or '').split()))[:MAX_TERMS]
+    return ([t for t in terms if len(t) >= MIN_INDEXED_TERM],
+            [t for t in terms if len(t) < MIN_INDEXED_TERM])
+
+
+def _match_expression(terms):
+    # Every term as a quoted phrase, so FTS5 syntax characters in user input are plain text
+    return ' '.join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def _like(term):
+    return '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def _search(model, fts, query, filters, before, limit, options=()):
+    """(rows, next_before) of `model` matching `query` and `filters`, newest first."""
+    columns = INDEXES[fts][1]
+    long_terms, short_terms = parse_query(query)
+    q = model.query.options(*options)
+    if long_terms:
+        index = table(fts, column('rowid'))
+        q = q.join(index, index.c.rowid == model.id).filter(
+            literal_column(fts).op('MATCH')(_match_expression(long_terms)))
+        id_column = index.c.rowid  # lets FTS5 walk its matches in id order and stop at `limit`
+    else:
+        id_column = model.id
+    for term in short_terms:
+        q = q.filter(or_(*(getattr(model, c).like(_like(term), escape='\\') for c in columns)))
+    q = q.filter(*filters)
+    if before:
+        q = q.filter(id_column < before)
+    rows = q.order_by(id_column.desc()).limit(limit + 1).all()
+    next_before = rows[limit - 1].id if len(rows) > limit else None
+    return rows[:limit], next_before
+
+
+def _amount_filters(column_, min_amount, max_amount):
+    filters = []
+    if min_amount is not None:
+        filters.append(column_ >= min_amount)
+    if max_amount is not None:
+        filters.append(column_ <= max_amount)
+    return filters
+
+
+def search_ledger(query, ledger_type=None, category=None, min_amount=None, max_amount=None,
+                  before=None, limit=50):
+    """Ledger entries whose description or note contains every term of `query`."""
+    filters = _amount_filters(LedgerEntry.amount, min_amount, max_amount)
+    if ledger_type:
+        filters.append(LedgerEntry.ledger_type == ledger_type)
+    if category:
+        filters.append(LedgerEntry.category == category)
+    return _search(LedgerEntry, 'ledger_entry_fts', query, filters, before, limit)
+
+
+def search_requests(query, account_type=None, category=None, min_amount=None, max_amount=None,
+                    requester_id=None, before=None, limit=50):
+    """Expense requests whose description contains every term of `query` (optionally one requester's)."""
+    filters = _amount_filters(ExpenseRequest.amount, min_amount, max_amount)
+    if account_type:
+        filters.append(ExpenseRequest.account_type == account_type)
+    if category:
+        filters.append(ExpenseRequest.category == category)
+    if requester_id is not None:
+        filters.append(ExpenseRequest.requester_id == requester_id)
+    return _search(ExpenseRequest, 'expense_request_fts', query, filters, before, limit,
+                   options=[joinedload(ExpenseRequest.requester)])
@@ -0,0 +1,105 @@
+"""Production entry point: the app behind a multi-worker / multi-thread WSGI server.
+
+    python serve.py                          # gunicorn on Linux/macOS, waitress on Windows
+    python serve.py --workers 4 --threads 4 --port 8000
+
+Linux/macOS: gunicorn with --workers processes of --threads threads each.
+Windows: waitress (one process, --threads threads; gunicorn does not run there).
+
+The database (with TENANCY on, every school's) is created/upgraded once,
+here, before any worker starts, instead of by every worker. With gunicorn
+the workers are forked from this process afterwards: the engines'
+connections are closed first so no worker inherits a SQLite handle, and
+each worker re-queues leftover export jobs when it boots (jobs.run() claims
+a job atomically, so it still runs once).
+
+Sessions work across workers because they all sign cookies with the same
+SECRET_KEY: from the environment, or instance/secret_key created on first
+start (see shared_secret_key in app.py). With more than one worker and no
+USER_CACHE_BACKEND set, the identity cache is shared through
+instance/user_cache.db so a role change is seen by every worker.
+
+Settings can also come from the environment: HOST, PORT, WEB_WORKERS,
+WEB_THREADS.
+"""
+import argparse
+import os
+import sys
+
+
+def default_workers():
+    # SQLite has a single writer, so more processes than this mostly queue on its lock
+    return min(2 * (os.cpu_count() or 1) + 1, 8)
+
+
+def run_gunicorn(app, args):
+    from gunicorn.app.base import BaseApplication
+
+    import jobs
+    import tenants
+
+    def post_worker_init(worker):
+        for _ in tenants.each_school(app):
+            jobs.recover()
+
+    class Server(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'{args.host}:{args.port}')
+            self.cfg.set('workers', args.workers)
+            self.cfg.set('threads', args.threads)
+            self.cfg.set('post_worker_init', post_worker_init)
+            self.cfg.set('accesslog', '-' if args.access_log else None)
+
+        def load(self):
+            return app
+
+    Server().run()
+
+
+def run_waitress(app, args):
+    from waitress import serve
+
+    import jobs
+    import tenants
+
+    requeued = sum(jobs.recover() for _ in tenants.each_school(app))
+    if requeued:
+        print(f"Re-queued {requeued} background job(s).")
+    serve(app, host=args.host, port=args.port, threads=args.threads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5000)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WEB_WORKERS', 0)) or default_workers(),
+                        help='worker processes (gunicorn only)')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('WEB_THREADS', 4)),
+                        help='threads per worker')
+    parser.add_argument('--server', choices=['gunicorn', 'waitress'],
+                        default='waitress' if sys.platform == 'win32' else 'gunicorn')
+    parser.add_argument('--access-log', action='store_true', help='log every request to stdout (gunicorn)')
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    multi_process = args.server == 'gunicorn' and args.workers > 1
+    if multi_process and 'USER_CACHE_BACKEND' not in os.environ:
+        os.environ['USER_CACHE_BACKEND'] = f"sqlite:{os.path.join('instance', 'user_cache.db')}"
+
+    from app import app, init_db
+    import tenants
+
+    init_db(recover_jobs=False)
+    with app.app_context():
+        tenants.dispose_all()
+
+    if args.server == 'gunicorn':
+        print(f"Serving on http://{args.host}:{args.port} (gunicorn, {args.workers} workers x {args.threads} threads)")
+        run_gunicorn(app, args)
+    else:
+        print(f"Serving on http://{args.host}:{args.port} (waitress, {args.threads} threads)")
+        run_waitress(app, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""SQLite settings for a multi-user deployment.
+
+configure(app) must run before db.init_app(app): it fills
+SQLALCHEMY_ENGINE_OPTIONS (pool size, driver busy timeout) and registers
+connection events that apply the pragmas below to every new connection:
+
+  journal_mode=WAL      readers never block behind a writer and vice versa
+  synchronous=NORMAL    safe with WAL; fsync only at checkpoints
+  cache_size / mmap_size  bigger page cache, memory-mapped reads
+  busy_timeout          wait for the write lock instead of failing at once
+
+Transactions are begun by us rather than by the sqlite3 driver. Views that
+write are marked with @writes('POST') (or whichever methods write); the first
+transaction of such a request starts with BEGIN IMMEDIATE, so it queues for
+the single write lock up front instead of failing with "database is locked"
+when it upgrades a read snapshot to a write. Everything else, including the
+page a POST renders after its commit, uses a plain deferred BEGIN and never
+waits. Only mark views that write soon after their first query: the lock is
+held until commit, so e.g. login (query, then a slow password hash) must not
+take it.
+
+Set SQLITE_TUNING = False to get the driver defaults back.
+"""
+import random
+import sqlite3
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULTS = {
+    'SQLITE_TUNING': True,
+    'SQLITE_JOURNAL_MODE': 'WAL',
+    'SQLITE_SYNCHRONOUS': 'NORMAL',
+    'SQLITE_CACHE_SIZE': -64000,        # negative = KiB, so 64 MB per connection
+    'SQLITE_MMAP_SIZE': 256 * 1024 * 1024,
+    'SQLITE_BUSY_TIMEOUT': 10000,       # ms
+    'SQLITE_POOL_SIZE': 10,
+}
+
+_settings = {}
+
+
+def _on_connect(dbapi_connection, connection_record):
+    if not _settings or not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    # Let the begin event below issue BEGIN, so we choose DEFERRED or IMMEDIATE
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={_settings['SQLITE_JOURNAL_MODE']}")
+    cursor.execute(f"PRAGMA synchronous={_settings['SQLITE_SYNCHRONOUS']}")
+    cursor.execute(f"PRAGMA cache_size={int(_settings['SQLITE_CACHE_SIZE'])}")
+    cursor.execute(f"PRAGMA mmap_size={int(_settings['SQLITE_MMAP_SIZE'])}")
+    cursor.execute(f"PRAGMA busy_timeout={int(_settings['SQLITE_BUSY_TIMEOUT'])}")
+    cursor.close()
+
+
+def _begin_immediate(dbapi_connection):
+    """BEGIN IMMEDIATE, polling every few ms until SQLITE_BUSY_TIMEOUT.
+
+    SQLite's own busy handler backs off to 100 ms sleeps, so under steady
+    write traffic a waiting writer keeps losing the lock to newcomers.
+    Short, jittered polls keep the wait close to the actual lock hold time.
+    """
+    deadline = time.monotonic() + _settings['SQLITE_BUSY_TIMEOUT'] / 1000
+    dbapi_connection.execute('PRAGMA busy_timeout=0')
+    try:
+        while True:
+            try:
+                dbapi_connection.execute('BEGIN IMMEDIATE')
+                return
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e) or time.monotonic() >= deadline:
+                    raise
+                time.sleep(random.uniform(0.001, 0.004))
+    finally:
+        dbapi_connection.execute(f"PRAGMA busy_timeout={int(_settings['SQLITE_BUSY_TIMEOUT'])}")
+
+
+def _wants_write_lock():
+    if not has_request_context() or 'sqlite_write_begun' in g:
+        return False
+    view = current_app.view_functions.get(request.endpoint)
+    return request.method in getattr(view, 'sqlite_write_methods', ())
+
+
+def _on_begin(conn):
+    if not _settings or conn.dialect.name != 'sqlite':
+        return
+    if _wants_write_lock():
+        g.sqlite_write_begun = True
+        _begin_immediate(conn.connection.driver_connection)
+    else:
+        conn.exec_driver_sql('BEGIN')
+
+
+def writes(*methods):
+    """Mark a view whose `methods` requests write, e.g. @writes('POST').
+
+    Goes anywhere below @app.route (functools.wraps carries the mark through
+    other decorators).
+    """
+    def decorator(view):
+        view.sqlite_write_methods = frozenset(methods or ('POST',))
+        return view
+    return decorator
+
+
+def configure(app):
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+    if not app.config['SQLITE_TUNING'] or not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        _settings.clear()
+        return
+
+    _settings.clear()
+    _settings.update({key: app.config[key] for key in DEFAULTS})
+
+    options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    options.setdefault('pool_size', app.config['SQLITE_POOL_SIZE'])
+    options.setdefault('max_overflow', app.config['SQLITE_POOL_SIZE'])
+    options.setdefault('pool_timeout', app.config['SQLITE_BUSY_TIMEOUT'] / 1000)
+    connect_args = options.setdefault('connect_args', {})
+    connect_args.setdefault('timeout', app.config['SQLITE_BUSY_TIMEOUT'] / 1000)
+    # Pooled connections move between the server's worker threads
+    connect_args.setdefault('check_same_thread', False)
+
+    if not event.contains(Engine, 'connect', _on_connect):
+        event.listen(Engine, 'connect', _on_connect)
+        event.listen(Engine, 'begin', _on_begin)
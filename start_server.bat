@@ -24,7 +24,7 @@ echo      ✓ Virtual Environment พร้อมใช้งาน
 echo.
 echo [3/4] กำลังติดตั้ง/ตรวจสอบ Dependencies...
 .venv\Scripts\python.exe -m pip install --quiet --upgrade pip >nul 2>&1
-.venv\Scripts\python.exe -m pip install --quiet Flask Flask-SQLAlchemy Flask-Login pandas openpyxl python-dateutil Werkzeug
+.venv\Scripts\python.exe -m pip install --quiet Flask Flask-SQLAlchemy Flask-Login openpyxl python-dateutil Werkzeug waitress
 if errorlevel 1 goto InstallFailed
 echo      ✓ Dependencies ติดตั้งเรียบร้อย
 
@@ -40,7 +40,7 @@ echo.
 
 timeout /t 2 /nobreak >nul
 start http://127.0.0.1:5000
-.venv\Scripts\python.exe app.py
+.venv\Scripts\python.exe serve.py
 
 echo.
 echo ระบบหยุดทำงานแล้ว กด Enter เพื่อปิด...
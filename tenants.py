@@ -0,0 +1,333 @@
+"""Several schools on one deployment: one SQLite database per school.
+
+TENANCY says how a request names its school (its slug, e.g. 'bangnamchuet'):
+
+  'off'        one school, the SQLALCHEMY_DATABASE_URI database (default)
+  'path'       https://host/school/<slug>/...   (TENANT_PATH_PREFIX)
+  'subdomain'  https://<slug>.<TENANT_DOMAIN>/...
+
+Each school has its own file, TENANT_DB_DIR/<slug>.db, created by the
+provision-school command. TenantMiddleware takes the slug off the URL (in
+path mode the prefix becomes SCRIPT_NAME, so url_for() keeps generating
+the school's URLs) and `db` (TenantSQLAlchemy) hands the current app
+context the engine of its school: db.session, db.engine, schema upgrades
+and every query in the app go to that school's database without knowing
+about schools at all. Outside a request (CLI, job threads, the district
+report) activate(slug) binds the app context; CLI commands read TENANT.
+
+Engines are pooled per school and kept in a process-wide LRU of
+TENANT_ENGINE_CACHE entries. When a new school's engine would exceed it,
+the least recently used engines with no connection checked out are
+disposed; a busy one is skipped and the cache shrinks back later.
+
+Logins are per school: the session cookie is scoped to the school's path
+(or host), and load_user only accepts a session started at the same school.
+With no school in the URL only the district-level endpoints answer: the
+list of schools, /metrics and the district report (district.py).
+"""
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import sqlalchemy as sa
+from flask import abort, current_app, g, has_app_context, has_request_context, render_template, request, session
+from flask.sessions import SecureCookieSessionInterface
+from flask_login import user_logged_in
+from flask_sqlalchemy import SQLAlchemy
+
+MODES = ('off', 'path', 'subdomain')
+SLUG_RE = re.compile(r'^[a-z0-9][a-z0-9-]{0,62}$')
+ENVIRON_KEY = 'school.tenant'
+DEFAULT_ENGINE_CACHE = 16
+# Endpoints that answer with no school selected
+DISTRICT_ENDPOINTS = {'static', 'metrics', 'district_balances'}
+
+_settings = {'mode': 'off'}
+
+
+class TenantError(Exception):
+    """Unknown, invalid or duplicate school, or no school selected where one is needed."""
+
+
+# --- Engines: one pooled engine per school, least recently used out first ---
+
+class EngineCache:
+    def __init__(self, size=DEFAULT_ENGINE_CACHE):
+        self.size = size
+        self._engines = OrderedDict()  # slug -> {None: engine}, the shape of SQLAlchemy.engines
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'opened': 0, 'evicted': 0}
+
+    def get(self, slug, create):
+        with self._lock:
+            engines = self._engines.get(slug)
+            if engines is not None:
+                self._engines.move_to_end(slug)
+                self._counters['hits'] += 1
+                return engines
+            engines = self._engines[slug] = {None: create()}
+            self._counters['opened'] += 1
+            evicted = self._evict()
+        for engine in evicted:
+            engine.dispose()
+        return engines
+
+    def _evict(self):
+        """Drop idle engines, oldest use first, until back at size. Caller holds the lock."""
+        evicted = []
+        for slug in list(self._engines)[:-1]:  # never the one just opened
+            if len(self._engines) <= self.size:
+                break
+            engine = self._engines[slug][None]
+            if engine.pool.checkedout():
+                continue  # in use by a request or job thread right now
+            del self._engines[slug]
+            evicted.append(engine)
+            self._counters['evicted'] += 1
+        return evicted
+
+    def dispose_all(self):
+        with self._lock:
+            engines = [engines[None] for engines in self._engines.values()]
+            self._engines.clear()
+        for engine in engines:
+            engine.dispose()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, open=len(self._engines), max_open=self.size,
+                        schools=list(self._engines))
+
+
+_engines = EngineCache()
+
+
+def _create_engine(slug):
+    # Checked only when the engine is opened: SQLite would create a missing file on first connect
+    if not exists(slug):
+        if has_request_context():
+            abort(404)
+        raise TenantError(f'Unknown school: {slug}')
+    # Same pool size and driver options as the single-school engine (sqlite_tuning fills them)
+    options = dict(current_app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+    return sa.create_engine(f'sqlite:///{database_path(slug)}', **options)
+
+
+class TenantSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy whose engines are those of the current app context's school."""
+
+    @property
+    def engines(self):
+        slug = current_slug()
+        if slug is None:
+            if _settings['mode'] != 'off':
+                raise TenantError('No school selected (CLI: set TENANT=<slug>)')
+            return super().engines
+        return _engines.get(slug, lambda: _create_engine(slug))
+
+
+# --- Resolving and binding the current school ---
+
+def database_path(slug):
+    return os.path.join(current_app.config['TENANT_DB_DIR'], f'{slug}.db')
+
+
+def exists(slug):
+    return bool(SLUG_RE.match(slug)) and os.path.exists(database_path(slug))
+
+
+def school_slugs():
+    """Slugs of every provisioned school, sorted."""
+    directory = current_app.config['TENANT_DB_DIR']
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name[:-3] for name in os.listdir(directory)
+                  if name.endswith('.db') and SLUG_RE.match(name[:-3]))
+
+
+def current_slug():
+    """Slug of the school this app context works on; None for a single school or the district level."""
+    if not has_app_context():
+        return None
+    if 'tenant' not in g:
+        g.tenant = _resolve()
+    return g.tenant
+
+
+def _resolve():
+    if _settings['mode'] == 'off':
+        return None
+    if has_request_context():
+        return request.environ.get(ENVIRON_KEY)
+    return current_app.config['TENANT']
+
+
+def activate(slug):
+    """Bind the current app context to a school (before its first query)."""
+    if slug is not None and not exists(slug):
+        raise TenantError(f'Unknown school: {slug}')
+    g.tenant = slug
+
+
+def each_school(app):
+    """Yield every school's slug (None for a single school) inside an app context bound to it."""
+    with app.app_context():
+        slugs = school_slugs() if app.config['TENANCY'] != 'off' else [None]
+    for slug in slugs:
+        with app.app_context():
+            activate(slug)
+            yield slug
+
+
+def create(slug):
+    """Create an empty database file for a new school. Its tables come from the caller's db.create_all()."""
+    if not SLUG_RE.match(slug or ''):
+        raise TenantError(f'Invalid school slug: {slug!r} (lowercase letters, digits and -)')
+    os.makedirs(current_app.config['TENANT_DB_DIR'], exist_ok=True)
+    try:
+        open(database_path(slug), 'x').close()  # an empty file is an empty SQLite database
+    except FileExistsError:
+        raise TenantError(f'School already exists: {slug}')
+
+
+def school_name():
+    """Name heading every page: the school's (School row), or DISTRICT_NAME with no school selected."""
+    if _settings['mode'] != 'off' and current_slug() is None:
+        return current_app.config['DISTRICT_NAME']
+    from models import db, School
+    names = current_app.extensions.setdefault('school_names', {})
+    slug = current_slug()
+    if slug not in names:
+        name = db.session.query(School.name).order_by(School.id).limit(1).scalar()
+        if name is None:
+            return current_app.config['SCHOOL_NAME']  # not provisioned yet: look again next time
+        names[slug] = name
+    return names[slug]
+
+
+def school_names():
+    """{slug: name} of every school, for the district pages. Read without opening pooled engines."""
+    names = current_app.extensions.setdefault('school_names', {})
+    result = {}
+    for slug in school_slugs():
+        if slug not in names:
+            try:
+                with sqlite3.connect(f'file:{database_path(slug)}?mode=ro', uri=True) as conn:
+                    row = conn.execute('SELECT name FROM school ORDER BY id LIMIT 1').fetchone()
+            except sqlite3.Error:
+                row = None
+            if row is None:
+                result[slug] = slug
+                continue
+            names[slug] = row[0]
+        result[slug] = names[slug]
+    return result
+
+
+def school_url(slug):
+    """Home page of a school, from the district level."""
+    if _settings['mode'] == 'subdomain':
+        port = request.host.partition(':')[2]
+        host = f"{slug}.{current_app.config['TENANT_DOMAIN']}" + (f':{port}' if port else '')
+        return f'{request.scheme}://{host}/'
+    return f"{request.script_root}{current_app.config['TENANT_PATH_PREFIX'].rstrip('/')}/{slug}/"
+
+
+def owns_session():
+    """True if the session was started at the current school (load_user refuses the others)."""
+    if _settings['mode'] == 'off':
+        return True
+    return current_slug() is not None and session.get('school') == current_slug()
+
+
+def engine_stats():
+    return _engines.stats()
+
+
+def dispose_all():
+    """Close every pooled connection, e.g. before forking server workers."""
+    _engines.dispose_all()
+    if _settings['mode'] == 'off':
+        from models import db
+        db.engine.dispose()
+
+
+# --- Request plumbing ---
+
+class TenantMiddleware:
+    """Moves the school slug from the URL into the WSGI environ (and, in path mode, into SCRIPT_NAME)."""
+
+    def __init__(self, wsgi_app, app):
+        self.wsgi_app = wsgi_app
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        mode = self.app.config['TENANCY']
+        if mode == 'path':
+            prefix = self.app.config['TENANT_PATH_PREFIX'].rstrip('/')
+            path = environ.get('PATH_INFO', '')
+            if path.startswith(prefix + '/'):
+                slug, _, rest = path[len(prefix) + 1:].partition('/')
+                if SLUG_RE.match(slug):
+                    environ[ENVIRON_KEY] = slug
+                    environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + f'{prefix}/{slug}'
+                    environ['PATH_INFO'] = '/' + rest
+        elif mode == 'subdomain':
+            host = environ.get('HTTP_HOST', '').split(':')[0].lower()
+            suffix = '.' + self.app.config['TENANT_DOMAIN'].lower()
+            slug = host[:-len(suffix)] if host.endswith(suffix) else ''
+            if SLUG_RE.match(slug):
+                environ[ENVIRON_KEY] = slug
+        return self.wsgi_app(environ, start_response)
+
+
+class TenantSessionInterface(SecureCookieSessionInterface):
+    """Session cookie scoped to the school's path prefix, so each school keeps its own login."""
+
+    def get_cookie_path(self, app):
+        if app.config['TENANCY'] == 'path' and has_request_context() and request.environ.get(ENVIRON_KEY):
+            return request.script_root
+        return super().get_cookie_path(app)
+
+
+def _remember_school(sender, user, **extra):
+    session['school'] = current_slug()
+
+
+def init_app(app):
+    app.config.setdefault('TENANCY', 'off')
+    app.config.setdefault('TENANT', None)
+    app.config.setdefault('TENANT_DB_DIR', os.path.join(app.instance_path, 'schools'))
+    app.config.setdefault('TENANT_PATH_PREFIX', '/school')
+    app.config.setdefault('TENANT_DOMAIN', 'localhost')
+    app.config.setdefault('TENANT_ENGINE_CACHE', DEFAULT_ENGINE_CACHE)
+    app.config.setdefault('SCHOOL_NAME', 'โรงเรียน')
+    app.config.setdefault('DISTRICT_NAME', 'สถานศึกษาในสังกัด')
+    if app.config['TENANCY'] not in MODES:
+        raise ValueError(f"TENANCY must be one of {', '.join(MODES)}, not {app.config['TENANCY']!r}")
+    _settings['mode'] = app.config['TENANCY']
+    _engines.size = app.config['TENANT_ENGINE_CACHE']
+
+    app.wsgi_app = TenantMiddleware(app.wsgi_app, app)
+    app.session_interface = TenantSessionInterface()
+    user_logged_in.connect(_remember_school, app)
+
+    @app.context_processor
+    def school_context():
+        return dict(school_name=school_name())
+
+    @app.before_request
+    def require_school():
+        if _settings['mode'] == 'off' or request.endpoint in DISTRICT_ENDPOINTS:
+            return None
+        slug = current_slug()
+        if slug is None:
+            if request.endpoint == 'index':
+                schools = [(name, school_url(slug)) for slug, name in school_names().items()]
+                return render_template('schools.html', schools=schools)
+            abort(404)
+        if not exists(slug):
+            abort(404)
+        return None
@@ -0,0 +1,44 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# app.py reads its configuration at import time
+_workdir = tempfile.mkdtemp(prefix='financial-tests-')
+os.environ.update(DATABASE_URI=f"sqlite:///{os.path.join(_workdir, 'test.db')}", SECRET_KEY='test',
+                  TENANCY='off', SQL_PROFILE='false')
+
+from app import app as flask_app  # noqa: E402
+from models import db  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    """App context on an empty database (all tables, no rows)."""
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+
+
+@pytest.fixture
+def client():
+    """Test client on a fresh database with the default users (password pass1234)."""
+    from app import setup_database
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+        setup_database(recover_jobs=False)
+    yield flask_app.test_client()
+    with flask_app.app_context():
+        db.session.remove()
+
+
+def login(client, username):
+    response = client.post('/login', data={'username': username, 'password': 'pass1234'})
+    assert response.status_code == 302, response.status_code
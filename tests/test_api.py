@@ -0,0 +1,38 @@
+from datetime import date
+
+import pytest
+
+from conftest import login
+
+FUTURE = 'Sun, 01 Jan 2040 00:00:00 GMT'
+
+
+@pytest.mark.parametrize('path', [
+    '/api/v1/balances',
+    '/api/v1/ledgers/subsidy/entries',
+    '/api/v1/ledgers/subsidy/balance',
+    '/api/v1/approvals/pending',
+    '/api/v1/requests/1',
+])
+def test_etag_only_validation(client, path):
+    login(client, 'finance')
+    if path.endswith('/requests/1'):
+        client.post('/request', data={'amount': '10', 'description': 'x', 'account_type': 'เงินอุดหนุนอื่น',
+                                      'date': date.today().isoformat(), 'category': 'อื่นๆ'})
+    response = client.get(path)
+    assert response.status_code == 200
+    assert 'Last-Modified' not in response.headers
+    assert client.get(path, headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+    # A date alone never produces 304: it cannot tell two changes in the same second apart
+    assert client.get(path, headers={'If-Modified-Since': FUTURE}).status_code == 200
+
+
+def test_entry_in_the_same_second_changes_the_etag(client):
+    login(client, 'finance')
+    path = '/api/v1/ledgers/subsidy/entries'
+    etag = client.get(path).headers['ETag']
+    client.post('/ledger/subsidy', data={'date': date.today().isoformat(), 'amount': '250.50',
+                                         'category': 'อื่นๆ', 'transaction_type': 'Income', 'description': 'x'})
+    response = client.get(path, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert [entry['amount'] for entry in response.json['entries']] == ['250.50']
@@ -0,0 +1,64 @@
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from app import app, BULK_APPROVAL_LIMIT
+from models import db, User, ExpenseRequest
+from conftest import login
+
+
+@pytest.fixture
+def request_ids(client):
+    with app.app_context():
+        teacher = User.query.filter_by(username='teacher').one()
+        requests = [ExpenseRequest(requester_id=teacher.id, date=date(2026, 10, 1), amount=Decimal('10.00'),
+                                   account_type='Subsidy', category='อื่นๆ') for _ in range(3)]
+        db.session.add_all(requests)
+        db.session.commit()
+        return [req.id for req in requests]
+
+
+def approved_by_finance():
+    with app.app_context():
+        return sorted(req.id for req in ExpenseRequest.query.filter(ExpenseRequest.finance_approved_at.isnot(None)))
+
+
+def test_bulk_approval_reports_each_request(client, request_ids):
+    login(client, 'finance')
+    response = client.post('/approve/bulk', json={'req_ids': request_ids + [request_ids[0], 999]})
+    assert response.status_code == 200
+    assert [(r['id'], r['outcome']) for r in response.json['results']] == \
+        [(req_id, 'approved') for req_id in request_ids] + [(999, 'not_found')]
+    assert approved_by_finance() == request_ids
+
+
+@pytest.mark.parametrize('body', [
+    {'req_ids': '123'},            # a string is not a list of ids
+    {'req_ids': [1, 'x']},
+    {'req_ids': [1, 2.5]},
+    {'req_ids': [True]},
+    {'req_ids': None},
+    {},
+    [1, 2, 3],
+])
+def test_bulk_approval_rejects_malformed_ids(client, request_ids, body):
+    login(client, 'finance')
+    response = client.post('/approve/bulk', json=body)
+    assert response.status_code == 400
+    assert approved_by_finance() == []
+
+
+def test_bulk_approval_form_rejects_non_integer_ids(client, request_ids):
+    login(client, 'finance')
+    response = client.post('/approve/bulk', data={'req_ids': [str(request_ids[0]), 'abc']})
+    assert response.status_code == 302
+    assert approved_by_finance() == []
+
+
+def test_bulk_approval_over_the_limit_is_refused(client, request_ids):
+    login(client, 'finance')
+    ids = request_ids + list(range(10_000, 10_000 + BULK_APPROVAL_LIMIT))
+    response = client.post('/approve/bulk', json={'req_ids': ids})
+    assert response.status_code == 413
+    assert approved_by_finance() == []
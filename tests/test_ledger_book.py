@@ -0,0 +1,136 @@
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pytest
+
+from models import db, LedgerEntry, LedgerDailyBalance, LedgerCategoryTotal
+import ledger_book
+import periods
+from ledger_export import LedgerExport
+from money import ZERO
+
+START = date(2025, 9, 1)  # spans the October fiscal year boundary
+CATEGORIES = ['ค่าอาหาร', 'ค่าวัสดุ', 'อื่นๆ']
+
+
+def add_entry(day, amount, transaction_type='Income', ledger_type='Subsidy', category='อื่นๆ'):
+    entry = LedgerEntry(date=day, amount=Decimal(amount), ledger_type=ledger_type, category=category,
+                        transaction_type=transaction_type)
+    db.session.add(entry)
+    ledger_book.record_entry(entry)
+    db.session.commit()
+    return entry
+
+
+def change_amount(entry, amount):
+    old_amount = entry.amount
+    entry.amount = Decimal(amount)
+    ledger_book.record_amount_change(entry, old_amount)
+    db.session.commit()
+
+
+def entry_sums(ledger_type):
+    """(income, expense) straight from the entries, in Python."""
+    income = expense = ZERO
+    for entry in LedgerEntry.query.filter_by(ledger_type=ledger_type):
+        if entry.transaction_type == 'Income':
+            income += entry.amount
+        else:
+            expense += entry.amount
+    return income, expense
+
+
+def random_amount(rng):
+    return Decimal(rng.randint(1, 5_000_000)).scaleb(-2)  # 0.01 .. 50,000.00
+
+
+def test_record_entry_updates_both_tables(app):
+    add_entry(date(2025, 9, 30), '100.10')
+    add_entry(date(2025, 9, 30), '0.20', 'Expense', category='ค่าวัสดุ')
+    add_entry(date(2025, 10, 1), '0.01')
+
+    day = LedgerDailyBalance.query.filter_by(ledger_type='Subsidy', date=date(2025, 9, 30)).one()
+    assert (day.income, day.expense) == (Decimal('100.10'), Decimal('0.20'))
+    # 30 Sep and 1 Oct fall in different fiscal years
+    years = {row.fiscal_year for row in LedgerCategoryTotal.query}
+    assert years == {2568, 2569}
+    assert ledger_book.verify_balances() == []
+
+
+def test_amount_changes_keep_totals_exact(app):
+    entry = add_entry(date(2026, 1, 5), '1000.00', 'Expense')
+    change_amount(entry, '999.99')
+    change_amount(entry, '999.99')  # no-op edit
+    assert ledger_book.verify_balances() == []
+    assert ledger_book.period_totals('Subsidy', date(2026, 1, 1), date(2026, 1, 31)) == (ZERO, Decimal('999.99'))
+    change_amount(entry, '0.01')
+    assert ledger_book.verify_balances() == []
+    assert ledger_book.period_totals('Subsidy', date(2026, 1, 1), date(2026, 1, 31)) == (ZERO, Decimal('0.01'))
+
+
+def test_archiving_entries_keeps_totals_exact(app):
+    # Archiving is the one path that deletes rows from ledger_entry
+    rng = random.Random(8)
+    for _ in range(60):
+        add_entry(START + timedelta(days=rng.randrange(90)), random_amount(rng), rng.choice(['Income', 'Expense']))
+    before = ledger_book.period_totals('Subsidy', START, START + timedelta(days=90))
+
+    periods.close_through('Subsidy', date(2025, 10, 1), None, today=date(2026, 1, 1))
+    moved = periods.archive_through('Subsidy', date(2025, 10, 1))
+    db.session.commit()
+
+    assert moved and LedgerEntry.query.filter(LedgerEntry.date < date(2025, 11, 1)).count() == 0
+    assert ledger_book.verify_balances() == []
+    assert periods.verify() == []
+    assert ledger_book.period_totals('Subsidy', START, START + timedelta(days=90)) == before
+
+
+def test_random_history_matches_verify_to_the_satang(app):
+    rng = random.Random(6)
+    entries = []
+    for _ in range(400):
+        if rng.random() < 0.7 or not entries:
+            entries.append(add_entry(
+                START + timedelta(days=rng.randrange(120)), random_amount(rng),
+                rng.choice(['Income', 'Expense']), rng.choice(list(ledger_book.LEDGER_TYPES.values())),
+                rng.choice(CATEGORIES)))
+        else:
+            change_amount(rng.choice(entries), random_amount(rng))
+
+    assert ledger_book.verify_balances() == []
+    for ledger_type in ledger_book.LEDGER_TYPES.values():
+        assert ledger_book.period_totals(ledger_type, START, START + timedelta(days=120)) == entry_sums(ledger_type)
+
+
+def test_verify_balances_reports_a_drifted_table(app):
+    add_entry(date(2026, 2, 1), '10.00')
+    row = LedgerDailyBalance.query.one()
+    row.income += Decimal('0.01')
+    db.session.commit()
+
+    problems = ledger_book.verify_balances()
+    assert len(problems) == 1 and '2026-02-01' in problems[0]
+    ledger_book.rebuild_balances()
+    assert ledger_book.verify_balances() == []
+
+
+@pytest.mark.parametrize('batch_size', [1, 7, 1000])
+def test_export_running_balance_matches_sum_of_entries(app, batch_size):
+    rng = random.Random(batch_size)
+    for _ in range(150):
+        add_entry(START + timedelta(days=rng.randrange(90)), random_amount(rng),
+                  rng.choice(['Income', 'Income', 'Expense']))
+
+    export = LedgerExport('Subsidy', 'test', START, START + timedelta(days=29), batch_size=batch_size)
+    rows = list(export.rows())
+    assert export.row_count == len(rows) == 150
+
+    balance = ZERO
+    for row in rows:
+        income, expense = row[4], row[5]
+        balance += (income or ZERO) - (expense or ZERO)
+        assert row[6] == balance  # running balance, exact on every row
+    income, expense = entry_sums('Subsidy')
+    assert export.balance == balance == income - expense
+    assert export.summary_rows()[-1] == ['เงินคงเหลือสุทธิ', income - expense]
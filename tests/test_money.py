@@ -0,0 +1,84 @@
+from decimal import Decimal
+
+import pytest
+
+from money import ZERO, MAX_AMOUNT, amount_in_range, format_satang, from_satang, parse_amount, to_satang
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('100', Decimal('100.00')),
+    (' 1,234.5 ', Decimal('1234.50')),
+    ('0.005', Decimal('0.01')),    # half up, not banker's rounding
+    ('0.015', Decimal('0.02')),
+    ('2.675', Decimal('2.68')),    # 2.67499... as a float
+    ('-12.345', Decimal('-12.35')),
+    (7, Decimal('7.00')),
+])
+def test_parse_amount_rounds_to_satang(text, expected):
+    amount = parse_amount(text)
+    assert amount == expected
+    assert amount.as_tuple().exponent == -2
+
+
+@pytest.mark.parametrize('text', ['nan', 'NaN', 'inf', '-Infinity', '1e30', '-1e40', 'abc', '', '1.2.3', None])
+def test_parse_amount_rejects_with_value_error(text):
+    with pytest.raises(ValueError):
+        parse_amount(text)
+
+
+@pytest.mark.parametrize('value, satang', [
+    (Decimal('1234.56'), 123456),
+    (Decimal('0.005'), 1),
+    (0.1 + 0.2, 30),               # float artefacts never reach storage
+    (2.675, 268),
+    ('99999999.99', 9999999999),
+    (-5, -500),
+])
+def test_to_satang(value, satang):
+    assert to_satang(value) == satang
+
+
+def test_satang_round_trip():
+    for satang in (0, 1, 99, 100, 123456, -250, 10_000_000_000):
+        assert to_satang(from_satang(satang)) == satang
+    for text in ('0.01', '0.10', '1234.56', '99999999.99'):
+        assert from_satang(to_satang(parse_amount(text))) == Decimal(text)
+
+
+def test_sum_of_tenths_is_exact():
+    # 0.1 added ten thousand times: float drifts, satang does not
+    total = sum(to_satang(0.1) for _ in range(10_000))
+    assert from_satang(total) == Decimal('1000.00')
+    assert sum(0.1 for _ in range(10_000)) != 1000.0
+
+
+@pytest.mark.parametrize('satang, text', [
+    (0, '0.00'), (5, '0.05'), (123456789, '1,234,567.89'), (-150, '-1.50'),
+])
+def test_format_satang(satang, text):
+    assert format_satang(satang) == text
+
+
+def test_amount_in_range():
+    assert amount_in_range(Decimal('0.01'))
+    assert amount_in_range(MAX_AMOUNT)
+    assert not amount_in_range(ZERO)
+    assert not amount_in_range(Decimal('-1.00'))
+    assert not amount_in_range(MAX_AMOUNT + Decimal('0.01'))
+
+
+def test_money_column_round_trip(app):
+    from models import db, LedgerEntry
+    from datetime import date
+
+    amounts = [Decimal('0.01'), Decimal('1234.56'), Decimal('99999999.99'), Decimal('0.10')]
+    db.session.add_all(LedgerEntry(date=date(2026, 1, 5), amount=amount, ledger_type='Subsidy',
+                                   category='อื่นๆ', transaction_type='Income') for amount in amounts)
+    db.session.commit()
+    db.session.expire_all()
+
+    stored = [entry.amount for entry in LedgerEntry.query.order_by(LedgerEntry.id)]
+    assert stored == amounts
+    assert all(isinstance(amount, Decimal) for amount in stored)
+    raw = db.session.execute(db.text('SELECT amount FROM ledger_entry ORDER BY id')).scalars().all()
+    assert raw == [1, 123456, 9999999999, 10]  # integer satang on disk
@@ -0,0 +1,92 @@
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from models import db, LedgerEntry, ExpenseRequest, LedgerDailyBalance
+import ledger_book
+import schema
+
+# Shape of the tables before amounts moved to integer satang (amounts as FLOAT baht)
+LEGACY_TABLES = {
+    'expense_request': """CREATE TABLE expense_request (
+        id INTEGER NOT NULL PRIMARY KEY, requester_id INTEGER NOT NULL, date DATE NOT NULL,
+        amount FLOAT NOT NULL, description VARCHAR(500), account_type VARCHAR(50) NOT NULL,
+        status VARCHAR(20), finance_approver_id INTEGER, finance_approved_at DATETIME,
+        director_approver_id INTEGER, director_approved_at DATETIME)""",
+    'ledger_entry': """CREATE TABLE ledger_entry (
+        id INTEGER NOT NULL PRIMARY KEY, date DATE NOT NULL, amount FLOAT NOT NULL,
+        description VARCHAR(255), note VARCHAR(255), ledger_type VARCHAR(50) NOT NULL,
+        category VARCHAR(100) NOT NULL, transaction_type VARCHAR(20) NOT NULL,
+        expense_request_id INTEGER, created_by_id INTEGER, created_at DATETIME)""",
+    'ledger_daily_balance': """CREATE TABLE ledger_daily_balance (
+        ledger_type VARCHAR(50) NOT NULL, date DATE NOT NULL, income FLOAT NOT NULL, expense FLOAT NOT NULL,
+        PRIMARY KEY (ledger_type, date))""",
+}
+
+# float the legacy app stored -> what the Money column must hold after the upgrade
+AMOUNTS = [
+    (0.1, Decimal('0.10')),
+    (0.29, Decimal('0.29')),              # 28.999999999999996 satang as a float
+    (1234.565, Decimal('1234.57')),
+    (1.005, Decimal('1.01')),             # 100.49999999999999 satang: half up on the typed value
+    (2.675, Decimal('2.68')),
+    (0.1 + 0.2, Decimal('0.30')),         # float sums stored by the old balance code
+    (99999999.99, Decimal('99999999.99')),
+    (250, Decimal('250.00')),             # integers stored in a FLOAT column
+]
+
+
+@pytest.fixture
+def legacy_db(app):
+    """The current schema, except the money tables in their FLOAT shape, filled with AMOUNTS."""
+    with db.engine.begin() as conn:
+        for table, ddl in LEGACY_TABLES.items():
+            conn.exec_driver_sql(f'DROP TABLE {table}')
+            conn.exec_driver_sql(ddl)
+        for i, (value, _) in enumerate(AMOUNTS, start=1):
+            conn.exec_driver_sql(
+                "INSERT INTO expense_request (id, requester_id, date, amount, account_type, status) "
+                "VALUES (?, 1, '2026-01-05', ?, 'เงินอุดหนุนอื่น', 'PENDING')", (i, value))
+            conn.exec_driver_sql(
+                "INSERT INTO ledger_entry (id, date, amount, ledger_type, category, transaction_type) "
+                "VALUES (?, ?, ?, 'Subsidy', 'อื่นๆ', 'Income')", (i, f'2026-01-{i:02d}', value))
+            conn.exec_driver_sql(
+                "INSERT INTO ledger_daily_balance (ledger_type, date, income, expense) "
+                "VALUES ('Subsidy', ?, ?, 0.0)", (f'2026-01-{i:02d}', value))
+    db.engine.dispose()  # fresh connections, as on a start against an old database file
+    return app
+
+
+def declared_types(table):
+    with db.engine.connect() as conn:
+        return {row[1]: row[2] for row in conn.exec_driver_sql(f'PRAGMA table_info({table})')}
+
+
+def test_convert_money_columns_to_satang(legacy_db):
+    changes = schema.upgrade_schema()
+    assert {'converted expense_request amounts to integer satang',
+            'converted ledger_entry amounts to integer satang',
+            'converted ledger_daily_balance amounts to integer satang'} <= set(changes)
+
+    expected = [amount for _, amount in AMOUNTS]
+    assert [e.amount for e in LedgerEntry.query.order_by(LedgerEntry.id)] == expected
+    assert [r.amount for r in ExpenseRequest.query.order_by(ExpenseRequest.id)] == expected
+    assert [d.income for d in LedgerDailyBalance.query.order_by(LedgerDailyBalance.date)] == expected
+    assert declared_types('ledger_entry')['amount'] == 'INTEGER'
+    assert declared_types('ledger_daily_balance')['expense'] == 'INTEGER'
+    with db.engine.connect() as conn:
+        raw = conn.exec_driver_sql('SELECT amount, typeof(amount) FROM ledger_entry ORDER BY id').all()
+    assert raw == [(int(amount * 100), 'integer') for amount in expected]
+
+    # The rebuilt tables keep their indexes, and the totals agree with the converted entries
+    assert 'ix_ledger_entry_type_date' in {ix['name'] for ix in db.inspect(db.engine).get_indexes('ledger_entry')}
+    ledger_book.rebuild_balances()
+    assert ledger_book.verify_balances() == []
+    assert ledger_book.period_totals('Subsidy', date(2026, 1, 1), date(2026, 1, 31)) == (sum(expected), 0)
+
+
+def test_convert_money_columns_runs_once(legacy_db):
+    schema.upgrade_schema()
+    assert schema.convert_money_columns() == []
+    assert db.session.get(LedgerEntry, 1).amount == Decimal('0.10')
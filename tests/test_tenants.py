@@ -0,0 +1,49 @@
+import pytest
+
+from models import School
+import tenants
+
+
+@pytest.fixture
+def path_tenancy(app, tmp_path, monkeypatch):
+    """TENANCY=path with an empty TENANT_DB_DIR for the duration of a test."""
+    monkeypatch.setitem(app.config, 'TENANCY', 'path')
+    monkeypatch.setitem(app.config, 'TENANT_DB_DIR', str(tmp_path / 'schools'))
+    monkeypatch.setitem(tenants._settings, 'mode', 'path')
+    monkeypatch.setitem(app.extensions, 'school_names', {})
+    yield app
+    tenants.dispose_all()
+
+
+def provision(app, *args):
+    result = app.test_cli_runner().invoke(args=['provision-school', *args])
+    assert result.exit_code == 0, result.output
+    return result
+
+
+def name_of(app, slug):
+    with app.app_context():
+        tenants.activate(slug)
+        return School.query.one().name
+
+
+def test_provision_names_a_new_school(path_tenancy):
+    provision(path_tenancy, 'alpha', '--name', 'โรงเรียนอัลฟา')
+    assert tenants.school_slugs() == ['alpha']
+    assert name_of(path_tenancy, 'alpha') == 'โรงเรียนอัลฟา'
+
+
+def test_provision_copy_takes_the_new_name(path_tenancy):
+    provision(path_tenancy, 'alpha', '--name', 'โรงเรียนอัลฟา')
+    source = tenants.database_path('alpha')
+    provision(path_tenancy, 'beta', '--name', 'โรงเรียนเบตา', '--copy-from', source)
+
+    assert name_of(path_tenancy, 'beta') == 'โรงเรียนเบตา'
+    assert name_of(path_tenancy, 'alpha') == 'โรงเรียนอัลฟา'  # the source is untouched
+
+
+def test_provision_refuses_a_duplicate(path_tenancy):
+    provision(path_tenancy, 'alpha', '--name', 'โรงเรียนอัลฟา')
+    result = path_tenancy.test_cli_runner().invoke(args=['provision-school', 'alpha', '--name', 'อื่น'])
+    assert result.exit_code != 0
+    assert name_of(path_tenancy, 'alpha') == 'โรงเรียนอัลฟา'
@@ -0,0 +1,279 @@
+"""Identity cache for Flask-Login's user_loader.
+
+load_user runs on every authenticated request. Instead of a SELECT on the
+user table each time, the loader keeps a small identity record (id,
+username, name, role) per user id in a TTL cache and returns a detached
+CachedUser built from it. The password hash is never cached.
+
+Entries are invalidated after any commit that updates or deletes a User
+through the ORM. With several worker processes, point USER_CACHE_BACKEND at
+a shared store ('file:<directory>' or 'sqlite:<path>') so an invalidation
+in one worker is seen by all of them; the default 'memory' store is
+per-process. With several schools (tenants.py) each school gets a store of
+its own, since user ids repeat across their databases: a memory cache, a
+subdirectory or a table per school. Bulk Query.update()/delete() on User
+bypasses the ORM events, so call invalidate() (or clear()) yourself after one.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import User
+import tenants
+
+DEFAULT_TTL = 300
+DEFAULT_SIZE = 1024
+
+
+class CachedUser(UserMixin):
+    """Read-only stand-in for User, enough for current_user in views and templates."""
+
+    def __init__(self, id, username, name, role):
+        self.id = id
+        self.username = username
+        self.name = name
+        self.role = role
+
+    def __repr__(self):
+        return f'<CachedUser {self.id} {self.username}>'
+
+
+def _identity(user):
+    return {'id': user.id, 'username': user.username, 'name': user.name, 'role': user.role}
+
+
+# --- Backends: get(key) -> dict or None, set(key, value, ttl), delete(key), clear() ---
+
+class MemoryBackend:
+    """Per-process LRU dict with expiry times."""
+
+    def __init__(self, size=DEFAULT_SIZE):
+        self.size = size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class FileBackend:
+    """One small JSON file per user in a directory shared by all workers."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'user-{int(key)}.json')
+
+    def get(self, key):
+        try:
+            with open(self._path(key), encoding='utf-8') as f:
+                item = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if item['expires_at'] < time.time():
+            return None
+        return item['value']
+
+    def set(self, key, value, ttl):
+        path = self._path(key)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'expires_at': time.time() + ttl, 'value': value}, f)
+        os.replace(tmp, path)  # atomic, so readers never see half a file
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.startswith('user-') and name.endswith('.json'):
+                self.delete(name[len('user-'):-len('.json')])
+
+
+class SQLiteBackend:
+    """Key/value table in its own SQLite file (not the application database)."""
+
+    def __init__(self, path, table='user_cache'):
+        self.path = path
+        self.table = table
+        self._local = threading.local()
+        self._connect().execute(
+            f'CREATE TABLE IF NOT EXISTS {table} '
+            '(user_id INTEGER PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)'
+        )
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute(
+            f'SELECT value FROM {self.table} WHERE user_id = ? AND expires_at >= ?', (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value, ttl):
+        self._connect().execute(
+            f'INSERT OR REPLACE INTO {self.table} (user_id, value, expires_at) VALUES (?, ?, ?)',
+            (key, json.dumps(value), time.time() + ttl)
+        )
+
+    def delete(self, key):
+        self._connect().execute(f'DELETE FROM {self.table} WHERE user_id = ?', (key,))
+
+    def clear(self):
+        self._connect().execute(f'DELETE FROM {self.table}')
+
+
+def make_backend(spec, size=DEFAULT_SIZE, school=None):
+    """'memory', 'file:<directory>' or 'sqlite:<path>' -> backend instance (for one school, if given)."""
+    kind, _, location = spec.partition(':')
+    if kind == 'memory':
+        return MemoryBackend(size)
+    if kind == 'file' and location:
+        return FileBackend(os.path.join(location, school) if school else location)
+    if kind == 'sqlite' and location:
+        # School slugs are [a-z0-9-], so this is a valid, unique table name
+        return SQLiteBackend(location, f"user_cache_{school.replace('-', '_')}" if school else 'user_cache')
+    raise ValueError(f'unknown USER_CACHE_BACKEND: {spec!r}')
+
+
+# --- The cache itself ---
+
+_backends = {}  # school slug (None: single school) -> backend
+_backends_lock = threading.Lock()
+_config = {'spec': 'memory', 'size': DEFAULT_SIZE}
+_ttl = DEFAULT_TTL
+_counters = {'hits': 0, 'misses': 0, 'invalidations': 0}
+_counters_lock = threading.Lock()
+
+
+def _count(name):
+    with _counters_lock:
+        _counters[name] += 1
+
+
+def _backend():
+    school = tenants.current_slug()
+    backend = _backends.get(school)
+    if backend is None:
+        with _backends_lock:
+            backend = _backends.get(school)
+            if backend is None:
+                backend = _backends[school] = make_backend(_config['spec'], _config['size'], school)
+    return backend
+
+
+def load(user_id):
+    """user_loader body: cached identity, or one SELECT on a miss."""
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    backend = _backend()
+    identity = backend.get(user_id)
+    if identity is not None:
+        _count('hits')
+        return CachedUser(**identity)
+    _count('misses')
+    user = User.query.get(user_id)
+    if user is None:
+        return None
+    identity = _identity(user)
+    backend.set(user_id, identity, _ttl)
+    return CachedUser(**identity)
+
+
+def invalidate(user_id):
+    _count('invalidations')
+    _backend().delete(int(user_id))
+
+
+def clear():
+    """Empty the current school's store."""
+    _backend().clear()
+
+
+def stats():
+    """Hit/miss counters of this process."""
+    with _counters_lock:
+        counters = dict(_counters)
+    lookups = counters['hits'] + counters['misses']
+    counters['hit_ratio'] = round(counters['hits'] / lookups, 4) if lookups else None
+    counters['backend'] = type(_backend()).__name__
+    return counters
+
+
+# --- Invalidation: remember changed users on flush, drop them once the commit lands ---
+
+def _remember(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault('user_cache_dirty', set()).add(target.id)
+
+
+def _after_commit(session):
+    for user_id in session.info.pop('user_cache_dirty', ()):
+        invalidate(user_id)
+
+
+def _after_rollback(session):
+    session.info.pop('user_cache_dirty', None)
+
+
+def init_app(app):
+    global _ttl
+    app.config.setdefault('USER_CACHE_BACKEND', 'memory')
+    app.config.setdefault('USER_CACHE_TTL', DEFAULT_TTL)
+    app.config.setdefault('USER_CACHE_SIZE', DEFAULT_SIZE)
+    make_backend(app.config['USER_CACHE_BACKEND'])  # fail at startup on a bad spec
+    _config.update(spec=app.config['USER_CACHE_BACKEND'], size=app.config['USER_CACHE_SIZE'])
+    with _backends_lock:
+        _backends.clear()
+    _ttl = app.config['USER_CACHE_TTL']
+
+    if not event.contains(User, 'after_update', _remember):
+        event.listen(User, 'after_update', _remember)
+        event.listen(User, 'after_delete', _remember)
+        event.listen(Session, 'after_commit', _after_commit)
+        event.listen(Session, 'after_rollback', _after_rollback)